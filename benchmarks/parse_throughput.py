@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+    Parser throughput benchmark - compares MB/s of the "fast" and
+    "legacy" PatchSet.parse() engines.
+
+    Usage:
+        python benchmarks/parse_throughput.py [patch file ...]
+
+    Without arguments a synthetic multi-file git patch is generated.
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import sys
+import time
+from io import StringIO
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pypatch_url import patch as pypatch
+
+
+def generate_patch(files=2000, hunks=5, context=3, changes=4):
+    """Return text of a synthetic git patch"""
+    out = []
+    for f in range(files):
+        name = 'pkg/module_%d.py' % f
+        out.append('diff --git a/%s b/%s\n' % (name, name))
+        out.append('index 1234567..89abcde 100644\n')
+        out.append('--- a/%s\n' % name)
+        out.append('+++ b/%s\n' % name)
+        for h in range(hunks):
+            start = 1 + h * 50
+            size = 2 * context + changes
+            out.append('@@ -%d,%d +%d,%d @@ def function_%d():\n' % (start, size, start, size, h))
+            for c in range(context):
+                out.append('     value_%d = compute(%d)\n' % (c, c))
+            for c in range(changes):
+                out.append('-    result_%d = old_call(value_%d)\n' % (c, c))
+            for c in range(changes):
+                out.append('+    result_%d = new_call(value_%d)\n' % (c, c))
+            for c in range(context):
+                out.append('     return_%d = finish(%d)\n' % (c, c))
+    return ''.join(out)
+
+
+def measure(text, engine, repeat):
+    """Return best time of `repeat` parses of `text` with `engine`"""
+    best = None
+    for _ in range(repeat):
+        stream = StringIO(text)
+        started = time.perf_counter()
+        ps = pypatch.PatchSet()
+        ps.parse(stream, engine=engine)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare parser engine throughput.')
+    parser.add_argument('patches', nargs='*', help='patch files to parse (synthetic patch if omitted)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='number of runs, best one is reported')
+    parser.add_argument('--min-speedup', type=float, default=2.0,
+                        help='exit with error if fast engine is slower than this (default: 2.0x)')
+    args = parser.parse_args()
+
+    logging.getLogger('pypatch.patch').setLevel(logging.CRITICAL)
+
+    if args.patches:
+        inputs = []
+        for filename in args.patches:
+            with open(filename, 'r', encoding='utf-8', errors='replace') as fp:
+                inputs.append((filename, fp.read()))
+    else:
+        inputs = [('synthetic', generate_patch())]
+
+    success = True
+    for name, text in inputs:
+        size = len(text.encode('utf-8')) / (1024.0 * 1024.0)
+        legacy = measure(text, 'legacy', args.repeat)
+        fast = measure(text, 'fast', args.repeat)
+        print('%s (%.1f MB)' % (name, size))
+        print('  legacy: %8.1f MB/s' % (size / legacy))
+        print('  fast:   %8.1f MB/s  (%.1fx)' % (size / fast, legacy / fast))
+        if legacy / fast < args.min_speedup:
+            print('  below target of %.1fx' % args.min_speedup)
+            success = False
+
+    sys.exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()
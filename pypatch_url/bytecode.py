@@ -0,0 +1,148 @@
+"""
+    Bytecode of patched python files.
+
+    Bytecode cached in __pycache__ is stale once a file is patched,
+    and unchecked hash based .pyc files would even be imported as
+    they are. recompile() removes cached bytecode of patched files
+    and compiles them again (in worker processes), keeping the
+    invalidation mode of the removed .pyc files, so syntax errors
+    made by a patch are found at once. Bytecode that can't be
+    removed or written (e.g. read-only __pycache__) is only warned
+    about, as the patch is applied already.
+
+    Available under the terms of MIT license
+"""
+
+import importlib.util
+import logging
+import os
+import py_compile
+import sys
+
+logger = logging.getLogger('pypatch.patch')
+
+debug = logger.debug
+warning = logger.warning
+
+# optimization levels with their own .pyc file, see
+# importlib.util.cache_from_source()
+OPTIMIZATIONS = ('', 1, 2)
+
+# hash based .pyc files (PEP 552) need Python 3.7
+PycInvalidationMode = getattr(py_compile, 'PycInvalidationMode', None)
+
+
+def _pycmode(cfile):
+    """ return py_compile.PycInvalidationMode of .pyc file `cfile`,
+        or None if it does not exist or is not valid, or there are
+        no invalidation modes (Python 3.6)
+    """
+    if PycInvalidationMode is None:
+        return None
+    try:
+        with open(cfile, "rb") as f:
+            header = f.read(16)
+    except OSError:
+        return None
+    if len(header) < 16 or header[:4] != importlib.util.MAGIC_NUMBER:
+        return None
+    flags = int.from_bytes(header[4:8], "little")
+    if not flags & 1:
+        return PycInvalidationMode.TIMESTAMP
+    if flags & 2:
+        return PycInvalidationMode.CHECKED_HASH
+    return PycInvalidationMode.UNCHECKED_HASH
+
+
+def invalidate(filename):
+    """ remove cached bytecode of source `filename`, return list of
+        (optimization, invalidation mode) of removed .pyc files
+    """
+    removed = []
+    for optimization in OPTIMIZATIONS:
+        cfile = importlib.util.cache_from_source(filename, optimization=optimization)
+        mode = _pycmode(cfile)
+        try:
+            os.unlink(cfile)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        except OSError as e:
+            warning("unable to remove stale bytecode %s (%s)" % (cfile, e))
+            continue
+        debug("removed stale bytecode %s" % cfile)
+        removed.append((optimization, mode))
+    return removed
+
+
+def _compile(filename, levels):
+    """ compile `filename` to .pyc for (optimization, invalidation
+        mode) `levels`, or only check its syntax if there are none.
+        Mode None is the default of py_compile (which is taken from
+        SOURCE_DATE_EPOCH environment variable).
+
+        return tuple (error message or None, list of warnings about
+        files that can't be read or written), warnings are logged
+        by the caller as this may run in a worker process
+    """
+    if not levels:
+        try:
+            with open(filename, "rb") as f:
+                compile(f.read(), filename, "exec", dont_inherit=True)
+        except (SyntaxError, ValueError) as e:
+            return "%s: %s" % (type(e).__name__, e), []
+        except OSError as e:
+            return None, ["unable to check syntax of %s (%s)" % (filename, e)]
+        return None, []
+    warnings = []
+    for optimization, mode in levels:
+        cfile = importlib.util.cache_from_source(filename, optimization=optimization)
+        options = {} if mode is None else dict(invalidation_mode=mode)
+        try:
+            py_compile.compile(filename, cfile=cfile, doraise=True, optimize=optimization or 0, **options)
+        except py_compile.PyCompileError as e:
+            return e.msg.strip(), warnings
+        except OSError as e:
+            # syntax is checked before the .pyc file is written
+            warnings.append("unable to write bytecode %s (%s)" % (cfile, e))
+    return None, warnings
+
+
+def recompile(filenames, workers=None):
+    """ remove cached bytecode of .py files among `filenames` and
+        compile them again with a pool of `workers` processes. Files
+        without cached bytecode are compiled for the default
+        optimization level. With sys.dont_write_bytecode (e.g.
+        PYTHONDONTWRITEBYTECODE) nothing is written, the files are
+        only checked for syntax errors.
+
+        return list of (filename, error message) for files that do
+        not compile. Bytecode that can't be removed or written is
+        only logged.
+    """
+    jobs = []
+    for filename in filenames:
+        if not filename.endswith(".py"):
+            continue
+        levels = invalidate(filename)
+        if sys.dont_write_bytecode:
+            levels = []
+        elif not levels:
+            levels = [('', None)]
+        jobs.append((filename, levels))
+
+    if len(jobs) > 1 and workers != 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        debug("compiling %d files with %s workers" % (len(jobs), workers or "all"))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_compile, *zip(*jobs)))
+    else:
+        results = [_compile(filename, levels) for filename, levels in jobs]
+
+    errors = []
+    for (filename, _), (error, warnings) in zip(jobs, results):
+        for message in warnings:
+            warning(message)
+        if error:
+            errors.append((filename, error))
+    return errors
@@ -0,0 +1,343 @@
+"""
+    On-disk caches of parsed and downloaded patches.
+
+    Parsed PatchSet objects are pickled into a cache directory under
+    a name made from SHA-256 of the raw patch bytes, the parser
+    version and the parse options. Least recently used entries are
+    removed when the total size of the cache grows over its limit.
+
+    Downloaded patches are kept with their ETag and Last-Modified
+    headers, which are sent back to the server to download a patch
+    again only if it changed.
+
+    Available under the terms of MIT license
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+
+from . import patch as pypatch
+from .compression import GZIP_ENCODINGS
+
+logger = logging.getLogger('pypatch.patch')
+
+debug = logger.debug
+warning = logger.warning
+
+# layout of cache entries, change it together with anything that
+# affects parse results which is not covered by pypatch.__version__
+FORMAT = 5
+
+# default limit for the total size of cache entries in bytes
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+SUFFIX = ".pickle"
+
+
+def default_directory():
+    """ return cache directory from PYPATCH_URL_CACHE_DIR environment
+        variable, or `pypatch-url` in XDG cache directory
+    """
+    directory = os.environ.get("PYPATCH_URL_CACHE_DIR")
+    if directory:
+        return directory
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pypatch-url")
+
+
+class ParseCache(object):
+    """ Directory of pickled PatchSet objects keyed by content hash.
+
+        Set `pypatch_url.patch.parse_cache` to an instance to make
+        fromfile(), fromstring() and fromurl() use it.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        self.directory = os.path.abspath(directory or default_directory())
+        self.max_size = max_size
+        # lookups made by this instance
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data, **options):
+        """ return cache key for raw patch `data` (bytes or buffer)
+            parsed with `options`
+        """
+        h = hashlib.sha256()
+        h.update(("%s:%d:%s\0" % (pypatch.__version__, FORMAT, sorted(options.items()))).encode("utf-8"))
+        h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        """ return cached PatchSet for `key` or None
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                patchset = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            warning("removing broken cache entry %s (%s)" % (path, e))
+            self._remove(path)
+            self.misses += 1
+            return None
+        # mtime is the last use time for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        debug("using cached parse %s" % key)
+        return patchset
+
+    def put(self, key, patchset):
+        """ store PatchSet under `key`, return True on success.
+            Failure to write the cache is not fatal and only
+            logged.
+        """
+        import tempfile
+
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(patchset, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmpname, self._path(key))
+            except BaseException:
+                self._remove(tmpname)
+                raise
+        except (OSError, pickle.PicklingError) as e:
+            warning("unable to write parse cache in %s (%s)" % (self.directory, e))
+            return False
+        debug("cached parse %s" % key)
+        self.evict()
+        return True
+
+    def entries(self):
+        """ return list of (mtime, size, path) of cache entries,
+            least recently used first
+        """
+        result = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return result
+        for name in names:
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            result.append((st.st_mtime, st.st_size, path))
+        result.sort()
+        return result
+
+    def evict(self):
+        """ remove least recently used entries until cache fits
+            in `max_size`, return number of removed entries
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            if self._remove(path):
+                removed += 1
+            total -= size
+        if removed:
+            debug("evicted %d cache entries" % removed)
+        return removed
+
+    def stats(self):
+        """ return dict with directory, number of entries, their
+            total size and size limit
+        """
+        entries = self.entries()
+        return dict(directory=self.directory,
+                    entries=len(entries),
+                    size=sum(size for _, size, _ in entries),
+                    max_size=self.max_size)
+
+    def clear(self):
+        """ remove all cache entries, return number of removed ones
+        """
+        removed = 0
+        for _, _, path in self.entries():
+            if self._remove(path):
+                removed += 1
+        return removed
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            return False
+        return True
+
+
+class HTTPCache(object):
+    """ Directory of downloaded patches keyed by URL.
+
+        Every URL has a .json file with its ETag, Last-Modified and
+        charset headers and the time of the last download, and a
+        .body file with the content. A cached URL is requested with
+        If-None-Match and If-Modified-Since headers and the body is
+        taken from disk if the server answers 304. Entries younger
+        than `max_age` seconds are used without asking the server,
+        and in `offline` mode there are no requests at all.
+
+        Set `pypatch_url.patch.http_cache` to an instance to make
+        fromurl() use it.
+    """
+
+    def __init__(self, directory=None, max_age=0, offline=False):
+        self.directory = os.path.abspath(directory or os.path.join(default_directory(), "http"))
+        self.max_age = max_age
+        self.offline = offline
+        # downloads saved by this instance (304 or no request at all)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, url, suffix):
+        return os.path.join(self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest() + suffix)
+
+    def get(self, url):
+        """ return (headers dict, body bytes) cached for `url`, or
+            (None, None)
+        """
+        try:
+            with open(self._path(url, ".json"), "r", encoding="utf-8") as f:
+                headers = json.load(f)
+            with open(self._path(url, ".body"), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None, None
+        except (OSError, ValueError) as e:
+            warning("ignoring broken HTTP cache entry for %s (%s)" % (url, e))
+            return None, None
+        if not isinstance(headers, dict) or headers.get("url") != url:
+            return None, None
+        return headers, body
+
+    def fetch(self, url, urlopen):
+        """ return tuple (body bytes, charset or None) of `url`,
+            downloading it with `urlopen` function if needed, or
+            (None, None) in offline mode when it is not cached.
+            Errors of `urlopen` are raised.
+        """
+        from urllib.error import HTTPError
+        from urllib.request import Request
+
+        headers, body = self.get(url)
+        if headers is not None and (self.offline or 0 <= time.time() - headers.get("fetched", 0) < self.max_age):
+            self.hits += 1
+            debug("using cached download of %s" % url)
+            return body, headers.get("charset")
+        if self.offline:
+            warning("%s is not in HTTP cache (offline mode)" % url)
+            return None, None
+
+        request = url
+        if headers is not None:
+            conditions = {}
+            if headers.get("etag"):
+                conditions["If-None-Match"] = headers["etag"]
+            if headers.get("last_modified"):
+                conditions["If-Modified-Since"] = headers["last_modified"]
+            if conditions:
+                request = Request(url, headers=conditions)
+        try:
+            response = urlopen(request)
+        except HTTPError as e:
+            if e.code != 304 or headers is None:
+                raise
+            self.hits += 1
+            debug("%s is not modified, using cached download" % url)
+            headers["fetched"] = time.time()
+            self._write(self._path(url, ".json"), json.dumps(headers).encode("utf-8"))
+            return body, headers.get("charset")
+
+        self.misses += 1
+        body = response.read()
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+        message = getattr(response, "headers", None)
+        headers = dict(url=url, fetched=time.time(), etag=None, last_modified=None, charset=None)
+        if message is not None and (message.get("Content-Encoding") or "").strip().lower() in GZIP_ENCODINGS:
+            import gzip
+            # keep the patch itself, as it would be downloaded without Accept-Encoding
+            body = gzip.decompress(body)
+        if message is not None:
+            headers.update(etag=message.get("ETag"), last_modified=message.get("Last-Modified"),
+                           charset=message.get_content_charset())
+        # body goes first, so headers never describe a missing body
+        if self._write(self._path(url, ".body"), body):
+            self._write(self._path(url, ".json"), json.dumps(headers).encode("utf-8"))
+        return body, headers["charset"]
+
+    def _write(self, path, data):
+        """ write `data` to `path` atomically, return True on success.
+            Failure to write the cache is only logged.
+        """
+        import tempfile
+
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmpname, path)
+            except BaseException:
+                os.unlink(tmpname)
+                raise
+        except OSError as e:
+            warning("unable to write HTTP cache in %s (%s)" % (self.directory, e))
+            return False
+        return True
+
+    def _files(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [os.path.join(self.directory, name) for name in names if name.endswith((".json", ".body"))]
+
+    def stats(self):
+        """ return dict with directory, number of cached URLs and
+            their total size
+        """
+        files = self._files()
+        size = 0
+        for path in files:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return dict(directory=self.directory,
+                    entries=sum(1 for path in files if path.endswith(".json")),
+                    size=size)
+
+    def clear(self):
+        """ remove all cached downloads, return number of removed URLs """
+        removed = 0
+        for path in self._files():
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            removed += path.endswith(".json")
+        return removed
@@ -13,76 +13,131 @@
 from __future__ import print_function
 
 import sys
-import argparse
-
 import os
-import traceback
-import six
-
 import logging
+
 from . import patch as pypatch
 
 logger = logging.getLogger('pypatch.patch')
 
+# exit codes of the check action for status of the whole patch
+CHECK_EXIT_CODES = {
+    pypatch.ALREADY_APPLIED: 0,
+    pypatch.APPLICABLE: 10,
+    pypatch.CONFLICT: 20,
+    pypatch.MISSING: 30,
+}
 
-# noinspection HttpUrlsUsage
-def apply_patch(args, debug=True):
+# seconds until a download times out and number of retries, see fetch.ConnectionPool
+URL_TIMEOUT = 30
+URL_RETRIES = 2
+
+
+def configure_logging(debug):
     """
-    Applies the contents of a unified diff file to a python module.
+    Sends messages of the patch module to the console at the given level (True for DEBUG), replacing the console
+    handler of earlier calls. Does nothing if debug is not set.
     """
     if debug:
-        from logging import config
-
-        logging_config = {
-            'version': 1,
-            'disable_existing_loggers': True,
-            'formatters': {
-                'simple': {
-                    'format': '%(message)s'
-                }
-            },
-            'handlers': {
-                'console': {
-                    'level': debug,
-                    'class': 'logging.StreamHandler',
-                    'formatter': 'simple'
-                }
-            },
-            'loggers': {
-                'pypatch.patch': {
-                    'handlers': ['console'],
-                    'level': debug,
-                    'propagate': False
-                }
-            }
-        }
-
-        config.dictConfig(logging_config)
+        level = 'DEBUG' if debug is True else debug
+        handler = logging.StreamHandler()
+        handler.setLevel(level)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        for old in [h for h in logger.handlers if isinstance(h, logging.StreamHandler)]:
+            logger.removeHandler(old)
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+
+
+# noinspection HttpUrlsUsage
+def load_patch_set(patch_file, workers=None):
+    """
+    Loads a patch set from a URL, a local file or standard input for '-'. Patches may be compressed with gzip,
+    bzip2, xz or zstd. URLs are downloaded with URL_TIMEOUT and URL_RETRIES. Returns False if that fails.
+    """
+    if patch_file == '-':
+        patch_set = pypatch.fromstream(sys.stdin.buffer)
+        if not patch_set:
+            print("Failed to read or parse patch from standard input")
+            return False
+    # Check if patch_file is a URL or local file
+    elif patch_file.startswith(('http://', 'https://', 'ftp://')):
+        try:
+            patch_set = pypatch.fromurls([patch_file], timeout=URL_TIMEOUT, retries=URL_RETRIES)[0]
+            if not patch_set:
+                print("Failed to download or parse patch from URL '%s'" % patch_file)
+                return False
+        except Exception as e:
+            print(f"Error downloading patch from URL '{patch_file}': {str(e)}")
+            return False
+    else:
+        if not os.path.exists(patch_file):
+            print("Unable to locate patch file '%s'" % patch_file)
+            return False
+        patch_set = pypatch.fromfile(patch_file, workers=workers)
+
+    logger.debug("Loaded patch set: %s", patch_set)
+    return patch_set
+
+
+def use_caches(args):
+    """
+    Sets the caches of parsed and downloaded patches of the patch module from args, unless args.no_cache is set.
+    Returns previous caches for restore_caches().
+    """
+    saved = pypatch.parse_cache, pypatch.http_cache
+    if not getattr(args, 'no_cache', True):
+        from .cache import HTTPCache, ParseCache
+
+        pypatch.parse_cache = ParseCache(args.cache_dir)
+        max_age = getattr(args, 'max_age', None)
+        pypatch.http_cache = HTTPCache(args.cache_dir and os.path.join(args.cache_dir, 'http'),
+                                       max_age=max_age if isinstance(max_age, int) else 0,
+                                       offline=getattr(args, 'offline', False) is True)
+    return saved
+
+
+def restore_caches(saved):
+    """
+    Restores caches returned by use_caches().
+    """
+    pypatch.parse_cache, pypatch.http_cache = saved
+
+
+def apply_patch(args, debug=None):
+    """
+    Applies the contents of a unified diff file to a python module (or reverts it with args.reverse set).
+    """
+    configure_logging(debug)
 
     try:
         module_path = get_module_path(args.module)
     except ImportError:
+        import argparse
         msg = "Unable to locate module '%s'. Are you sure its installed?" % args.module
         raise argparse.ArgumentTypeError(msg)
 
-    try:
-        # Check if patch_file is a URL or local file
-        if args.patch_file.startswith(('http://', 'https://', 'ftp://')):
-            try:
-                patch_set = pypatch.fromurl(args.patch_file)
-                if not patch_set:
-                    print("Failed to download or parse patch from URL '%s'" % args.patch_file)
-                    return False
-            except Exception as e:
-                print(f"Error downloading patch from URL '{args.patch_file}': {str(e)}")
-                return False
-        else:
-            if not os.path.exists(args.patch_file):
-                print("Unable to locate patch file '%s'" % args.patch_file)
-                return False
-            patch_set = pypatch.fromfile(args.patch_file)
+    jobs = None
+    if hasattr(args, 'jobs') and isinstance(args.jobs, int):
+        jobs = args.jobs
+
+    fuzz = 0
+    if hasattr(args, 'fuzz') and isinstance(args.fuzz, int):
+        fuzz = args.fuzz
 
-        logger.debug("Loaded patch set: %s", patch_set)
+    durability = None
+    if hasattr(args, 'durability') and isinstance(args.durability, str):
+        durability = args.durability
+
+    reverse = getattr(args, 'reverse', False) is True
+
+    saved_caches = use_caches(args)
+
+    try:
+        patch_set = load_patch_set(args.patch_file, jobs)
+        if not patch_set:
+            return False
         # Apply path stripping if specified
         # if hasattr(args, 'strip') and args.strip is not None:
         #     strip_count = args.strip
@@ -95,85 +150,384 @@ def apply_patch(args, debug=True):
         #             patch.target = pypatch.xnormpath(patch.target)
         #
         #     logger.debug("Stripped patch set: %s", patch_set)
-        try:
-            os.chdir(module_path)
-        except OSError as e:
-            print(f"Failed to change directory to {module_path}: {str(e)}")
-            return False
         strip_count = 0
         if hasattr(args, 'strip') and args.strip is not None:
             strip_count = args.strip
-        result = patch_set.apply(strip_count)
+        transactional = getattr(args, 'transactional', False) is True
+
+        ledger = None
+        if not getattr(args, 'no_ledger', True):
+            from .ledger import Ledger
+            ledger = Ledger(module_path)
+            key = ledger.key(patch_set, strip_count)
+        if ledger and not reverse and ledger.applied(key):
+            logger.info("already patched according to %s" % ledger.path)
+            result = True
+        else:
+            result = patch_set.apply(strip_count, workers=jobs, fuzz=fuzz, durability=durability,
+                                     transactional=transactional, reverse=reverse, root=module_path)
+            if result and not getattr(args, 'no_compile', True):
+                from .bytecode import recompile
+                for filename, error in recompile(result.changed, jobs):
+                    print("Patched file '%s' does not compile:\n%s" % (filename, error))
+                    result = False
+            if result and ledger:
+                if reverse:
+                    ledger.forget(key)
+                else:
+                    ledger.record(key, patch_set, strip_count)
 
     except Exception as err:
         print("An unexpected error has occurred: %s" % err)
+        import traceback
         traceback.print_exc()
         if hasattr(err, 'message'):
             print(err.message)
         return False
+    finally:
+        restore_caches(saved_caches)
     if result:
-        print("Module '%s' patched successfully!" % args.module)
+        print("Module '%s' %s successfully!" % (args.module, 'reverted' if reverse else 'patched'))
         return True
     else:
-        print("Unable to apply patch. Please verify the patch contents and python module.")
+        print("Unable to %s patch. Please verify the patch contents and python module." % ('revert' if reverse else 'apply'))
         return False
 
 
-def get_module_path(module_name):
-    """Gets the module path without importing anything. Avoids conflicts with package dependencies."""
-    path = sys.path
+def apply_all(args, debug=None):
+    """
+    Applies all patches of a TOML manifest to their python modules in one process and prints a summary.
+    """
+    from . import manifest
 
-    if six.PY2:
-        import imp
-        for name in module_name.split('.'):
-            file_pointer, path, desc = imp.find_module(name, path)
-            path = [path, ]
-            if file_pointer is not None:
-                file_pointer.close()
+    configure_logging(debug)
 
-        return path[0]
+    saved_caches = use_caches(args)
 
-    if six.PY3:
-        from pathlib import Path
-        import importlib.util
-        spec = importlib.util.find_spec(module_name)
-        if spec:
-            return Path(spec.origin).parent
+    try:
+        entries = manifest.load_manifest(args.manifest)
+        result = manifest.apply_manifest(entries, jobs=args.jobs, fuzz=args.fuzz or 0, durability=args.durability,
+                                         ledger=not args.no_ledger, recompile=not args.no_compile)
+    except Exception as err:
+        print("An unexpected error has occurred: %s" % err)
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        restore_caches(saved_caches)
+
+    for entry in entries:
+        print("%-8s %s -> %s" % ('ok' if entry.result else 'FAILED', entry.patch, entry.module))
+    print("Applied %d of %d patches to %d modules"
+          % (sum(1 for entry in entries if entry.result), len(entries), len(set(entry.module for entry in entries))))
+    return result
+
+
+def check_patch(args, debug=None):
+    """
+    Checks if a unified diff file can be applied to a python module without changing any file.
+    The caches are only used with --cache, --cache-dir, --max-age or --offline, so nothing is written by default.
+    Returns exit code for the status of the whole patch, see CHECK_EXIT_CODES.
+    """
+    configure_logging(debug)
+
+    try:
+        module_path = get_module_path(args.module)
+    except ImportError:
+        import argparse
+        msg = "Unable to locate module '%s'. Are you sure its installed?" % args.module
+        raise argparse.ArgumentTypeError(msg)
+
+    if args.cache_dir or args.max_age is not None or args.offline:
+        args.no_cache = False
+    saved_caches = use_caches(args)
+
+    try:
+        patch_set = load_patch_set(args.patch_file)
+        if not patch_set:
+            return 1
+        results = patch_set.check(args.strip or 0, fuzz=args.fuzz or 0, reverse=args.reverse, root=module_path)
+    except Exception as err:
+        print("An unexpected error has occurred: %s" % err)
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        restore_caches(saved_caches)
+
+    for result in results:
+        filename = os.path.relpath(result.filename, module_path) if result.filename else result.patch.target
+        print("%s: %s" % (filename, result.status))
+        if len(set(result.hunks)) > 1:
+            for hno, status in enumerate(result.hunks):
+                print("  hunk no.%d: %s" % (hno + 1, status))
+
+    # the worst status of all files
+    statuses = set(result.status for result in results)
+    for status in (pypatch.MISSING, pypatch.CONFLICT, pypatch.APPLICABLE, pypatch.ALREADY_APPLIED):
+        if status in statuses:
+            print("Patch for module '%s' is %s" % (args.module, status))
+            return CHECK_EXIT_CODES[status]
+    return 0
+
+
+def cache_stats(args, debug=None):
+    """
+    Prints the location, number of entries and size of the caches of parsed and downloaded patches.
+    """
+    from .cache import HTTPCache, ParseCache
+
+    stats = ParseCache(args.cache_dir).stats()
+    print("Cache directory: %s" % stats['directory'])
+    print("Entries: %d" % stats['entries'])
+    print("Size: %d bytes (limit %d bytes)" % (stats['size'], stats['max_size']))
+    stats = HTTPCache(args.cache_dir and os.path.join(args.cache_dir, 'http')).stats()
+    print("Downloads directory: %s" % stats['directory'])
+    print("Downloads: %d (%d bytes)" % (stats['entries'], stats['size']))
+    return True
+
+
+def cache_clear(args, debug=None):
+    """
+    Removes all entries from the caches of parsed and downloaded patches.
+    """
+    from .cache import HTTPCache, ParseCache
+
+    cache = ParseCache(args.cache_dir)
+    removed = cache.clear()
+    print("Removed %d entries from %s" % (removed, cache.directory))
+    cache = HTTPCache(args.cache_dir and os.path.join(args.cache_dir, 'http'))
+    removed = cache.clear()
+    print("Removed %d downloads from %s" % (removed, cache.directory))
+    return True
+
+
+def get_module_path(module_name):
+    """Gets the module path without importing anything. Avoids conflicts with package dependencies."""
+    from pathlib import Path
+    from .locate import find_module_path
+
+    path = find_module_path(module_name)
+    if path:
+        return Path(path)
 
     raise ImportError("Did not know how to find module '%s'" % module_name)
 
 def main():
     """Parse args and execute function"""
+    import argparse
 
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers()
 
-    # Arguments for the apply action
-    apply_patch_parser = subparsers.add_parser('apply', description='Apply a patch file to a python module.')
-
-    apply_patch_parser.add_argument('patch_file',
+    # Arguments for the apply and revert actions
+    for action, description, reverse in (('apply', 'Apply a patch file to a python module.', False),
+                                         ('revert', 'Revert a patch file applied to a python module.', True)):
+        apply_patch_parser = subparsers.add_parser(action, description=description)
+
+        apply_patch_parser.add_argument('patch_file',
+                                        metavar='patch file',
+                                        help='A unified diff/patch file or URL to be %s, '
+                                             '"-" for standard input. It may be compressed.'
+                                             % ('reverted' if reverse else 'applied to the python module'),
+                                        type=str)
+
+        apply_patch_parser.add_argument('module',
+                                        metavar='python module',
+                                        help='The name of the python module to be patched.',
+                                        type=str)
+
+        apply_patch_parser.add_argument('--debug',
+                                        default='WARNING',
+                                        help='use debug logging',)
+
+        apply_patch_parser.add_argument('-p', '--strip',
+                                        metavar='NUM',
+                                        type=int,
+                                        help='Strip NUM leading components from file names.')
+
+        apply_patch_parser.add_argument('-F', '--fuzz',
+                                        metavar='NUM',
+                                        type=int,
+                                        help='Ignore up to NUM leading and trailing context lines of a hunk '
+                                             'if it does not match otherwise (default 0).')
+
+        apply_patch_parser.add_argument('-j', '--jobs',
+                                        metavar='N',
+                                        type=int,
+                                        help='Patch up to N files at once (and parse large patch files with N processes).')
+
+        apply_patch_parser.add_argument('--durability',
+                                        choices=pypatch.DURABILITY_MODES,
+                                        help='none: only rename a temp file over the original, '
+                                             'atomic: sync the temp file first (default), '
+                                             'fsync: also sync the directory after the rename.')
+
+        apply_patch_parser.add_argument('--transactional',
+                                        action='store_true',
+                                        help='Change no files at all unless every file can be %s.'
+                                             % ('reverted' if reverse else 'patched'))
+
+        apply_patch_parser.add_argument('--no-compile',
+                                        action='store_true',
+                                        help='Do not remove stale bytecode of patched files from __pycache__ '
+                                             'and compile them again.')
+
+        apply_patch_parser.add_argument('--no-ledger',
+                                        action='store_true',
+                                        help='Do not use the ledger of applied patches in the module directory '
+                                             'to skip patches that are already applied.')
+
+        apply_patch_parser.add_argument('--no-cache',
+                                        action='store_true',
+                                        help='Do not use the caches of parsed and downloaded patches.')
+
+        apply_patch_parser.add_argument('--cache-dir',
+                                        metavar='DIR',
+                                        help='Directory of the caches of parsed and downloaded patches '
+                                             '(default: $PYPATCH_URL_CACHE_DIR or $XDG_CACHE_HOME/pypatch-url).')
+
+        apply_patch_parser.add_argument('--max-age',
+                                        metavar='SECONDS',
+                                        type=int,
+                                        help='Use a downloaded patch for SECONDS without asking the server if it changed.')
+
+        apply_patch_parser.add_argument('--offline',
+                                        action='store_true',
+                                        help='Use downloaded patches only, never connect to the server.')
+
+        apply_patch_parser.set_defaults(func=apply_patch, reverse=reverse)
+
+    # Arguments for the apply-all action
+    apply_all_parser = subparsers.add_parser(
+        'apply-all',
+        description='Apply all patches listed in a TOML manifest to their python modules.')
+
+    apply_all_parser.add_argument('manifest',
+                                  help='A TOML file with [[patches]] tables of patch (file or URL), '
+                                       'module and optional strip.',
+                                  type=str)
+
+    apply_all_parser.add_argument('--debug',
+                                  default='WARNING',
+                                  help='use debug logging',)
+
+    apply_all_parser.add_argument('-F', '--fuzz',
+                                  metavar='NUM',
+                                  type=int,
+                                  help='Ignore up to NUM leading and trailing context lines of a hunk.')
+
+    apply_all_parser.add_argument('-j', '--jobs',
+                                  metavar='N',
+                                  type=int,
+                                  help='Parse patches and patch modules with up to N threads.')
+
+    apply_all_parser.add_argument('--durability',
+                                  choices=pypatch.DURABILITY_MODES,
+                                  help='How patched files are written, see apply.')
+
+    apply_all_parser.add_argument('--no-compile',
+                                  action='store_true',
+                                  help='Do not compile patched files again, see apply.')
+
+    apply_all_parser.add_argument('--no-ledger',
+                                  action='store_true',
+                                  help='Do not use the ledgers of applied patches in module directories.')
+
+    apply_all_parser.add_argument('--no-cache',
+                                  action='store_true',
+                                  help='Do not use the caches of parsed and downloaded patches.')
+
+    apply_all_parser.add_argument('--cache-dir',
+                                  metavar='DIR',
+                                  help='Directory of the caches of parsed and downloaded patches.')
+
+    apply_all_parser.add_argument('--max-age',
+                                  metavar='SECONDS',
+                                  type=int,
+                                  help='Use a downloaded patch for SECONDS without asking the server if it changed.')
+
+    apply_all_parser.add_argument('--offline',
+                                  action='store_true',
+                                  help='Use downloaded patches only, never connect to the server.')
+
+    apply_all_parser.set_defaults(func=apply_all)
+
+    # Arguments for the check action
+    check_patch_parser = subparsers.add_parser(
+        'check',
+        description='Check if a patch file can be applied to a python module without changing any file. '
+                    'Exits with 0 if the patch is already applied, 10 if it can be applied, '
+                    '20 if it conflicts, 30 if files are missing and 1 on other errors.')
+
+    check_patch_parser.add_argument('patch_file',
                                     metavar='patch file',
-                                    help='A unified diff/patch file to be applied to the python module.',
+                                    help='A unified diff/patch file or URL to be checked, "-" for standard input.',
                                     type=str)
 
-    apply_patch_parser.add_argument('module',
+    check_patch_parser.add_argument('module',
                                     metavar='python module',
-                                    help='The name of the python module to be patched.',
+                                    help='The name of the python module to be checked.',
                                     type=str)
 
-    apply_patch_parser.add_argument('--debug',
-                                    default='DEBUG',
+    check_patch_parser.add_argument('--debug',
+                                    default='WARNING',
                                     help='use debug logging',)
 
-    apply_patch_parser.add_argument('-p', '--strip',
+    check_patch_parser.add_argument('-p', '--strip',
                                     metavar='NUM',
                                     type=int,
                                     help='Strip NUM leading components from file names.')
 
-    apply_patch_parser.set_defaults(func=apply_patch)
+    check_patch_parser.add_argument('-F', '--fuzz',
+                                    metavar='NUM',
+                                    type=int,
+                                    help='Ignore up to NUM leading and trailing context lines of a hunk.')
+
+    check_patch_parser.add_argument('-R', '--reverse',
+                                    action='store_true',
+                                    help='Check if the patch can be reverted instead.')
+
+    check_patch_parser.add_argument('--cache',
+                                    dest='no_cache',
+                                    action='store_false',
+                                    help='Use the caches of parsed and downloaded patches (implied by the options '
+                                         'below), which are not written by default.')
+
+    check_patch_parser.add_argument('--cache-dir',
+                                    metavar='DIR',
+                                    help='Directory of the caches of parsed and downloaded patches.')
+
+    check_patch_parser.add_argument('--max-age',
+                                    metavar='SECONDS',
+                                    type=int,
+                                    help='Use a downloaded patch for SECONDS without asking the server if it changed.')
+
+    check_patch_parser.add_argument('--offline',
+                                    action='store_true',
+                                    help='Use downloaded patches only, never connect to the server.')
+
+    check_patch_parser.set_defaults(func=check_patch)
+
+    # Arguments for the cache actions
+    cache_parser = subparsers.add_parser('cache', description='Manage the cache of parsed patches.')
+    cache_subparsers = cache_parser.add_subparsers(dest='action')
+    # required= argument of add_subparsers() needs Python 3.7
+    cache_subparsers.required = True
+
+    for name, func, description in (('stats', cache_stats, 'Show size of the cache.'),
+                                    ('clear', cache_clear, 'Remove all cache entries.')):
+        cache_action_parser = cache_subparsers.add_parser(name, description=description)
+        cache_action_parser.add_argument('--cache-dir',
+                                         metavar='DIR',
+                                         help='Directory of the caches of parsed and downloaded patches.')
+        cache_action_parser.set_defaults(func=func)
+
     args = parser.parse_args()
-    success = args.func(args, debug=args.debug.upper())
-    sys.exit(0 if success else 1)
+    result = args.func(args, debug=args.debug.upper() if 'debug' in args else None)
+    if isinstance(result, bool):
+        result = 0 if result else 1
+    sys.exit(result)
 
 
 if __name__ == "__main__":
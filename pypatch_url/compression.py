@@ -0,0 +1,150 @@
+"""
+    Compressed patches.
+
+    Patches compressed with gzip, bzip2 or xz (and zstd, if the
+    compression.zstd module of Python 3.14 or zstandard package is
+    installed) are recognized by their magic bytes, whatever their
+    file name is, and decompressed while they are read, so they
+    are never written out or held in memory uncompressed.
+
+    Available under the terms of MIT license
+"""
+
+import logging
+
+try:
+    from lzma import LZMAError
+except ImportError:  # Python built without lzma
+    LZMAError = OSError
+
+logger = logging.getLogger('pypatch.patch')
+
+debug = logger.debug
+
+# (magic bytes, format) of recognized compressed streams
+MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bzip2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+)
+
+# longest magic
+HEADSIZE = max(len(magic) for magic, _ in MAGIC)
+
+# errors of reading broken compressed data
+ERRORS = (OSError, EOFError, ValueError, LZMAError)
+
+# values of Content-Encoding header for gzip
+GZIP_ENCODINGS = ("gzip", "x-gzip")
+
+
+def detect(head):
+    """ return format of compressed data starting with bytes
+        `head`, or None if it is not compressed
+    """
+    for magic, format in MAGIC:
+        if head.startswith(magic):
+            return format
+    return None
+
+
+class _Prefixed(object):
+    """ binary stream `stream` with bytes `head` read from it
+        put back in front
+    """
+
+    def __init__(self, head, stream):
+        self._head = head
+        self._stream = stream
+
+    def read(self, size=-1):
+        if not self._head:
+            return self._stream.read(size)
+        if size is None or size < 0:
+            data, self._head = self._head + self._stream.read(), b""
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+    def readable(self):
+        return True
+
+    def close(self):
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            close()
+
+
+def _readhead(stream, size):
+    """ read up to `size` bytes (or characters of text stream)
+        from `stream`, less only at EOF
+    """
+    head = stream.read(size)
+    while head and len(head) < size:
+        block = stream.read(size - len(head))
+        if not block:
+            break
+        head += block
+    return head
+
+
+def _zstdreader(stream):
+    """ return reader of decompressed zstd `stream`, raise
+        ValueError if no zstd module is installed
+    """
+    try:
+        from compression import zstd  # Python >= 3.14
+        return zstd.ZstdFile(stream)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compressed patch needs the zstandard package")
+    import io
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True))
+
+
+def decompressed(stream, content_encoding=None):
+    """ return binary stream of decompressed `stream` if it is
+        compressed, otherwise stream with the same data. gzip
+        `content_encoding` (e.g. Content-Encoding HTTP header) is
+        removed first, then the data is checked for magic bytes.
+        Seekable streams are read from their position again,
+        others get the bytes read to check them put back in front.
+        Text streams are returned as they are.
+
+        Raises ValueError for zstd data without a zstd module.
+    """
+    if content_encoding and content_encoding.strip().lower() in GZIP_ENCODINGS:
+        import gzip
+        debug("decompressing gzip content encoding")
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+
+    seekable = getattr(stream, "seekable", None)
+    if seekable is not None and seekable():
+        position = stream.tell()
+        head = _readhead(stream, HEADSIZE)
+        stream.seek(position)
+    else:
+        head = _readhead(stream, HEADSIZE)
+        if head:
+            stream = _Prefixed(head, stream)
+    format = detect(head) if isinstance(head, bytes) else None
+    if format is None:
+        return stream
+
+    debug("decompressing %s patch" % format)
+    if format == "gzip":
+        import gzip
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if format == "bzip2":
+        import bz2
+        return bz2.BZ2File(stream, mode="rb")
+    if format == "xz":
+        import lzma
+        return lzma.LZMAFile(stream, mode="rb")
+    return _zstdreader(stream)
@@ -0,0 +1,195 @@
+"""
+    Downloads over reused HTTP connections.
+
+    ConnectionPool.urlopen() works like urllib.request.urlopen() for
+    GET requests, but keeps idle keep-alive connections for every
+    host, so downloading many patches from the same server needs
+    only a few TCP and TLS handshakes. Requests have a timeout and
+    failed ones are retried with exponential backoff. URLs that go
+    through a proxy or are not HTTP are left to urllib.
+
+    Available under the terms of MIT license
+"""
+
+import http.client
+import io
+import logging
+import ssl
+import threading
+import time
+
+from urllib.error import HTTPError, URLError
+from urllib.parse import urljoin, urlsplit
+from urllib.request import Request, getproxies, proxy_bypass
+
+logger = logging.getLogger('pypatch.patch')
+
+debug = logger.debug
+
+# statuses that are followed to Location
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+# statuses that are worth another try
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class _Response(object):
+    """ Downloaded response, the part of http.client.HTTPResponse
+        that is used by fromurl()
+    """
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self._body = io.BytesIO(body)
+
+    def read(self, size=-1):
+        return self._body.read(size)
+
+    def geturl(self):
+        return self.url
+
+
+class ConnectionPool(object):
+    """ Idle HTTP connections by (scheme, host, port), safe to use
+        from many threads. Every request has `timeout` seconds and is
+        tried up to `retries` more times, waiting `backoff` seconds
+        before the first retry and twice as long before every next.
+        With `accept_gzip` servers may send gzip Content-Encoding,
+        which is left to the caller to decompress.
+    """
+
+    def __init__(self, timeout=30, retries=2, backoff=0.5, accept_gzip=False):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.accept_gzip = accept_gzip
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._context = None
+        # number of new connections
+        self.connections = 0
+
+    def urlopen(self, request, timeout=None):
+        """ GET `request` (URL or urllib Request), return response
+            with read() and headers. Raises HTTPError for statuses
+            other than 2xx (including 304) and URLError if server
+            can't be reached, like urllib.request.urlopen().
+        """
+        if isinstance(request, Request):
+            url = request.full_url
+            headers = dict(request.header_items())
+        else:
+            url = request
+            headers = {}
+        if self.accept_gzip and not any(name.lower() == "accept-encoding" for name in headers):
+            headers["Accept-Encoding"] = "gzip"
+        timeout = self.timeout if timeout is None else timeout
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                debug("retrying %s in %.1f seconds" % (url, delay))
+                time.sleep(delay)
+            try:
+                response = self._get(url, headers, timeout)
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == self.retries:
+                    raise URLError(e)
+                debug("error downloading %s (%s)" % (url, e))
+                continue
+            if response.status in RETRY_STATUSES and attempt < self.retries:
+                debug("HTTP Error %d downloading %s" % (response.status, url))
+                continue
+            break
+
+        if not 200 <= response.status < 300:
+            raise HTTPError(response.url, response.status, http.client.responses.get(response.status, ""),
+                            response.headers, io.BytesIO(response.read()))
+        return response
+
+    def _get(self, url, headers, timeout):
+        """ GET `url` following redirects, return _Response """
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or self._proxied(parts):
+                # proxies and other schemes are left to urllib
+                from urllib.request import urlopen
+                try:
+                    response = urlopen(Request(url, headers=headers), timeout=timeout)
+                except HTTPError as e:
+                    return _Response(url, e.code, e.headers, e.read())
+                return _Response(response.geturl(), getattr(response, "status", 200), response.headers,
+                                 response.read())
+            response = self._request(parts, headers, timeout)
+            if response.status not in REDIRECTS or not response.headers.get("Location"):
+                response.url = url
+                return response
+            url = urljoin(url, response.headers["Location"])
+            debug("redirected to %s" % url)
+        raise URLError("too many redirects")
+
+    def _proxied(self, parts):
+        return parts.scheme in getproxies() and not proxy_bypass(parts.hostname or "")
+
+    def _request(self, parts, headers, timeout):
+        """ send GET request for split URL `parts` over an idle
+            connection to its host or a new one, return _Response
+        """
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        while True:
+            conn = self._take(key)
+            reused = conn is not None
+            if conn is None:
+                conn = self._connect(parts, timeout)
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if reused:
+                    # server closed the idle connection
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._give(key, conn)
+            return _Response(None, response.status, response.headers, body)
+
+    def _connect(self, parts, timeout):
+        with self._lock:
+            self.connections += 1
+        if parts.scheme == "https":
+            if self._context is None:
+                self._context = ssl.create_default_context()
+            return http.client.HTTPSConnection(parts.hostname, parts.port, timeout=timeout,
+                                               context=self._context)
+        return http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+
+    def _take(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            return idle.pop() if idle else None
+
+    def _give(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def close(self):
+        """ close all idle connections """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
@@ -0,0 +1,202 @@
+"""
+    Ledger of patches applied to a python module.
+
+    The ledger is a JSON file in the module directory. For every
+    applied patch (keyed by SHA-256 of its parsed content and strip
+    level) it holds size, mtime and SHA-256 of the files it touched
+    after patching. A re-run checks the files with stat() only, and
+    reads a file just to compare its hash when the stat differs.
+    Patches are verified in full only when a file has changed.
+    Changes are merged into the ledger file as it is on disk under
+    a lock file next to it, so entries written by other processes
+    (or Ledger objects) are kept.
+
+    Available under the terms of MIT license
+"""
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+
+from . import patch as pypatch
+
+logger = logging.getLogger('pypatch.patch')
+
+debug = logger.debug
+info = logger.info
+warning = logger.warning
+
+FILENAME = ".pypatch-url-ledger.json"
+LOCKNAME = FILENAME + ".lock"
+
+# layout of the ledger file
+FORMAT = 1
+
+
+def _filehash(filename):
+    """ return SHA-256 of contents of `filename` """
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@contextlib.contextmanager
+def _locked(filename):
+    """ hold exclusive lock of file `filename` (created if it
+        does not exist) in the with block
+    """
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            import fcntl
+        except ImportError:  # Windows
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # gave up after 10 seconds
+                    continue
+            try:
+                yield
+            finally:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+    finally:
+        os.close(fd)
+
+
+class Ledger(object):
+    """ Applied patches of the module in `directory`.
+
+        File names in the ledger are relative to `directory`.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(str(directory))
+        self.path = os.path.join(self.directory, FILENAME)
+        self._patches = None
+
+    @property
+    def patches(self):
+        """ {key: {file name: fingerprint}} read from the ledger file """
+        if self._patches is None:
+            self._patches = self._read()
+        return self._patches
+
+    def _read(self):
+        """ return patches in the ledger file, {} if it is missing
+            or broken
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("format") == FORMAT:
+                return dict(data["patches"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError, TypeError) as e:
+            warning("ignoring broken ledger %s (%s)" % (self.path, e))
+        return {}
+
+    def key(self, patchset, strip=0):
+        """ return ledger key for PatchSet applied with `strip` """
+        h = hashlib.sha256()
+        h.update(("%d:%d\0" % (FORMAT, int(strip or 0))).encode("utf-8"))
+        for p in patchset.items:
+            h.update(("%s\0%s\0" % (p.source, p.target)).encode("utf-8", "surrogateescape"))
+            for hunk in p.hunks:
+                h.update(("@@ -%s,%s +%s,%s @@\0" % (hunk.startsrc, hunk.linessrc, hunk.starttgt, hunk.linestgt))
+                         .encode("utf-8"))
+                h.update("".join(hunk.text).encode("utf-8", "surrogateescape"))
+        return h.hexdigest()
+
+    def applied(self, key):
+        """ return True if patch with `key` is recorded and none of
+            its files changed since. Files that were only touched
+            get their new stat recorded.
+        """
+        files = self.patches.get(key)
+        if not files:
+            return False
+        touched = False
+        for name, fingerprint in files.items():
+            filename = os.path.join(self.directory, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                debug("file %s from ledger is missing" % name)
+                return False
+            if st.st_size == fingerprint["size"] and st.st_mtime_ns == fingerprint["mtime_ns"]:
+                continue
+            if st.st_size != fingerprint["size"] or _filehash(filename) != fingerprint["sha256"]:
+                debug("file %s changed since patch %s was applied" % (name, key))
+                return False
+            fingerprint["mtime_ns"] = st.st_mtime_ns
+            touched = True
+        if touched:
+            self._save(key)
+        return True
+
+    def record(self, key, patchset, strip=0):
+        """ record files of PatchSet applied with `strip` under `key`,
+            return True if the ledger was written. File names of the
+            PatchSet are relative to the module directory.
+        """
+        files = {}
+        for p in patchset.items:
+            for name in (p.source, p.target):
+                if strip:
+                    name = pypatch.pathstrip(name, strip)
+                name = os.path.join(self.directory, name)
+                if os.path.isfile(name):
+                    break
+            else:
+                continue
+            st = os.stat(name)
+            relname = os.path.relpath(name, self.directory).replace(os.sep, "/")
+            files[relname] = dict(size=st.st_size, mtime_ns=st.st_mtime_ns, sha256=_filehash(name))
+        self.patches[key] = files
+        return self._save(key)
+
+    def forget(self, key):
+        """ remove patch with `key`, return True if it was recorded """
+        if self.patches.pop(key, None) is None:
+            return False
+        return self._save(key)
+
+    def _save(self, key):
+        """ write entry of `key` in `patches` (or its removal) to
+            the ledger file as it is now, keeping the other entries
+            there. Failure is only logged
+        """
+        import tempfile
+
+        try:
+            with _locked(os.path.join(self.directory, LOCKNAME)):
+                patches = self._read()
+                if key in self.patches:
+                    patches[key] = self.patches[key]
+                else:
+                    patches.pop(key, None)
+                fd, tmpname = tempfile.mkstemp(prefix=FILENAME + ".", suffix=".tmp", dir=self.directory)
+                try:
+                    with os.fdopen(fd, "w", encoding="utf-8") as f:
+                        json.dump(dict(format=FORMAT, patches=patches), f, indent=1, sort_keys=True)
+                    os.replace(tmpname, self.path)
+                except BaseException:
+                    os.unlink(tmpname)
+                    raise
+                self._patches = patches
+        except OSError as e:
+            warning("unable to write ledger %s (%s)" % (self.path, e))
+            return False
+        debug("updated ledger %s" % self.path)
+        return True
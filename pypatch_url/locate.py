@@ -0,0 +1,152 @@
+"""
+    Locate python modules without importing them.
+
+    importlib.util.find_spec("a.b.c") imports the parent packages
+    a and a.b, running their code (which may be slow, have side
+    effects, or fail for the broken package that needs a patch).
+    find_module_path() looks the dotted name up in the directories
+    of sys.path the way the path based finder does: regular
+    packages, modules and namespace packages split over several
+    directories. Names not found there are asked of finders that
+    come after the path based finder in sys.meta_path, such as
+    those of editable installs, for the top level name only.
+
+    Directory listings are cached (and read again when the mtime
+    of a directory changes), so looking up many modules takes a
+    few stat() calls each.
+
+    Available under the terms of MIT license
+"""
+
+import importlib.machinery
+import logging
+import os
+import sys
+
+logger = logging.getLogger('pypatch.patch')
+
+debug = logger.debug
+
+# {directory: (mtime_ns, set of names)}
+_listings = {}
+
+
+def _listdir(directory):
+    """ return set of names in `directory` (empty if it is not a
+        readable directory), cached while its mtime is the same
+    """
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return frozenset()
+    cached = _listings.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        names = frozenset(os.listdir(directory))
+    except OSError:
+        names = frozenset()
+    _listings[directory] = (mtime, names)
+    return names
+
+
+def _ismodule(names, name):
+    """ return True if set of file `names` has module `name` """
+    return any(name + suffix in names for suffix in importlib.machinery.all_suffixes())
+
+
+def _lookup(directory, name):
+    """ return ("package", dir), ("module", file), ("namespace",
+        dir) or (None, None) for `name` in `directory`, in the
+        order of importlib.machinery.FileFinder
+    """
+    directory = directory or os.getcwd()
+    names = _listdir(directory)
+    if name in names:
+        path = os.path.join(directory, name)
+        if _ismodule(_listdir(path), "__init__"):
+            return "package", path
+    for suffix in importlib.machinery.all_suffixes():
+        if name + suffix in names:
+            return "module", os.path.join(directory, name + suffix)
+    if name in names and os.path.isdir(os.path.join(directory, name)):
+        return "namespace", os.path.join(directory, name)
+    return None, None
+
+
+def _search(name, directories):
+    """ return (kind, location, search path of submodules) of
+        module `name` in `directories`, (None, None, None) if it
+        is not found
+    """
+    portions = []
+    for n, directory in enumerate(directories):
+        kind, location = _lookup(directory, name)
+        if kind == "package":
+            # other directories of the same package come after it,
+            # in case it extends its __path__ (pkgutil.extend_path())
+            others = [d for d in directories[n + 1:] if _lookup(d, name)[0] in ("package", "namespace")]
+            return kind, location, [location] + [os.path.join(d, name) for d in others]
+        if kind == "module":
+            return kind, location, None
+        if kind == "namespace":
+            portions.append(location)
+    if portions:
+        return "namespace", portions[0], portions
+    return None, None, None
+
+
+def _metapath(name):
+    """ return (kind, location, search path of submodules) of top
+        level module `name` from finders after the path based finder
+        in sys.meta_path, (None, None, None) if none finds it
+    """
+    finders = sys.meta_path
+    try:
+        finders = finders[finders.index(importlib.machinery.PathFinder) + 1:]
+    except ValueError:
+        return None, None, None
+    for finder in finders:
+        find_spec = getattr(finder, "find_spec", None)
+        if find_spec is None:
+            continue
+        try:
+            spec = find_spec(name, None)
+        except Exception as e:
+            debug("finder %r failed to find %s (%s)" % (finder, name, e))
+            continue
+        if spec is None:
+            continue
+        locations = list(spec.submodule_search_locations or [])
+        if spec.origin and spec.has_location:
+            if locations:
+                return "package", os.path.dirname(spec.origin), locations
+            return "module", spec.origin, None
+        if locations:
+            return "namespace", locations[0], locations
+    return None, None, None
+
+
+def find_module_path(name, path=None):
+    """ return directory of package (or of the file of module)
+        with dotted `name`, looked up in list of directories `path`
+        (sys.path by default) without importing anything. For
+        namespace packages the first directory is returned.
+
+        return None if it is not found
+    """
+    directories = list(sys.path if path is None else path)
+    parts = name.split(".")
+    for n, part in enumerate(parts):
+        kind, location, directories = _search(part, directories)
+        if kind is None and n == 0 and path is None:
+            kind, location, directories = _metapath(part)
+        if kind is None:
+            debug("module %s not found" % ".".join(parts[:n + 1]))
+            return None
+        if kind == "module" and n < len(parts) - 1:
+            debug("module %s is not a package" % ".".join(parts[:n + 1]))
+            return None
+    if kind == "module":
+        return os.path.dirname(location)
+    return location
@@ -0,0 +1,212 @@
+"""
+    Apply many patches to many python modules in one process.
+
+    A manifest is a TOML file with a list of patches:
+
+        strip = 1                     # default for all patches
+
+        [[patches]]
+        patch = "patches/fix.patch"   # file (relative to manifest) or URL
+        module = "django"
+        strip = 0                     # optional
+
+    Every module is located and every patch is parsed only once.
+    URLs are downloaded at once over reused connections.
+    Patches for modules in different directories are applied by a
+    pool of threads, patches for modules in the same directory (or
+    in directories inside each other) are applied in manifest order.
+
+    Available under the terms of MIT license
+"""
+
+import functools
+import logging
+import os
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+from . import bytecode
+from . import command
+from . import patch as pypatch
+from .ledger import Ledger
+
+logger = logging.getLogger('pypatch.patch')
+
+ENTRY_KEYS = ('patch', 'module', 'strip')
+
+
+class ManifestEntry(object):
+    """ Patch of a manifest and the result of applying it """
+
+    __slots__ = ('patch', 'module', 'strip', 'result')
+
+    def __init__(self, patch, module, strip=0):
+        self.patch = patch    #: file name or URL
+        self.module = module  #: name of python module
+        self.strip = strip
+        self.result = None    #: True or False once applied
+
+    def __repr__(self):
+        return "ManifestEntry(%r, %r, %r, %r)" % (self.patch, self.module, self.strip, self.result)
+
+
+def load_manifest(filename):
+    """
+    Reads a TOML manifest and returns a list of ManifestEntry. Relative patch file names are taken relative
+    to the directory of the manifest. Raises ValueError if the manifest is not valid.
+    """
+    with open(filename, 'rb') as f:
+        try:
+            data = tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError("invalid manifest %s: %s" % (filename, e))
+
+    unknown = set(data) - set(['strip', 'patches'])
+    if unknown:
+        raise ValueError("unknown keys in manifest %s: %s" % (filename, ', '.join(sorted(unknown))))
+    strip = data.get('strip', 0)
+    base = os.path.dirname(os.path.abspath(filename))
+
+    entries = []
+    for n, item in enumerate(data.get('patches', [])):
+        if not isinstance(item, dict) or not isinstance(item.get('patch'), str) \
+                or not isinstance(item.get('module'), str):
+            raise ValueError("patch no.%d in manifest %s needs 'patch' and 'module'" % (n + 1, filename))
+        unknown = set(item) - set(ENTRY_KEYS)
+        if unknown:
+            raise ValueError("unknown keys for patch no.%d in manifest %s: %s"
+                             % (n + 1, filename, ', '.join(sorted(unknown))))
+        source = item['patch']
+        if not source.startswith(('http://', 'https://', 'ftp://')):
+            source = os.path.join(base, source)
+        entries.append(ManifestEntry(source, item['module'], item.get('strip', strip)))
+    return entries
+
+
+def apply_manifest(entries, jobs=None, fuzz=0, durability=None, ledger=True, recompile=True):
+    """
+    Applies ManifestEntry objects, setting their result. Modules are located and patches parsed once, then
+    up to `jobs` module directories are patched at once. Log messages are reported in the order of directories.
+    With `ledger` patches found in the ledger of a module are not verified again, see pypatch_url.ledger.
+    With `recompile` bytecode of all patched files is made again, see pypatch_url.bytecode, and patches that
+    make files which do not compile fail.
+    Returns True if all patches were applied.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    modules = list(dict.fromkeys(entry.module for entry in entries))
+    sources = list(dict.fromkeys(entry.patch for entry in entries))
+
+    urls = [source for source in sources if source.startswith(('http://', 'https://', 'ftp://'))]
+    files = [source for source in sources if source not in urls]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        paths = dict(zip(modules, executor.map(_module_path, modules)))
+        patch_sets = dict(zip(files, executor.map(command.load_patch_set, files)))
+        patch_sets.update(zip(urls, pypatch.fromurls(urls, max_concurrency=jobs or 8)))
+
+        # patches for every directory in manifest order, single file
+        # modules of one directory share it (and its ledger)
+        directories = {}
+        for entry in entries:
+            directories.setdefault(paths[entry.module], []).append(entry)
+
+        collector = pypatch._ThreadRecords()
+        logger.addFilter(collector)
+        try:
+            futures = [executor.submit(collector.collect, _apply_directories,
+                                       [(root, directories[root]) for root in group],
+                                       patch_sets, fuzz, durability, ledger)
+                       for group in _nested(directories)]
+            results = [f.result() for f in futures]
+        finally:
+            logger.removeFilter(collector)
+
+    applied = []
+    for module_applied, records in results:
+        for level, msg in records:
+            logger.log(level, msg)
+        applied.extend(module_applied)
+
+    errors = {}
+    if recompile:
+        errors = dict(bytecode.recompile([name for _, changed, _ in applied for name in changed], jobs))
+    for entry, changed, record in applied:
+        for filename in changed:
+            if filename in errors:
+                logger.warning("%s makes file %s that does not compile:\n%s" % (entry.patch, filename, errors[filename]))
+                entry.result = False
+        if entry.result and record:
+            record()
+    return all(entry.result for entry in entries)
+
+
+def _module_path(module):
+    """ return real path of directory of `module`, or None if it
+        is not found
+    """
+    try:
+        return os.path.realpath(str(command.get_module_path(module)))
+    except ImportError:
+        logger.warning("Unable to locate module '%s'" % module)
+        return None
+
+
+def _nested(directories):
+    """ return lists of `directories` (real paths, or None) where
+        one is inside another, which must not be patched at once,
+        in order of `directories`
+    """
+    top = {None: None}
+    current = None
+    for directory in sorted((d for d in directories if d is not None), key=lambda d: d.split(os.sep)):
+        if current is None or not directory.startswith(current.rstrip(os.sep) + os.sep):
+            current = directory
+        top[directory] = current
+    groups = {}
+    for directory in directories:
+        groups.setdefault(top[directory], []).append(directory)
+    return list(groups.values())
+
+
+def _apply_directories(roots, patch_sets, fuzz, durability, ledger):
+    """ _apply_module() for every (root, entries) of `roots` one
+        after another, return list of all applied patches
+    """
+    applied = []
+    for root, entries in roots:
+        applied.extend(_apply_module(root, entries, patch_sets, fuzz, durability, ledger))
+    return applied
+
+
+def _apply_module(root, entries, patch_sets, fuzz, durability, ledger):
+    """ apply patches of `entries` to modules in directory `root`
+        in order, see PatchSet.apply()
+
+        return list of (entry, names of changed files, function to
+        record it in the ledger or None) for applied patches
+    """
+    applied = []
+    if root is not None and ledger:
+        ledger = Ledger(root)
+    for entry in entries:
+        patch_set = patch_sets[entry.patch]
+        if root is None or not patch_set:
+            entry.result = False
+            continue
+        if ledger:
+            key = ledger.key(patch_set, entry.strip)
+            if ledger.applied(key):
+                logger.info("%s is already applied to %s according to %s" % (entry.patch, entry.module, ledger.path))
+                entry.result = True
+                continue
+        logger.debug("applying %s to %s" % (entry.patch, entry.module))
+        result = patch_set.apply(entry.strip, fuzz=fuzz, durability=durability, root=root)
+        entry.result = result.success
+        if result:
+            applied.append((entry, result.changed,
+                            ledger and functools.partial(ledger.record, key, patch_set, entry.strip)))
+    return applied
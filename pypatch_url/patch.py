@@ -16,16 +16,20 @@
 __author__ = "anatoly techtonik <techtonik@gmail.com>"
 __version__ = "1.12.11"
 
+import codecs
+import errno
+import functools
 import logging
+import mmap
 import re
 import os
-import six
-import shutil
+import threading
 
+from itertools import accumulate, chain
+from io import BytesIO, StringIO, TextIOWrapper
 from os.path import isfile, abspath
-from six import StringIO
-# from six.moves.urllib.request import urlopen
-# from six.moves.urllib import error as urllib_error
+
+from . import compression
 
 
 #------------------------------------------------
@@ -34,6 +38,33 @@ from six import StringIO
 
 debugmode = False
 
+# parse engine used by PatchSet.parse() - "fast" or "legacy"
+# (legacy state machine is kept selectable for one release)
+parser_engine = "fast"
+
+# cache of parsed patches used by fromfile(), fromstring() and
+# fromurl(), e.g. pypatch_url.cache.ParseCache() - None to disable
+parse_cache = None
+
+# cache of downloads used by fromurl(), e.g.
+# pypatch_url.cache.HTTPCache() - None to download every time
+http_cache = None
+
+# engine used by PatchSet.apply() - "fused" or "legacy"
+apply_engine = "fused"
+
+# how patched files are written by fused engine:
+#   "none"   - temp file is renamed over the original
+#   "atomic" - temp file is also synced before the rename
+#   "fsync"  - directory is synced after the rename as well
+apply_durability = "atomic"
+DURABILITY_MODES = ("none", "atomic", "fsync")
+
+# files of at least this many bytes are patched by fused engine
+# copying unchanged byte ranges in the kernel (see Patch.patch_ranges()),
+# None to always patch line by line
+copy_threshold = 16 * 1024 * 1024
+
 logger = logging.getLogger('pypatch.patch')
 
 debug = logger.debug
@@ -70,6 +101,46 @@ SVN = SUBVERSION = "svn"
 # Patches of different type
 MIXED = MIXED = "mixed"
 
+#------------------------------------------------
+# Constants for statuses of files and hunks
+# reported by PatchSet.check()
+
+APPLICABLE = "applicable"
+ALREADY_APPLIED = "already-applied"
+CONFLICT = "conflict"
+MISSING = "missing"
+
+
+#------------------------------------------------
+# Patterns and tables used by the parser
+
+def _grammar(token):
+    """ return tokens and patterns of unified diff for lines
+        of the type made by `token` function (str or bytes)
+    """
+    return dict(
+        # regexp to match start of hunk, used groups - 1,3,4,6
+        hunk_start=re.compile(token(r"^@@ -(\d+)(,(\d+))? \+(\d+)(,(\d+))?")).match,
+        srcname=re.compile(token(r"^--- ([^\t]+)")).match,
+        tgtname=re.compile(token(r"^\+\+\+ ([^\t]+)")).match,
+        # first character of hunk line -> (source lines, target lines) it counts for
+        hunkline={token('-'): (1, 0), token('+'): (0, 1), token(' '): (1, 1), token('\\'): (0, 0)},
+        src=token("--- "),
+        tgt=token("+++ "),
+        crlf=token("\r\n"),
+        lf=token("\n"),
+        cr=token("\r"),
+        space=token(" "),
+        nonewline=token("\\"),
+    )
+
+
+# grammar for each supported type of stream lines
+_GRAMMAR = {str: _grammar(str), bytes: _grammar(lambda s: s.encode("ascii"))}
+
+# parser states
+_HEADSCAN, _FILENAMES, _HUNKHEAD, _HUNKBODY, _HUNKSKIP, _HUNKPARSED = range(6)
+
 
 #------------------------------------------------
 # Helpers (these could come with Python stdlib)
@@ -121,56 +192,363 @@ def xstrip(filename):
 #-----------------------------------------------
 # Main API functions
 
-def fromfile(filename):
+def fromfile(filename, stream=False, compact=False, mmap=False, workers=None):
     """ Parse patch file. If successful, returns
         PatchSet() object. Otherwise returns False.
+
+        With `stream` set the file is not parsed upfront. The
+        returned PatchSet yields Patch objects one by one as
+        they are parsed when iterated (or applied), and keeps
+        the file open until the iteration is over.
+
+        With `compact` set hunk texts and headers are kept in
+        shared buffers to save memory, see Hunk.
+
+        With `mmap` set the file is memory mapped and parsed as
+        bytes. Only filenames and headers are decoded while
+        parsing, hunks keep offsets into the mapped file and
+        decode their text when it is accessed. Line ends of the
+        file are kept as is.
+
+        `workers` is the number of processes to parse the file
+        with, see PatchSet.parse()
+
+        Streamed files are never looked up in `parse_cache`.
     """
     patchset = PatchSet()
     debug("reading %s" % filename)
-    if six.PY2:
-        fp = open(filename, "rb")
-    else:
-        fp = open(filename, "r", encoding="utf-8", errors="replace")
-    res = patchset.parse(fp)
+    if mmap:
+        buffer = _mapfile(filename)
+        if buffer and compression.detect(buffer[:compression.HEADSIZE]):
+            debug("%s is compressed, reading it without mmap" % filename)
+            buffer.close()
+            mmap = False
+    if mmap:
+        lines = iter(buffer.readline, b"") if buffer else ()
+        if stream:
+            patchset.stream(lines, compact=compact, buffer=buffer)
+            return patchset
+
+        def parse():
+            res = patchset.parse(lines, compact=compact, buffer=buffer, workers=workers)
+            return patchset if res else False
+        return _cached(buffer, parse, compact=compact, mmap=True)
+    if stream:
+        patchset.stream(_readfile(filename), compact=compact)
+        return patchset
+    if parse_cache is not None:
+        with open(filename, "rb") as fp:
+            data = fp.read()
+
+        def parse():
+            fp = TextIOWrapper(compression.decompressed(BytesIO(data)), encoding="utf-8", errors="replace")
+            res = patchset.parse(fp, compact=compact, workers=workers)
+            return patchset if res else False
+        return _cached(data, parse, compact=compact)
+    with open(filename, "rb") as raw:
+        fp = TextIOWrapper(compression.decompressed(raw), encoding="utf-8", errors="replace")
+        res = patchset.parse(fp, compact=compact, workers=workers)
     fp.close()
     if res == True:
         return patchset
     return False
 
 
-def fromstring(s):
+def fromstring(s, compact=False):
     """ Parse text string and return PatchSet()
         object (or False if parsing fails)
     """
-    ps = PatchSet(StringIO(s))
+    def parse():
+        ps = PatchSet()
+        ps.parse(StringIO(s), compact=compact)
+        if ps.errors == 0:
+            return ps
+        return False
+    if parse_cache is None:
+        return parse()
+    return _cached(s.encode("utf-8", "surrogatepass"), parse, compact=compact, string=True)
+
+
+def fromstream(stream, compact=False):
+    """ Parse patch from binary `stream` (e.g. sys.stdin.buffer)
+        that may be compressed, see compression module. Return
+        PatchSet() object or False if parsing fails.
+
+        Without `parse_cache` the stream is parsed as it is read.
+    """
+    ps = PatchSet()
+    try:
+        if parse_cache is not None:
+            data = stream.read()
+
+            def parse():
+                fp = TextIOWrapper(compression.decompressed(BytesIO(data)), encoding="utf-8", errors="replace")
+                return ps if ps.parse(fp, compact=compact) else False
+            return _cached(data, parse, compact=compact)
+        ps.parse(_decodedlines(compression.decompressed(stream), "utf-8"), compact=compact)
+    except compression.ERRORS as e:
+        warning("unable to decompress patch: %s" % e)
+        return False
     if ps.errors == 0:
         return ps
     return False
 
 
-def fromurl(url):
+def fromurl(url, stream=False, compact=False, urlopen=None):
     """ Parse patch from an URL, return False
         if an error occurred. Note that this also
         can throw urlopen() exceptions.
+
+        `stream` and `compact` have the same meaning as for
+        fromfile(). Module level `http_cache` is used to
+        download the patch only if it changed. `urlopen` is
+        urllib.request.urlopen() by default, see fromurls().
+
+        The response is decompressed (see compression module),
+        decoded and parsed while it is being downloaded, see
+        _decodedlines(). Only with `parse_cache` it is decoded
+        in memory first, as the cache key needs all of it.
     """
+    import urllib.error
+    import urllib.request
+
+    urlopen = urlopen or urllib.request.urlopen
     try:
-        response = six.moves.urllib.request.urlopen(url)
-        encoding = response.headers.get_content_charset('utf-8')  # Default to 'utf-8' if not specified
-        content = response.read().decode(encoding, errors='replace')
+        if http_cache is not None:
+            content, charset = http_cache.fetch(url, urlopen)
+            if content is None:
+                return False
+            response = compression.decompressed(BytesIO(content))
+        else:
+            response = urlopen(url)
+            headers = getattr(response, 'headers', None)
+            charset = headers.get_content_charset() if headers else None
+            response = compression.decompressed(response, headers and headers.get('Content-Encoding'))
+        # Default to 'utf-8' if not specified
+        charset = charset or 'utf-8'
+
+        ps = PatchSet()
+        if stream:
+            ps.stream(_decodedlines(response, charset), compact=compact)
+            return ps
 
-        # if six.PY3 and isinstance(content, bytes):
-        #     content = content.decode('utf-8', errors='replace')
+        if parse_cache is not None:
+            # cache key is the same as for fromstring() of the text
+            content = "".join(_decodedlines(response, charset))
+            response = StringIO(content)
 
-        ps = PatchSet(StringIO(content))
-        if ps.errors == 0:
-            return ps
-        return False
-    except six.moves.urllib.error.HTTPError as e:
+        def parse():
+            ps.parse(_decodedlines(response, charset), compact=compact)
+            if ps.errors == 0:
+                return ps
+            return False
+        if parse_cache is None:
+            return parse()
+        return _cached(content.encode("utf-8", "surrogatepass"), parse, compact=compact, string=True)
+    except urllib.error.HTTPError as e:
         warning("HTTP Error %d: %s" % (e.code, e.reason))
         return False
-    except six.moves.urllib.error.URLError as e:
+    except urllib.error.URLError as e:
         warning("URL Error: %s" % e.reason)
         return False
+    except compression.ERRORS as e:
+        warning("unable to decompress patch from %s: %s" % (url, e))
+        return False
+
+
+def _decodedlines(stream, encoding, size=1 << 16):
+    """ yield lines of binary `stream` (e.g. HTTP response)
+        decoded with an incremental decoder, reading it in blocks
+        of `size` bytes only as the lines are consumed. Lines are
+        split at "\n" like lines of StringIO. Text streams are
+        read as they are.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = []
+    while True:
+        block = stream.read(size)
+        text = decoder.decode(block, final=not block) if isinstance(block, bytes) else block
+        lines = text.split("\n")
+        if len(lines) > 1:
+            pending.append(lines[0])
+            yield "".join(pending) + "\n"
+            for line in lines[1:-1]:
+                yield line + "\n"
+            pending = []
+        if lines[-1]:
+            pending.append(lines[-1])
+        if not block:
+            break
+    if pending:
+        yield "".join(pending)
+
+
+def fromurls(urls, max_concurrency=8, timeout=30, retries=2, stream=False, compact=False):
+    """ Parse patches from a list of URLs with up to
+        `max_concurrency` downloads at once, reusing keep-alive
+        connections to the same host. Every request times out
+        after `timeout` seconds and is retried up to `retries`
+        times with backoff, see fetch.ConnectionPool. Servers
+        may send the patches with gzip Content-Encoding.
+
+        return list with PatchSet, or False if an error occurred,
+        for every URL in the same order
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from .fetch import ConnectionPool
+
+    pool = ConnectionPool(timeout=timeout, retries=retries, accept_gzip=True)
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            return list(executor.map(functools.partial(fromurl, stream=stream, compact=compact,
+                                                       urlopen=pool.urlopen), urls))
+    finally:
+        pool.close()
+
+
+def _cached(data, parse, **options):
+    """ return result of `parse` function for raw patch `data`
+        from `parse_cache`, calling it and caching successful
+        results on a miss. `options` are parse options that
+        are a part of cache key.
+    """
+    cache = parse_cache
+    if cache is None:
+        return parse()
+    key = cache.key(data, engine=parser_engine, **options)
+    patchset = cache.get(key)
+    if patchset is not None:
+        return patchset
+    patchset = parse()
+    if patchset:
+        cache.put(key, patchset)
+    return patchset
+
+
+# minimal number of lines in a part of stream that is parsed in parallel
+_MIN_CHUNK_LINES = 10000
+
+
+def _split_points(lines, parts):
+    """ return indexes of lines where list of `lines` can be split
+        into about `parts` parts, each one starting with a header
+        of a file that follows a hunk
+    """
+    bounds = []
+    for n in range(1, parts):
+        idx = max(len(lines) * n // parts, bounds[-1] + 1 if bounds else 1)
+        while idx < len(lines) - 2:
+            line = lines[idx]
+            if (line[:4] in ("--- ", b"--- ") and lines[idx + 1][:4] in ("+++ ", b"+++ ")
+                    and lines[idx + 2][:4] in ("@@ -", b"@@ -")):
+                break
+            idx += 1
+        else:
+            break
+        # move split point to the start of file header
+        while idx > 1 and lines[idx - 1][:1] not in ("", " ", "+", "-", "\\", "@", b"", b" ", b"+", b"-", b"\\", b"@"):
+            if not lines[idx - 1].strip():
+                break
+            idx -= 1
+        if idx > (bounds[-1] if bounds else 0):
+            bounds.append(idx)
+    return bounds
+
+
+def _countpatches(lines, start, end):
+    """ return number of file headers ("--- " line followed by
+        "+++ " line) among lines[start:end]
+    """
+    return sum(1 for idx in range(start, min(end, len(lines) - 1))
+               if lines[idx][:4] in ("--- ", b"--- ") and lines[idx + 1][:4] in ("+++ ", b"+++ "))
+
+
+class _ListHandler(logging.Handler):
+    """ logging handler that collects (level, message) records """
+
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+
+class _ThreadRecords(logging.Filter):
+    """ logger filter that holds back (level, message) records
+        of threads that run a function with collect()
+    """
+
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.local = threading.local()
+
+    def filter(self, record):
+        records = getattr(self.local, "records", None)
+        if records is None:
+            return True
+        records.append((record.levelno, record.getMessage()))
+        return False
+
+    def collect(self, func, *args):
+        """ return result of func(*args) and records logged by it """
+        self.local.records = records = []
+        try:
+            return func(*args), records
+        finally:
+            self.local.records = None
+
+
+def _parse_chunk(text, compact, level, first=0):
+    """ parse part of a patch in a worker process, return items,
+        error and warning counts, whether the part ended with a
+        complete hunk and log records to replay in main process.
+        `first` is the number of patches before the part, so that
+        messages name patches like a serial parse.
+    """
+    records = []
+    handlers, propagate, oldlevel = logger.handlers, logger.propagate, logger.level
+    logger.handlers = [_ListHandler(records)]
+    logger.propagate = False
+    logger.setLevel(level)
+    try:
+        patchset = PatchSet()
+        patchset._first = first
+        if isinstance(text, bytes):
+            patchset.parse(BytesIO(text), compact=compact, buffer=text)
+        else:
+            patchset.parse(StringIO(text), compact=compact)
+    finally:
+        logger.handlers, logger.propagate = handlers, propagate
+        logger.setLevel(oldlevel)
+    return patchset.items, patchset.errors, patchset.warnings, patchset._complete, records
+
+
+def _compacted(patches):
+    """ Generator that compacts Patch objects on the way """
+    for p in patches:
+        p.compact()
+        yield p
+
+
+def _mapfile(filename):
+    """ Map file into memory read-only, empty files
+        (that can not be mapped) are returned as b""
+    """
+    with open(filename, "rb") as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _readfile(filename):
+    """ Generator that yields lines of a patch file,
+        the file is closed when the generator is over
+    """
+    with open(filename, "rb") as raw:
+        fp = TextIOWrapper(compression.decompressed(raw), encoding="utf-8", errors="replace")
+        for line in fp:
+            yield line
 
 
 # --- Utility functions ---
@@ -197,8 +575,362 @@ def pathstrip(path, n):
 # --- /Utility function ---
 
 
+def _splitlines(text):
+    """ Split text joined from lines back into lines that
+        keep their \\n line ends
+    """
+    lines = text.split('\n')
+    last = lines.pop()
+    lines = [line + '\n' for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+def _lineend(lines):
+    """ return line end used by all `lines`, or None if
+        line ends are mixed or there are none
+    """
+    ends = set()
+    for line in lines:
+        if line.endswith("\r\n"):
+            ends.add("\r\n")
+        elif line.endswith("\n"):
+            ends.add("\n")
+        elif line.endswith("\r"):
+            ends.add("\r")
+        else:
+            continue
+        if len(ends) > 1:
+            return None
+    return ends.pop() if ends else None
+
+
+def _hunkstart(start, count):
+    """ return index of the first line of hunk side that starts
+        at line `start` and has `count` lines. Empty side of a
+        hunk starts after line `start`.
+    """
+    return start - 1 if count else start
+
+
+def _hunkside(text, skip):
+    """ return hunk lines without line ends and leading character
+        for one side of a hunk, `skip` is the kind of lines that
+        belong to the other side ("+" or "-")
+    """
+    return [x[1:].rstrip("\r\n") for x in text if x[:1] != skip and x[:1] != "\\"]
+
+
+def _fuzzed(text, fuzz):
+    """ return hunk `text` without up to `fuzz` leading and trailing
+        context lines and number of removed leading lines
+    """
+    lead = 0
+    while lead < fuzz and lead < len(text) and text[lead][:1] not in "+-\\":
+        lead += 1
+    end = len(text)
+    while len(text) - end < fuzz and end > lead and text[end - 1][:1] not in "+-\\":
+        end -= 1
+    return text[lead:end], lead
+
+
+def _lineindex(lines):
+    """ return dict {line: [positions]} for list of `lines` """
+    index = {}
+    for pos, line in enumerate(lines):
+        index.setdefault(line, []).append(pos)
+    return index
+
+
+def _search(lines, index, find, expected, lower):
+    """ return position of `find` lines in `lines` nearest to
+        `expected` and not before `lower`, or None. Candidates
+        come from `index` of the rarest line of `find`.
+    """
+    if not find:
+        return None
+    anchor = min(range(len(find)), key=lambda k: len(index.get(find[k], ())))
+    best = None
+    for pos in index.get(find[anchor], ()):
+        pos -= anchor
+        if pos < lower:
+            continue
+        if best is not None and abs(pos - expected) >= abs(best - expected):
+            if pos > expected:
+                break
+            continue
+        if lines[pos:pos + len(find)] == find:
+            best = pos
+    return best
+
+
+def _opener(dir_fd):
+    """ return `opener` for open() that opens names relative to
+        open directory `dir_fd`, None for the working directory
+    """
+    if dir_fd is None:
+        return None
+    return lambda name, flags: os.open(name, flags, dir_fd=dir_fd)
+
+
+def _filestat(filename, dir_fd=None):
+    """ return os.stat() of `filename` relative to `dir_fd`, or
+        None if it does not exist
+    """
+    try:
+        return os.stat(filename, dir_fd=dir_fd)
+    except (OSError, ValueError):
+        return None
+
+
+def _realname(filename, dir_fd=None):
+    """ return name of the file symlink `filename` points to,
+        `filename` if it is not a symlink. Relative to `dir_fd`
+        only links of the last name component are followed, the
+        directories are found by os functions all the same.
+    """
+    if dir_fd is None:
+        return os.path.realpath(filename)
+    for _ in range(40):
+        try:
+            link = os.readlink(filename, dir_fd=dir_fd)
+        except OSError as e:
+            if e.errno != errno.EINVAL:
+                raise
+            return filename
+        filename = os.path.join(os.path.dirname(filename), link)
+    raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), filename)
+
+
+def _mkstemp(filename, dir_fd=None):
+    """ create temp file in directory of `filename` (relative to
+        open directory `dir_fd`) with the same permissions, return
+        tuple (fd, name of temp file)
+    """
+    import shutil
+    import tempfile
+
+    directory, name = os.path.split(filename)
+    if dir_fd is None:
+        fd, tmpname = tempfile.mkstemp(prefix="." + name + ".", suffix=".tmp", dir=directory or ".")
+        try:
+            shutil.copymode(filename, tmpname)
+        except BaseException:
+            os.close(fd)
+            os.unlink(tmpname)
+            raise
+        return fd, tmpname
+
+    import stat
+
+    mode = stat.S_IMODE(os.stat(filename, dir_fd=dir_fd).st_mode)
+    flags = os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, "O_NOFOLLOW", 0) | getattr(os, "O_CLOEXEC", 0)
+    for _ in range(100):
+        tmpname = os.path.join(directory, ".%s.%s.tmp" % (name, os.urandom(6).hex()))
+        try:
+            fd = os.open(tmpname, flags, 0o600, dir_fd=dir_fd)
+        except FileExistsError:
+            continue
+        try:
+            os.chmod(fd, mode)
+        except BaseException:
+            os.close(fd)
+            os.unlink(tmpname, dir_fd=dir_fd)
+            raise
+        return fd, tmpname
+    raise FileExistsError(errno.EEXIST, "no unused temp file name", filename)
+
+
+def _stagefile(filename, lines, mode, dir_fd=None):
+    """ write `lines` to a temp file in directory of `filename`
+        with the same permissions, syncing it unless `mode` is
+        "none", and return name of the temp file
+    """
+    fd, tmpname = _mkstemp(filename, dir_fd)
+    try:
+        with open(fd, "w", encoding="utf-8", errors="surrogateescape", newline="") as fp:
+            fp.writelines(lines)
+            if mode != "none":
+                fp.flush()
+                os.fsync(fp.fileno())
+    except BaseException:
+        os.unlink(tmpname, dir_fd=dir_fd)
+        raise
+    return tmpname
+
+
+def _stageranges(filename, data, pieces, mode, dir_fd=None):
+    """ write `pieces` (see Patch.patch_ranges()) to a temp file like
+        _stagefile(), copying byte ranges of `data`, which is a mmap
+        of opened `filename`, with _copyrange()
+    """
+    fd, tmpname = _mkstemp(filename, dir_fd)
+    try:
+        with open(fd, "wb", buffering=0) as fp:
+            with open(filename, "rb", buffering=0, opener=_opener(dir_fd)) as src:
+                for piece in pieces:
+                    if isinstance(piece, tuple):
+                        _copyrange(src.fileno(), fp.fileno(), data, piece[0], piece[1] - piece[0])
+                    else:
+                        _writeall(fp.fileno(), piece)
+            if mode != "none":
+                os.fsync(fp.fileno())
+    except BaseException:
+        os.unlink(tmpname, dir_fd=dir_fd)
+        raise
+    return tmpname
+
+
+# errors of os.copy_file_range() and os.sendfile() that mean they
+# can not be used for the files
+_NOCOPY = set([errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+               getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)])
+
+
+def _copyrange(infd, outfd, data, offset, count):
+    """ copy `count` bytes at `offset` of file `infd` to current
+        position of file `outfd` with os.copy_file_range(), or
+        os.sendfile() if that is not available, so the bytes never
+        pass through Python. The last resort is writing slices of
+        `data` (contents of `infd`).
+    """
+    end = offset + count
+    for method in ("copy_file_range", "sendfile", None):
+        try:
+            while offset < end:
+                if method == "copy_file_range":
+                    done = os.copy_file_range(infd, outfd, end - offset, offset)
+                elif method == "sendfile":
+                    done = os.sendfile(outfd, infd, offset, end - offset)
+                else:
+                    done = _writeall(outfd, data[offset:min(end, offset + (1 << 20))])
+                if not done:
+                    raise IOError("unexpected end of file")
+                offset += done
+            return
+        except (AttributeError, OSError) as e:
+            if method is None or getattr(e, "errno", None) not in _NOCOPY and not isinstance(e, AttributeError):
+                raise
+            debug("%s is not usable (%s), falling back" % (method, e))
+
+
+def _writeall(fd, data):
+    """ write all of `data` to file `fd`, return its length """
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+    return len(data)
+
+
+def _lineoffsets(data, numbers, block=1 << 20):
+    """ return list of byte offsets where lines with ascending
+        0-based `numbers` start in `data` with "\n" line ends.
+        Line ends are counted in blocks, so only the block with
+        a wanted line is looked through line by line. A line
+        past the end of `data` has offset None.
+    """
+    offsets = []
+    size = len(data)
+    pos = line = 0
+    for number in numbers:
+        while number - line > 0 and pos < size:
+            end = min(pos + block, size)
+            count = data[pos:end].count(b"\n")
+            if count >= number - line:
+                break
+            line += count
+            pos = end
+        while line < number:
+            pos = data.find(b"\n", pos)
+            if pos == -1:
+                break
+            pos += 1
+            line += 1
+        if line < number:
+            offsets.extend([None] * (len(numbers) - len(offsets)))
+            break
+        offsets.append(pos)
+    return offsets
+
+
+# os functions that must take dir_fd for PatchSet.apply(dir_fd=),
+# os.replace() takes it where os.rename() does
+_DIR_FD_FUNCTIONS = ("open", "stat", "rename", "unlink", "readlink")
+
+
+def _rootpath(root, dir_fd):
+    """ return `root` argument of PatchSet.apply() as str (or None
+        for the working directory), raise ValueError if `dir_fd`
+        is given but not an open directory or os functions can't
+        take it on this platform
+    """
+    if root is not None:
+        root = os.fspath(root)
+    if dir_fd is None:
+        return root
+    missing = [name for name in _DIR_FD_FUNCTIONS if getattr(os, name) not in os.supports_dir_fd]
+    if missing:
+        raise ValueError("dir_fd is not supported on this platform (by os.%s)" % ", os.".join(missing))
+    import stat
+
+    try:
+        st = os.stat(dir_fd)
+    except OSError as e:
+        raise ValueError("dir_fd %d is not an open directory (%s)" % (dir_fd, e))
+    if not stat.S_ISDIR(st.st_mode):
+        raise ValueError("dir_fd %d is not an open directory" % dir_fd)
+    return root
+
+
+def _replacefile(tmpname, filename, mode, dir_fd=None):
+    """ rename temp file over `filename` (temp file is removed
+        if that fails), syncing the directory if `mode` is "fsync"
+    """
+    try:
+        os.replace(tmpname, filename, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+    except BaseException:
+        os.unlink(tmpname, dir_fd=dir_fd)
+        raise
+    if mode == "fsync":
+        _syncdir(os.path.dirname(filename), dir_fd)
+
+
+def _syncdir(directory, dir_fd=None):
+    """ fsync directory, so renames in it are on disk """
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(directory or ".", os.O_RDONLY | os.O_DIRECTORY, dir_fd=dir_fd)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _joinable(lines):
+    """ Return True if `lines` can be joined and restored
+        with _splitlines() without changes
+    """
+    if not lines:
+        return False
+    for line in lines[:-1]:
+        if not line.endswith('\n'):
+            return False
+    text = ''.join(lines)
+    return text.count('\n') == len(lines) - (not lines[-1].endswith('\n'))
+
+
 class Hunk(object):
-    """ Parsed hunk data container (hunk starts with @@ -R +R @@) """
+    """ Parsed hunk data container (hunk starts with @@ -R +R @@)
+
+        In compact mode `text` is kept as (start, end) offsets into
+        a buffer shared by all hunks of a Patch and a new list of
+        lines is made every time `text` is read. Assign to `text`
+        to change it.
+    """
+
+    __slots__ = ('startsrc', 'linessrc', 'starttgt', 'linestgt', 'invalid',
+                 '_text', '_buffer', '_start', '_end')
 
     def __init__(self):
         self.startsrc = None #: line count starts with 1
@@ -208,6 +940,45 @@ class Hunk(object):
         self.invalid = False
         self.text = []
 
+    @property
+    def text(self):
+        if self._text is None:
+            text = self._buffer[self._start:self._end]
+            if not isinstance(text, str):
+                text = text.decode("utf-8", "replace")
+            return _splitlines(text)
+        return self._text
+
+    @text.setter
+    def text(self, lines):
+        self._text = lines
+        self._buffer = None
+
+    def __getstate__(self):
+        state = dict((name, getattr(self, name)) for name in self.__slots__ if hasattr(self, name))
+        if self._text is None and not isinstance(self._buffer, (str, bytes)):
+            # memory mapped files can't be pickled, keep only own span
+            state["_buffer"] = self._buffer[self._start:self._end]
+            state["_start"] = 0
+            state["_end"] = len(state["_buffer"])
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def reversed(self):
+        """ return new Hunk that undoes this one, with source and
+            target ranges and removed and added lines swapped
+        """
+        h = Hunk()
+        h.startsrc, h.linessrc = self.starttgt, self.linestgt
+        h.starttgt, h.linestgt = self.startsrc, self.linessrc
+        h.invalid = self.invalid
+        swap = {"-": "+", "+": "-"}
+        h.text = [swap[line[0]] + line[1:] if line[:1] in swap else line for line in self.text]
+        return h
+
 #  def apply(self, estream):
 #    """ write hunk data into enumerable stream
 #        return strings one by one until hunk is
@@ -222,6 +993,8 @@ class Hunk(object):
 class Patch(object):
     """ Patch for a single file """
 
+    __slots__ = ('source', 'target', 'hunks', 'hunkends', '_header', 'type')
+
     def __init__(self):
         self.source = None
         self.target = None
@@ -231,6 +1004,350 @@ class Patch(object):
 
         self.type = None
 
+    @property
+    def header(self):
+        if isinstance(self._header, list):
+            return self._header
+        return _splitlines(self._header)
+
+    @header.setter
+    def header(self, lines):
+        self._header = lines
+
+    def check_lines(self, lines, filename=None, i=0, total=1, fuzz=0, every=True):
+        """ find hunks in list of `lines` (with line ends) of
+            `filename`. Every hunk is checked against both source
+            and target side in one pass over the lines.
+
+            Hunks that are not found at their line are looked up
+            in the whole file with an index of its lines, and the
+            offset of a found hunk is carried to the next ones.
+            With `fuzz` up to that many leading and trailing
+            context lines of a hunk may be ignored. Hunks are not
+            changed, so one Patch can be checked from many threads.
+
+            `i` and `total` are number of the file and number of
+            files in the PatchSet for messages. Without `every` the
+            search stops as soon as the status of file is known.
+
+            return tuple (status, hunk statuses, found hunks), where
+            status is APPLICABLE, ALREADY_APPLIED or CONFLICT and
+            found hunks is a list of (line index, hunk text, offset
+            from startsrc, fuzz) to apply
+        """
+        filename = filename or self.target
+        stripped = [x.rstrip("\r\n") for x in lines]
+        index = []
+
+        def locate(text, skip, start, offset, lower):
+            """ return (position, fuzz, used text) of hunk side
+                or None if it is not found
+            """
+            for level in range(fuzz + 1):
+                used, lead = _fuzzed(text, level)
+                if level and len(used) == len(text):
+                    break
+                find = _hunkside(used, skip)
+                expected = _hunkstart(start, len(_hunkside(text, skip))) + lead
+                if stripped[expected + offset:expected + offset + len(find)] == find \
+                        and expected + offset >= lower and (find or expected + offset <= len(lines)):
+                    return expected + offset, level, used
+                if not index:
+                    index.append(_lineindex(stripped))
+                pos = _search(stripped, index[0], find, expected + offset, lower)
+                if pos is not None:
+                    return pos, level, used
+            return None
+
+        # hunk text may be decoded from a buffer on every access
+        texts = [h.text for h in self.hunks]
+        srcvalid = tgtvalid = True
+        # True while all hunks are found at their lines without fuzz
+        srcexact = tgtexact = True
+        premature = None
+        found = []
+        statuses = []
+        srcoffset = tgtoffset = srcend = tgtend = 0
+        for hno, (h, text) in enumerate(zip(self.hunks, texts)):
+            status = CONFLICT
+            # check hunk in source file
+            if srcvalid or every:
+                where = locate(text, "+", h.startsrc, srcoffset, srcend)
+                if where is None:
+                    hunkfind = _hunkside(text, "+")
+                    pos = _hunkstart(h.startsrc, len(hunkfind)) + srcoffset
+                    for n, expected in enumerate(hunkfind):
+                        if pos + n >= len(lines):
+                            if premature is None:
+                                premature = hno
+                            break
+                        if stripped[pos + n] != expected:
+                            info("file %d/%s:\t %s" % (i + 1, total, filename))
+                            info(" hunk no.%d doesn't match source file at line %d" % (hno + 1, pos + n))
+                            info("  expected: %s" % expected)
+                            info("  actual  : %s" % stripped[pos + n])
+                            break
+                    else:
+                        debug(" hunk no.%d for file %s overlaps previous hunk" % (hno + 1, filename))
+                    srcvalid = False
+                else:
+                    status = APPLICABLE
+                    pos, level, used = where
+                    lead = _fuzzed(text, level)[1]
+                    srcoffset = pos - lead - _hunkstart(h.startsrc, len(_hunkside(text, "+")))
+                    srcexact = srcexact and not (srcoffset or level)
+                    srcend = pos + len(_hunkside(used, "+"))
+                    found.append((pos, used, srcoffset, level))
+                    if srcoffset or level:
+                        info(" hunk no.%d for file %s found at line %d (offset %d lines, fuzz %d)"
+                             % (hno + 1, filename, pos + 1, srcoffset, level))
+                    else:
+                        debug(" hunk no.%d for file %s  -- is ready to be patched" % (hno + 1, filename))
+
+            # check hunk in target file, to see if it is already patched
+            if tgtvalid or every:
+                where = locate(text, "-", h.starttgt, tgtoffset, tgtend)
+                if where is None:
+                    debug("file is not patched - failed hunk: %d" % (hno + 1))
+                    tgtvalid = False
+                else:
+                    if status == CONFLICT:
+                        status = ALREADY_APPLIED
+                    pos, level, used = where
+                    tgtoffset = pos - _fuzzed(text, level)[1] - _hunkstart(h.starttgt, len(_hunkside(text, "-")))
+                    tgtexact = tgtexact and not (tgtoffset or level)
+                    tgtend = pos + len(_hunkside(used, "-"))
+
+            statuses.append(status)
+            if not srcvalid and not tgtvalid and not every:
+                break
+
+        if srcvalid and not srcexact and tgtvalid and tgtexact:
+            # hunks that moved may be found in patched file too
+            debug("hunks for file %s match the target side exactly" % filename)
+            srcvalid = False
+        if srcvalid:
+            return APPLICABLE, statuses, found
+
+        if premature is not None:
+            warning("premature end of source file %s at hunk %d" % (filename, premature + 1))
+        if tgtvalid:
+            return ALREADY_APPLIED, [ALREADY_APPLIED] * len(self.hunks), []
+        return CONFLICT, statuses, []
+
+    def patch_lines(self, lines, filename=None, i=0, total=1, fuzz=0):
+        """ apply hunks to list of `lines` (with line ends) of
+            `filename`, see check_lines(). New lines are made from
+            the same list. Line ends of the file are kept and used
+            for added lines if they are all the same. Nothing is
+            read or written.
+
+            return tuple (errors, new lines), new lines are None
+            if lines are already patched or on error
+        """
+        filename = filename or self.target
+        if not self.hunks:
+            debug("no hunks for file %s" % filename)
+            return 0, None
+
+        status, statuses, found = self.check_lines(lines, filename, i, total, fuzz, every=False)
+        if status == ALREADY_APPLIED:
+            warning("already patched  %s" % filename)
+            return 0, None
+        if status == CONFLICT:
+            warning("source file is different - %s" % filename)
+            return 1, None
+
+        newline = _lineend(lines)
+        output = []
+        srcpos = 0
+        for pos, text, _, _ in found:
+            output.extend(lines[srcpos:pos])
+            srcpos = pos
+            for n, hline in enumerate(text):
+                kind = hline[:1]
+                if kind == "-":
+                    srcpos += 1
+                elif kind == "+":
+                    line = hline[1:]
+                    if n + 1 < len(text) and text[n + 1][:1] == "\\":
+                        # \ No newline at end of file
+                        line = line.rstrip("\r\n")
+                    elif newline:
+                        line = line.rstrip("\r\n") + newline
+                    output.append(line)
+                elif kind != "\\":
+                    # context line is taken from file as is
+                    output.append(lines[srcpos])
+                    srcpos += 1
+        output.extend(lines[srcpos:])
+
+        return 0, output
+
+    def patch_ranges(self, data, filename=None, i=0, total=1):
+        """ find hunks in bytes-like `data` (e.g. mmap of a large
+            file) without splitting it into lines. Hunks are only
+            looked up at their lines, so file data is scanned by
+            C loops (counting line ends) and not by Python.
+
+            return list of pieces of new content, either (start,
+            end) range of `data` to copy as is, or bytes to write,
+            or None if the file has line ends other than "\n" or
+            hunks are not all found at their lines. Use
+            patch_lines() then, which gives the same result when
+            both work.
+        """
+        filename = filename or self.target
+        if not self.hunks or data.find(b"\r") != -1 or data.find(b"\n") == -1:
+            return None
+
+        texts = [h.text for h in self.hunks]
+        numbers = []
+        finds = []
+        end = 0
+        for h, text in zip(self.hunks, texts):
+            find = _hunkside(text, "+")
+            number = _hunkstart(h.startsrc, len(find))
+            if number < end:
+                return None
+            end = number + len(find)
+            numbers.append(number)
+            finds.append(b"\n".join(x.encode("utf-8", "surrogateescape") for x in find))
+
+        size = len(data)
+        offsets = _lineoffsets(data, numbers)
+        for hno, (pos, find, text) in enumerate(zip(offsets, finds, texts)):
+            if pos is None:
+                return None
+            if _hunkside(text, "+"):
+                stop = pos + len(find)
+                if data[pos:stop] != find or stop != size and data[stop:stop + 1] != b"\n":
+                    return None
+            debug(" hunk no.%d for file %s  -- is ready to be patched" % (hno + 1, filename))
+
+        def nextline(pos):
+            pos = data.find(b"\n", pos)
+            return size if pos == -1 else pos + 1
+
+        pieces = []
+        srcpos = 0
+        for pos, text in zip(offsets, texts):
+            if pos > srcpos:
+                pieces.append((srcpos, pos))
+            srcpos = pos
+            output = []
+            for n, hline in enumerate(text):
+                kind = hline[:1]
+                if kind == "-":
+                    srcpos = nextline(srcpos)
+                elif kind == "+":
+                    line = hline[1:].rstrip("\r\n")
+                    if not (n + 1 < len(text) and text[n + 1][:1] == "\\"):
+                        line += "\n"
+                    output.append(line.encode("utf-8", "surrogateescape"))
+                elif kind != "\\":
+                    # context line is taken from file as is
+                    output.append(data[srcpos:nextline(srcpos)])
+                    srcpos = nextline(srcpos)
+            if output:
+                pieces.append(b"".join(output))
+        if srcpos < size:
+            pieces.append((srcpos, size))
+        return pieces
+
+    def apply_to_text(self, text, fuzz=0):
+        """ return `text` (str or bytes) with hunks applied, the
+            same `text` if it is already patched, or False if the
+            hunks do not match. No files are touched. For `fuzz`
+            see patch_lines().
+        """
+        errors, text = self._patch_text(text, fuzz=fuzz)
+        if errors:
+            return False
+        return text
+
+    def _patch_text(self, text, filename=None, i=0, total=1, fuzz=0):
+        """ patch_lines() for str or bytes `text`, return tuple
+            (errors, new text)
+        """
+        data = text
+        if isinstance(text, bytes):
+            data = text.decode("utf-8", "surrogateescape")
+        errors, output = self.patch_lines(StringIO(data, newline="").readlines(), filename, i, total, fuzz)
+        if output is None:
+            return errors, text
+        data = "".join(output)
+        if isinstance(text, bytes):
+            return errors, data.encode("utf-8", "surrogateescape")
+        return errors, data
+
+    def reversed(self):
+        """ return new Patch that undoes this one, see
+            Hunk.reversed()
+        """
+        p = Patch()
+        p.source, p.target = self.target, self.source
+        p.hunks = [h.reversed() for h in self.hunks]
+        p.hunkends = self.hunkends.copy()
+        p.header = list(self.header)
+        p.type = self.type
+        return p
+
+    def compact(self):
+        """ store texts of all hunks in one buffer and header
+            as a single string, see Hunk
+        """
+        if _joinable(self._header):
+            self._header = ''.join(self._header)
+
+        lines = []
+        spans = []
+        for h in self.hunks:
+            text = h.text
+            spans.append((len(lines), len(lines) + len(text)))
+            lines.extend(text)
+        if not _joinable(lines):
+            return
+        buffer = ''.join(lines)
+        offsets = [0]
+        offsets.extend(accumulate(len(line) for line in lines))
+        for h, (start, end) in zip(self.hunks, spans):
+            h._text = None
+            h._buffer = buffer
+            h._start = offsets[start]
+            h._end = offsets[end]
+
+
+class CheckResult(object):
+    """ Status of a Patch made by PatchSet.check() """
+
+    __slots__ = ('patch', 'filename', 'status', 'hunks')
+
+    def __init__(self, patch, filename, status, hunks):
+        self.patch = patch
+        self.filename = filename  #: None if file is not found
+        self.status = status      #: APPLICABLE, ALREADY_APPLIED, CONFLICT or MISSING
+        self.hunks = hunks        #: status of every hunk
+
+    def __repr__(self):
+        return "CheckResult(%r, %r, %r)" % (self.filename or self.patch.target, self.status, self.hunks)
+
+
+class ApplyResult(object):
+    """ Result of PatchSet.apply(), true if the patch is applied """
+
+    __slots__ = ('success', 'changed')
+
+    def __init__(self, success, changed):
+        self.success = success  #: True if there were no errors
+        self.changed = changed  #: absolute names of written files
+
+    def __bool__(self):
+        return self.success
+
+    def __repr__(self):
+        return "ApplyResult(%r, %r)" % (self.success, self.changed)
+
 
 # noinspection SpellCheckingInspection
 class PatchSet(object):
@@ -249,21 +1366,160 @@ class PatchSet(object):
         self.warnings = 0  # non-critical warnings
         # --- /API ---
 
+        # stream that is not parsed yet and iterparse() options
+        # for it (see stream() method)
+        self._stream = None
+        self._streamopts = {}
+        # True if last parsed stream ended with a complete hunk
+        self._complete = False
+        # number of patches before the parsed stream, see _parse_chunk()
+        self._first = 0
+
         if stream:
             self.parse(stream)
 
     def __len__(self):
         return len(self.items)
 
+    def __iter__(self):
+        """ iterate over Patch objects, parsing pending
+            stream (if any) on the fly
+        """
+        if self._stream is None:
+            return iter(self.items)
+        stream, self._stream = self._stream, None
+        return self.iterparse(stream, **self._streamopts)
+
+    def stream(self, stream, **options):
+        """ attach stream to be parsed lazily when PatchSet
+            is iterated. Parsed patches are not stored in
+            `items`, so memory is only used for the file
+            section that is currently processed.
+
+            `options` are passed to iterparse()
+        """
+        self._stream = stream
+        self._streamopts = options
+
+    def reversed(self):
+        """ return new PatchSet that undoes this one. Patches are
+            reversed in the opposite order, so that a file changed
+            by several of them is restored step by step. Pending
+            stream is parsed.
+        """
+        patchset = PatchSet()
+        patchset.name = self.name
+        patchset.type = self.type
+        patchset.items = [p.reversed() for p in self][::-1]
+        return patchset
+
     def __str__(self):
         """Return a string representation of this PatchSet."""
         items_str = '[' + ', '.join(f"Patch(source='{p.source}', target='{p.target}')" for p in self.items) + ']'
         return f"PatchSet(type={self.type or 'None'}, items={items_str})"
 
-    def parse(self, stream):
+    def parse(self, stream, engine=None, compact=False, buffer=None, workers=None):
         """ parse unified diff
             return True on success
+
+            With `workers` greater than 1 the stream is read in
+            memory, split at file boundaries and the parts are
+            parsed by a pool of processes (fast engine only).
+            Results are the same as for a serial parse.
         """
+        nitems = len(self.items)
+        if workers and workers > 1 and (engine or parser_engine) == "fast":
+            self._parse_parallel(stream, compact, workers)
+        else:
+            for p in self.iterparse(stream, engine, compact, buffer):
+                self.items.append(p)
+        # stream without any patch data is not an error, but not a success either
+        return (self.errors == 0 and len(self.items) > nitems)
+
+    def _parse_parallel(self, stream, compact, workers):
+        """ parse stream in parts with a process pool
+
+            Stream is split before headers of files that follow a
+            hunk. Every part is parsed from scratch, which gives
+            the same results as a serial parse when all but the
+            last part end with a complete hunk and every part but
+            the first has patches. If that is not the case the
+            stream is parsed serially.
+        """
+        lines = list(stream)
+        bounds = _split_points(lines, min(workers * 4, len(lines) // _MIN_CHUNK_LINES))
+        if not bounds:
+            for p in self.iterparse(lines, "fast", compact):
+                self.items.append(p)
+            return
+
+        empty = lines[0][:0]
+        starts = [0] + bounds
+        ends = bounds + [len(lines)]
+        chunks = [empty.join(lines[s:e]) for s, e in zip(starts, ends)]
+        # patches expected in every part and before it
+        counts = [_countpatches(lines, s, e) for s, e in zip(starts, ends)]
+        firsts = [sum(counts[:idx]) for idx in range(len(counts))]
+        debug("parsing %d parts with %d workers" % (len(chunks), workers))
+
+        from concurrent.futures import ProcessPoolExecutor
+        level = logger.getEffectiveLevel()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_parse_chunk, chunks,
+                                        [compact] * len(chunks), [level] * len(chunks), firsts))
+
+        last = len(results) - 1
+        for idx, (items, errors, warnings, complete, records) in enumerate(results):
+            # a part with other patches than counted has wrong numbers in messages
+            if (idx < last and not complete) or (idx > 0 and not items) or len(items) != counts[idx]:
+                debug("part %d can not be parsed separately, parsing serially" % (idx + 1))
+                for p in self.iterparse(lines, "fast", compact):
+                    self.items.append(p)
+                return
+
+        self.errors = 0
+        types = set()
+        for items, errors, warnings, complete, records in results:
+            for level, msg in records:
+                logger.log(level, msg)
+            self.items.extend(items)
+            self.errors += errors
+            self.warnings += warnings
+            types.update(p.type for p in items)
+        if types:
+            self.type = MIXED if len(types) > 1 else types.pop()
+
+    def iterparse(self, stream, engine=None, compact=False, buffer=None):
+        """ parse unified diff and yield Patch objects as soon
+            as each file section is complete. Type detection and
+            filename normalization are done for every Patch before
+            it is yielded, `type`, `errors` and `warnings` of the
+            PatchSet are updated along the way.
+
+            `engine` is "fast" or "legacy", module level
+            `parser_engine` is used by default. With `compact`
+            set every Patch is compacted before it is yielded.
+
+            Stream may yield bytes instead of text (fast engine
+            only). `buffer` is a bytes-like object (e.g. mmap)
+            when the lines are consecutive slices of it, hunks
+            then refer to the buffer instead of keeping lines.
+        """
+        engine = engine or parser_engine
+        if engine == "fast":
+            patches = self._iterparse_fast(stream, buffer)
+        elif engine == "legacy":
+            if buffer is not None:
+                raise ValueError("legacy parser engine supports only text streams")
+            patches = self._iterparse_legacy(stream)
+        else:
+            raise ValueError("unknown parser engine '%s'" % engine)
+        if compact:
+            return _compacted(patches)
+        return patches
+
+    def _iterparse_legacy(self, stream):
+        """ original line-by-line state machine parser """
         lineends = dict(lf=0, crlf=0, cr=0)
         nexthunkno = 0    #: even if index starts with 0 user messages number hunks from 1
 
@@ -330,6 +1586,12 @@ class PatchSet(object):
         srcname = None
         tgtname = None
 
+        # number of Patch objects yielded so far and their types
+        nitems = 0
+        types = set()
+        # True when current Patch is already yielded
+        pdone = False
+
         # start of main cycle
         # each parsing block already has line available in fe.line
         fe = wrapumerate(stream)
@@ -338,13 +1600,22 @@ class PatchSet(object):
             # -- deciders: these only switch state to decide who should process
             # --           line fetched at the start of this cycle
             if hunkparsed:
+                if fe.line[:1] in ("\\", b"\\"):
+                    # \ No newline at end of file after the last hunk line
+                    hunk.text.append(fe.line)
+                    continue
                 hunkparsed = False
                 if re_hunk_start.match(fe.line):
                     hunkhead = True
-                elif fe.line.startswith("--- "):
-                    filenames = True
                 else:
-                    headscan = True
+                    if fe.line.startswith("--- "):
+                        filenames = True
+                    else:
+                        headscan = True
+                    # no more hunks for this file, release it
+                    pdone = True
+                    yield self._finish_patch(p, nitems, types)
+                    nitems += 1
                 # -- ------------------------------------
 
             # read out header
@@ -521,9 +1792,11 @@ class PatchSet(object):
                             filenames = False
                             headscan = True
                         else:
-                            if p: # for the first run p is None
-                                self.items.append(p)
+                            if p and not pdone: # for the first run p is None
+                                yield self._finish_patch(p, nitems, types)
+                                nitems += 1
                             p = Patch()
+                            pdone = False
                             p.source = srcname
                             srcname = None
                             p.target = match.group(1).strip()
@@ -573,45 +1846,338 @@ class PatchSet(object):
 
         # /while fe.next()
 
-        if p:
-            self.items.append(p)
+        if p and not pdone:
+            yield self._finish_patch(p, nitems, types)
+            nitems += 1
 
         if not hunkparsed:
             if hunkskip:
                 warning("warning: finished with errors, some hunks may be invalid")
             elif headscan:
-                if len(self.items) == 0:
+                if nitems == 0:
                     warning("error: no patch data found!")
-                    return False
+                    return
                 else: # extra data at the end of file
                     pass
             else:
                 warning("error: patch stream is incomplete!")
                 self.errors += 1
-                if len(self.items) == 0:
-                    return False
+                if nitems == 0:
+                    return
 
-        if debugmode and len(self.items) > 0:
+        if debugmode and nitems > 0:
             debug("- %2d hunks for %s" % (len(p.hunks), p.source))
 
-        # XXX fix total hunks calculation
-        debug("total files: %d  total hunks: %d" % (len(self.items),
-                                                    sum(len(p.hunks) for p in self.items)))
+        debug("total files: %d" % nitems)
 
-        # ---- detect patch and patchset types ----
-        for idx, p in enumerate(self.items):
-            self.items[idx].type = self._detect_type(p)
+    def _iterparse_fast(self, stream, buffer=None):
+        """ table-driven parser that gives the same results as
+            _iterparse_legacy(). Hunk bodies, which hold most of
+            the lines, are consumed in a tight inner loop that
+            dispatches on the first character of every line.
 
-        types = set([p.type for p in self.items])
-        if len(types) > 1:
-            self.type = MIXED
+            Stream may also yield bytes. Filenames and headers are
+            decoded from UTF-8 then. If the lines are consecutive
+            slices of `buffer`, hunks refer to their text in the
+            buffer and decode it only when it is accessed.
+        """
+        # peek at the first line to find out the type of lines,
+        # inner loops consume `it` after the first line is taken
+        it = iter(stream)
+        line = next(it, None)
+        if line is None:
+            lines, line = (), ""
         else:
-            self.type = types.pop()
-            # --------
+            lines = chain((line,), it)
+        g = _GRAMMAR[type(line)]
+        hunk_start = g["hunk_start"]
+        srcname_match = g["srcname"]
+        tgtname_match = g["tgtname"]
+        hunkline = g["hunkline"]
+        context = hunkline[g["space"]]
+        SRC, TGT, CRLF, LF, CR, EOL, SPACE = (g["src"], g["tgt"], g["crlf"], g["lf"],
+                                              g["cr"], g["crlf"], g["space"])
+        NONEWLINE = g["nonewline"]
+        binary = isinstance(line, bytes)
+        if binary and buffer is None:
+            buffer = False
 
-        self._normalize_filenames()
+        self.errors = 0
+        header = []
+        srcname = None
 
-        return (self.errors == 0)
+        p = None
+        hunk = None
+        nexthunkno = 0
+        nitems = 0
+        types = set()
+        pdone = False
+
+        # line ends in hunks of the current Patch
+        lf = crlf = cr = 0
+        # hunk lines seen so far and expected
+        srcseen = tgtseen = linessrc = linestgt = 0
+        # hunk skip flag that is left over by a hunk that is both
+        # invalid and complete (only affects final warning)
+        skipping = False
+        lineno = -1
+        # offsets of the current and the next line in buffer
+        pos = nextpos = 0
+
+        state = _HEADSCAN
+        for line in lines:
+            lineno += 1
+            pos = nextpos
+            nextpos += len(line)
+
+            if state == _HUNKPARSED:
+                if line.startswith(NONEWLINE):
+                    # \ No newline at end of file after the last hunk line
+                    if hunk._text is None:
+                        # hunk is a span of buffer that the line follows
+                        hunk._end = nextpos
+                    else:
+                        hunk.text.append(line.decode("utf-8", "replace") if binary else line)
+                    continue
+                if hunk_start(line):
+                    state = _HUNKHEAD
+                    skipping = False
+                else:
+                    if line.startswith(SRC):
+                        state = _FILENAMES
+                        skipping = False
+                    else:
+                        state = _HEADSCAN
+                    # no more hunks for this file, release it
+                    pdone = True
+                    yield self._finish_patch(p, nitems, types)
+                    nitems += 1
+
+            if state == _HEADSCAN:
+                if not line.startswith(SRC):
+                    header.append(line)
+                    for line in it:
+                        lineno += 1
+                        pos = nextpos
+                        nextpos += len(line)
+                        if line.startswith(SRC):
+                            break
+                        header.append(line)
+                    else:
+                        if p is None:
+                            debug("no patch data found")  # error is shown later
+                            self.errors += 1
+                        else:
+                            info("%d unparsed bytes left at the end of stream" % sum(map(len, header)))
+                            self.warnings += 1
+                        break
+                state = _FILENAMES
+                skipping = False
+
+            if state == _HUNKBODY:
+                text = hunk.text
+                append = text.append
+                bodystart = lineno
+                expanded = 0
+                valid = True
+                for line in chain((line,), it):
+                    d = hunkline.get(line[:1])
+                    if d is None:
+                        if line.strip(EOL):
+                            valid = False
+                            break
+                        debug("expanding empty line in a middle of hunk body")
+                        self.warnings += 1
+                        expanded += 1
+                        line = SPACE + line
+                        d = context
+                    if line.endswith(CRLF):
+                        crlf += 1
+                    elif line.endswith(LF):
+                        lf += 1
+                    elif line.endswith(CR):
+                        cr += 1
+                    srcseen += d[0]
+                    tgtseen += d[1]
+                    append(line)
+                    if srcseen >= linessrc or tgtseen >= linestgt:
+                        if srcseen > linessrc or tgtseen > linestgt:
+                            break
+                        if srcseen == linessrc and tgtseen == linestgt:
+                            break
+                else:
+                    # end of stream in the middle of hunk
+                    valid = None
+
+                ends = p.hunkends
+                ends["lf"], ends["crlf"], ends["cr"] = lf, crlf, cr
+                if binary:
+                    # hunk text is either a span of buffer or decoded lines
+                    bodyend = pos + sum(map(len, text)) - expanded
+                    if buffer is not False and not expanded:
+                        hunk._text = None
+                        hunk._buffer = buffer
+                        hunk._start = pos
+                        hunk._end = bodyend
+                    else:
+                        hunk.text = [x.decode("utf-8", "replace") for x in text]
+                    pos = bodyend
+                    nextpos = bodyend if valid else bodyend + len(line)
+                if valid is None:
+                    break
+
+                if valid:
+                    lineno = bodystart + len(text) - 1
+                    if srcseen > linessrc or tgtseen > linestgt:
+                        warning("extra lines for hunk no.%d at %d for target %s" % (nexthunkno, lineno + 1, p.target))
+                        hunk.invalid = True
+                        p.hunks.append(hunk)
+                        self.errors += 1
+                        state = _HUNKSKIP
+                    else:
+                        state = _HUNKPARSED
+                else:
+                    lineno = bodystart + len(text)
+                    warning("invalid hunk no.%d at %d for target file %s" % (nexthunkno, lineno + 1, p.target))
+                    hunk.invalid = True
+                    p.hunks.append(hunk)
+                    self.errors += 1
+                    state = _HUNKSKIP
+                    if srcseen == linessrc and tgtseen == linestgt:
+                        # empty hunk followed by invalid line is also complete
+                        state = _HUNKPARSED
+                        skipping = True
+
+                if state == _HUNKPARSED:
+                    # hunk parsed successfully
+                    p.hunks.append(hunk)
+                    # detect mixed window/unix line ends
+                    if ((cr != 0) + (crlf != 0) + (lf != 0)) > 1:
+                        warning("inconsistent line ends in patch hunks for %s" % p.source)
+                        self.warnings += 1
+                    if debugmode:
+                        debug("crlf: %d  lf: %d  cr: %d\t - file: %s hunk: %d" % (crlf, lf, cr, p.target, nexthunkno))
+                    continue
+
+            if state == _HUNKSKIP:
+                if hunk_start(line):
+                    state = _HUNKHEAD
+                elif line.startswith(SRC):
+                    state = _FILENAMES
+                    if debugmode and nitems > 0:
+                        debug("- %2d hunks for %s" % (len(p.hunks), p.source))
+                else:
+                    continue
+                skipping = False
+
+            if state == _FILENAMES:
+                if line.startswith(SRC):
+                    if srcname is not None:
+                        warning("skipping false patch for %s" % srcname)
+                        srcname = None
+                    match = srcname_match(line)
+                    if match:
+                        srcname = match.group(1).strip()
+                        if binary:
+                            srcname = srcname.decode("utf-8", "replace")
+                    else:
+                        warning("skipping invalid filename at line %d" % lineno)
+                        self.errors += 1
+                        state = _HEADSCAN
+                elif not line.startswith(TGT):
+                    if srcname is not None:
+                        warning("skipping invalid patch with no target for %s" % srcname)
+                        self.errors += 1
+                        srcname = None
+                    else:
+                        # this should be unreachable
+                        warning("skipping invalid target patch")
+                    state = _HEADSCAN
+                else:
+                    match = tgtname_match(line)
+                    if not match:
+                        warning("skipping invalid patch - no target filename at line %d" % lineno)
+                        self.errors += 1
+                        srcname = None
+                        state = _HEADSCAN
+                    else:
+                        if p and not pdone:
+                            yield self._finish_patch(p, nitems, types)
+                            nitems += 1
+                        p = Patch()
+                        pdone = False
+                        p.source = srcname
+                        srcname = None
+                        p.target = match.group(1).strip()
+                        if binary:
+                            p.target = p.target.decode("utf-8", "replace")
+                            header = [x.decode("utf-8", "replace") for x in header]
+                        p.header = header
+                        header = []
+                        p.hunkends = dict(lf=0, crlf=0, cr=0)
+                        lf = crlf = cr = 0
+                        nexthunkno = 0
+                        state = _HUNKHEAD
+                continue
+
+            if state == _HUNKHEAD:
+                match = hunk_start(line)
+                if not match:
+                    if not p.hunks:
+                        warning("skipping invalid patch with no hunks for file %s" % p.source)
+                        self.errors += 1
+                    state = _HEADSCAN
+                    continue
+                hunk = Hunk()
+                hunk.startsrc = int(match.group(1))
+                linessrc = int(match.group(3)) if match.group(3) else 1
+                hunk.linessrc = linessrc
+                hunk.starttgt = int(match.group(4))
+                linestgt = int(match.group(6)) if match.group(6) else 1
+                hunk.linestgt = linestgt
+                srcseen = tgtseen = 0
+                state = _HUNKBODY
+                nexthunkno += 1
+
+        if p and not pdone:
+            yield self._finish_patch(p, nitems, types)
+            nitems += 1
+
+        # stream ended right after a complete hunk, this is what
+        # parallel parsing checks when it splits the stream
+        self._complete = (state == _HUNKPARSED and not skipping)
+
+        if state != _HUNKPARSED:
+            if state == _HUNKSKIP or skipping:
+                warning("warning: finished with errors, some hunks may be invalid")
+            elif state == _HEADSCAN:
+                if nitems == 0:
+                    warning("error: no patch data found!")
+                    return
+            else:
+                warning("error: patch stream is incomplete!")
+                self.errors += 1
+                if nitems == 0:
+                    return
+
+        if debugmode and nitems > 0:
+            debug("- %2d hunks for %s" % (len(p.hunks), p.source))
+
+        debug("total files: %d" % nitems)
+
+    def _finish_patch(self, p, idx, types):
+        """ detect type and normalize filenames of the Patch
+            number `idx` (counting from 0), update PatchSet type
+            with it and return the Patch back
+        """
+        p.type = self._detect_type(p)
+        types.add(p.type)
+        if len(types) > 1:
+            self.type = MIXED
+        else:
+            self.type = p.type
+        self._normalize_patch(p, self._first + idx)
+        return p
 
     def _detect_type(self, p):
         """ detect and return type for the specified Patch object
@@ -686,49 +2252,52 @@ class PatchSet(object):
             return None
         """
         for i, p in enumerate(self.items):
-            if p.type in (HG, GIT):
-                # TODO: figure out how to deal with /dev/null entries
-                debug("stripping a/ and b/ prefixes")
-                if p.source != '/dev/null':
-                    if not p.source.startswith("a/"):
-                        warning("invalid source filename")
-                    else:
-                        p.source = p.source[2:]
-                if p.target != '/dev/null':
-                    if not p.target.startswith("b/"):
-                        warning("invalid target filename")
-                    else:
-                        p.target = p.target[2:]
-
-            p.source = xnormpath(p.source)
-            p.target = xnormpath(p.target)
-
-            sep = '/'  # sep value can be hardcoded, but it looks nice this way
-
-            # references to parent are not allowed
-            if p.source.startswith(".." + sep):
-                warning("error: stripping parent path for source file patch no.%d" % (i + 1))
-                self.warnings += 1
-                while p.source.startswith(".." + sep):
-                    p.source = p.source.partition(sep)[2]
-            if p.target.startswith(".." + sep):
-                warning("error: stripping parent path for target file patch no.%d" % (i + 1))
-                self.warnings += 1
-                while p.target.startswith(".." + sep):
-                    p.target = p.target.partition(sep)[2]
-                # absolute paths are not allowed
-            if xisabs(p.source) or xisabs(p.target):
-                warning("warning: absolute paths are not allowed (but who cares) - file no.%d" % (i + 1))
-                self.warnings += 1
-                if xisabs(p.source):
-                    warning("stripping absolute path from source name '%s'" % p.source)
-                    p.source = xstrip(p.source)
-                if xisabs(p.target):
-                    warning("stripping absolute path from target name '%s'" % p.target)
-                    p.target = xstrip(p.target)
-
-            self.items[i].source = p.source
-            self.items[i].target = p.target
+            self._normalize_patch(p, i)
+
+    def _normalize_patch(self, p, i):
+        """ sanitize filenames of a single Patch number `i`
+            (counting from 0), see _normalize_filenames()
+        """
+        if p.type in (HG, GIT):
+            # TODO: figure out how to deal with /dev/null entries
+            debug("stripping a/ and b/ prefixes")
+            if p.source != '/dev/null':
+                if not p.source.startswith("a/"):
+                    warning("invalid source filename")
+                else:
+                    p.source = p.source[2:]
+            if p.target != '/dev/null':
+                if not p.target.startswith("b/"):
+                    warning("invalid target filename")
+                else:
+                    p.target = p.target[2:]
+
+        p.source = xnormpath(p.source)
+        p.target = xnormpath(p.target)
+
+        sep = '/'  # sep value can be hardcoded, but it looks nice this way
+
+        # references to parent are not allowed
+        if p.source.startswith(".." + sep):
+            warning("error: stripping parent path for source file patch no.%d" % (i + 1))
+            self.warnings += 1
+            while p.source.startswith(".." + sep):
+                p.source = p.source.partition(sep)[2]
+        if p.target.startswith(".." + sep):
+            warning("error: stripping parent path for target file patch no.%d" % (i + 1))
+            self.warnings += 1
+            while p.target.startswith(".." + sep):
+                p.target = p.target.partition(sep)[2]
+            # absolute paths are not allowed
+        if xisabs(p.source) or xisabs(p.target):
+            warning("warning: absolute paths are not allowed (but who cares) - file no.%d" % (i + 1))
+            self.warnings += 1
+            if xisabs(p.source):
+                warning("stripping absolute path from source name '%s'" % p.source)
+                p.source = xstrip(p.source)
+            if xisabs(p.target):
+                warning("stripping absolute path from target name '%s'" % p.target)
+                p.target = xstrip(p.target)
 
 
     def diffstat(self):
@@ -784,12 +2353,72 @@ class PatchSet(object):
                    % (len(names), sum(insert), sum(delete)))
         return output
 
-    def apply(self, strip=0):
+    def apply(self, strip=0, engine=None, workers=None, fuzz=0, durability=None,
+              transactional=False, reverse=False, root=None, dir_fd=None):
         """ apply parsed patch
-            return True on success
+            return ApplyResult, which is true on success
+
+            `engine` is "fused" or "legacy", module level
+            `apply_engine` is used by default
+
+            Fused engine finds hunks that moved in the file and
+            ignores up to `fuzz` context lines of a hunk if it does
+            not match otherwise, see Patch.patch_lines(). It writes
+            patched files to a temp file that replaces the original,
+            `durability` is one of DURABILITY_MODES (module level
+            `apply_durability` by default).
+
+            With `workers` greater than 1 files are patched by a
+            pool of threads. Log messages and errors are reported
+            in the order of files all the same. Patches are applied
+            serially when two of them may refer to the same file,
+            and for streamed PatchSet.
+
+            With `transactional` set (fused engine only) new content
+            of all files is made in memory and written to temp files
+            first. The temp files replace the originals only if
+            there were no errors, otherwise nothing is changed.
+
+            With `reverse` set the patch is reverted instead, see
+            reversed(). Files that are already reverted are left
+            as they are, just like already patched ones.
+
+            File names are relative to directory `root` instead of
+            the working directory, which is never changed. Neither
+            are the PatchSet and its hunks, so one parsed (not
+            streamed) PatchSet can be applied to different
+            directories from many threads at once. With open
+            directory `dir_fd` (fused engine only, on platforms
+            where os functions take dir_fd) `root` and file names
+            are relative to it: files are opened, created, renamed
+            and removed with the dir_fd arguments of os functions.
+
+            Names of written files are returned in `changed` of the
+            result, absolute ones unless `dir_fd` is given.
         """
+        if reverse:
+            return self.reversed().apply(strip, engine, workers, fuzz, durability, transactional,
+                                         root=root, dir_fd=dir_fd)
+
+        root = _rootpath(root, dir_fd)
+        changed = []
+        engine = engine or apply_engine
+        if engine == "fused":
+            mode = durability or apply_durability
+            if mode not in DURABILITY_MODES:
+                raise ValueError("unknown durability mode '%s'" % mode)
+            apply_file = functools.partial(self._apply_fused, fuzz=fuzz, durability=mode, dir_fd=dir_fd)
+            if transactional:
+                # {real path: (original lines, new lines)}
+                staged = {}
+                apply_file = functools.partial(self._stage_fused, staged=staged, fuzz=fuzz, dir_fd=dir_fd)
+        elif engine == "legacy":
+            if fuzz or durability or transactional or dir_fd is not None:
+                raise ValueError("legacy apply engine does not support fuzz, durability, transactions and dir_fd")
+            apply_file = self._apply_legacy
+        else:
+            raise ValueError("unknown apply engine '%s'" % engine)
 
-        total = len(self.items)
         errors = 0
         if strip:
             # [ ] test strip level exceeds nesting level
@@ -802,122 +2431,415 @@ class PatchSet(object):
                 warning("error: strip parameter '%s' must be an integer" % strip)
                 strip = 0
 
-        #for fileno, filename in enumerate(self.source):
-        for i, p in enumerate(self.items):
-            f2patch = p.source
-            debug("applying patch to '%s'" % f2patch)
+        if workers and workers > 1 and self._stream is None and self._independent(strip, root):
+            errors += self._apply_parallel(strip, apply_file, workers, changed, root, dir_fd)
+        else:
+            # number of files is not known in advance for streamed PatchSet
+            total = len(self.items) if self._stream is None else '?'
+            #for fileno, filename in enumerate(self.source):
+            for i, p in enumerate(self):
+                errors += self._apply_item(p, i, total, strip, apply_file, changed, root, dir_fd)
+
+        if transactional:
+            if errors:
+                warning("patch set is not applied, no files are changed")
+            else:
+                errors += self._commit(staged, mode, changed, dir_fd)
+
+        # todo: check for premature eof
+        return ApplyResult(errors == 0, changed)
+
+
+    def _apply_item(self, p, i, total, strip, apply_file, changed, root=None, dir_fd=None):
+        """ find file for Patch `p` and apply it with `apply_file`
+            method, which adds written files to list `changed`,
+            return number of errors
+        """
+        filename = self._resolve(p, i, total, strip, root, dir_fd)
+        if filename is None:
+            return 1
+        return apply_file(p, filename, i, total, changed)
+
+
+    def _resolve(self, p, i, total, strip, root=None, dir_fd=None):
+        """ return name of existing file for Patch `p` (joined to
+            directory `root`, relative to `dir_fd`), or None
+        """
+        import stat
+
+        f2patch = p.source
+        debug("applying patch to '%s'" % f2patch)
+        if strip:
+            debug("stripping %s leading component from '%s'" % (strip, f2patch))
+            f2patch = pathstrip(f2patch, strip)
+        if root is not None:
+            f2patch = os.path.join(root, f2patch)
+        st = _filestat(f2patch, dir_fd)
+        if st is None:
+            f2patch = p.target
             if strip:
                 debug("stripping %s leading component from '%s'" % (strip, f2patch))
                 f2patch = pathstrip(f2patch, strip)
-            if not os.path.exists(f2patch):
-                f2patch = p.target
+            if root is not None:
+                f2patch = os.path.join(root, f2patch)
+            st = _filestat(f2patch, dir_fd)
+            if st is None:
+                warning("source/target file does not exist\n--- %s\n+++ %s" % (p.source, f2patch))
+                return None
+        if not stat.S_ISREG(st.st_mode):
+            warning("not a file - %s" % f2patch)
+            return None
+
+        debug("processing %d/%s:\t %s" % (i + 1, total, f2patch))
+        return f2patch
+
+
+    def check(self, strip=0, fuzz=0, reverse=False, root=None, dir_fd=None):
+        """ check if patch can be applied without changing any
+            file, see Patch.check_lines(). Every file is only read,
+            once. With `reverse` set check if it can be reverted.
+            For `root` and `dir_fd` see apply().
+
+            return list of CheckResult, one for every Patch
+        """
+        if reverse:
+            return self.reversed().check(strip, fuzz, root=root, dir_fd=dir_fd)
+        root = _rootpath(root, dir_fd)
+        if strip:
+            strip = int(strip)
+        results = []
+        total = len(self.items) if self._stream is None else '?'
+        for i, p in enumerate(self):
+            filename = self._resolve(p, i, total, strip, root, dir_fd)
+            if filename is None:
+                results.append(CheckResult(p, None, MISSING, [MISSING] * len(p.hunks)))
+                continue
+            with open(filename, "r", encoding="utf-8", errors="surrogateescape", newline="",
+                      opener=_opener(dir_fd)) as fp:
+                lines = fp.readlines()
+            status, statuses, _ = p.check_lines(lines, filename, i, total, fuzz)
+            debug("file %d/%s:\t %s is %s" % (i + 1, total, filename, status))
+            results.append(CheckResult(p, filename, status, statuses))
+        return results
+
+
+    def _independent(self, strip, root=None):
+        """ return True if no two items can resolve to the same
+            file (either of source and target name may be used)
+        """
+        seen = set()
+        for p in self.items:
+            names = set()
+            for name in (p.source, p.target):
                 if strip:
-                    debug("stripping %s leading component from '%s'" % (strip, f2patch))
-                    f2patch = pathstrip(f2patch, strip)
-                if not os.path.exists(f2patch):
-                    warning("source/target file does not exist\n--- %s\n+++ %s" % (p.source, f2patch))
-                    errors += 1
-                    continue
-            if not isfile(f2patch):
-                warning("not a file - %s" % f2patch)
+                    name = pathstrip(name, strip)
+                if root is not None:
+                    name = os.path.join(root, name)
+                names.add(os.path.normcase(abspath(name)))
+            if names & seen:
+                debug("patches for %s may change the same file, applying serially" % p.target)
+                return False
+            seen.update(names)
+        return True
+
+
+    def _apply_parallel(self, strip, apply_file, workers, changed, root=None, dir_fd=None):
+        """ apply items with a thread pool, replay their log
+            records and add their written files to `changed` in
+            order, return number of errors
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        total = len(self.items)
+        debug("applying %d patches with %d workers" % (total, workers))
+        written = [[] for p in self.items]
+        collector = _ThreadRecords()
+        logger.addFilter(collector)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(collector.collect, self._apply_item,
+                                           p, i, total, strip, apply_file, written[i], root, dir_fd)
+                           for i, p in enumerate(self.items)]
+                results = [f.result() for f in futures]
+        finally:
+            logger.removeFilter(collector)
+
+        errors = 0
+        for (nerrors, records), names in zip(results, written):
+            for level, msg in records:
+                logger.log(level, msg)
+            errors += nerrors
+            changed.extend(names)
+        return errors
+
+
+    def apply_to_mapping(self, mapping, strip=0, fuzz=0):
+        """ apply patch to contents of files given as a mapping
+            {path: content}, where content is str or bytes. Paths
+            are looked up like file names in apply(), both as they
+            are and normalized. Nothing is read or written. For
+            `fuzz` see Patch.patch_lines().
+
+            return new dict {path: new content} with all paths of
+            `mapping`, or False if there were errors
+        """
+        def normalized(path):
+            return xnormpath(path.replace("\\", "/"))
+
+        result = dict(mapping)
+        paths = dict((normalized(path), path) for path in mapping)
+        total = len(self.items) if self._stream is None else '?'
+        errors = 0
+        for i, p in enumerate(self):
+            for name in (p.source, p.target):
+                if strip:
+                    name = pathstrip(name, strip)
+                path = name if name in result else paths.get(normalized(name))
+                if path is not None:
+                    break
+            else:
+                warning("source/target file does not exist\n--- %s\n+++ %s" % (p.source, name))
                 errors += 1
                 continue
-            filename = f2patch
 
-            debug("processing %d/%d:\t %s" % (i + 1, total, filename))
+            debug("processing %d/%s:\t %s" % (i + 1, total, path))
+            perrors, result[path] = p._patch_text(result[path], path, i, total, fuzz)
+            errors += perrors
+        if errors:
+            return False
+        return result
 
-            # validate before patching
-            if six.PY2:
-                f2fp = open(filename, "rb")
-            else:
-                f2fp = open(filename, "r", encoding="utf-8", errors="replace")
-            hunkno = 0
-            hunk = p.hunks[hunkno]
-            hunkfind = []
-            hunkreplace = []
-            validhunks = 0
-            canpatch = False
-            for lineno, line in enumerate(f2fp):
-                if lineno + 1 < hunk.startsrc:
-                    continue
-                elif lineno + 1 == hunk.startsrc:
-                    hunkfind = [x[1:].rstrip("\r\n") for x in hunk.text if x[0] in " -"]
-                    hunkreplace = [x[1:].rstrip("\r\n") for x in hunk.text if x[0] in " +"]
-                    #pprint(hunkreplace)
-                    hunklineno = 0
-
-                    # todo \ No newline at end of file
-
-                # check hunks in source file
-                if lineno + 1 < hunk.startsrc + len(hunkfind) - 1:
-                    if line.rstrip("\r\n") == hunkfind[hunklineno]:
-                        hunklineno += 1
-                    else:
-                        info("file %d/%d:\t %s" % (i + 1, total, filename))
-                        info(" hunk no.%d doesn't match source file at line %d" % (hunkno + 1, lineno))
-                        info("  expected: %s" % hunkfind[hunklineno])
-                        info("  actual  : %s" % line.rstrip("\r\n"))
-                        # not counting this as error, because file may already be patched.
-                        # check if file is already patched is done after the number of
-                        # invalid hunks if found
-                        # TODO: check hunks against source/target file in one pass
-                        #   API - check(stream, srchunks, tgthunks)
-                        #           return tuple (srcerrs, tgterrs)
-
-                        # continue to check other hunks for completeness
-                        hunkno += 1
-                        if hunkno < len(p.hunks):
-                            hunk = p.hunks[hunkno]
-                            continue
-                        else:
-                            break
 
-                # check if processed line is the last line
-                if lineno + 1 == hunk.startsrc + len(hunkfind) - 1:
-                    debug(" hunk no.%d for file %s  -- is ready to be patched" % (hunkno + 1, filename))
+    def _apply_fused(self, p, filename, i, total, changed, fuzz=0, durability="atomic", dir_fd=None):
+        """ apply hunks of Patch `p` to `filename` reading the file
+            only once, see Patch.patch_lines(). New content is
+            written to a temp file which then replaces the file,
+            whose name is added to list `changed`.
+
+            return number of errors
+        """
+        if not p.hunks:
+            debug("no hunks for file %s" % filename)
+            return 0
+
+        if copy_threshold is not None and os.stat(filename, dir_fd=dir_fd).st_size >= max(copy_threshold, 1):
+            errors = self._apply_ranges(p, filename, i, total, changed, durability, dir_fd)
+            if errors is not None:
+                return errors
+
+        with open(filename, "r", encoding="utf-8", errors="surrogateescape", newline="",
+                  opener=_opener(dir_fd)) as fp:
+            lines = fp.readlines()
+
+        errors, output = p.patch_lines(lines, filename, i, total, fuzz)
+        if output is None:
+            return errors
+
+        debug("processing target file %s" % filename)
+        try:
+            # replace file a symlink points to, not the link
+            target = _realname(filename, dir_fd)
+            _replacefile(_stagefile(target, output, durability, dir_fd), target, durability, dir_fd)
+        except Exception as e:
+            warning("error patching file %s (%s)" % (filename, e))
+            return 1
+        changed.append(target)
+        info("successfully patched %d/%s:\t %s" % (i + 1, total, filename))
+        return 0
+
+
+    def _apply_ranges(self, p, filename, i, total, changed, durability, dir_fd=None):
+        """ apply hunks of Patch `p` to a large `filename` writing
+            only changed parts from Python, see Patch.patch_ranges()
+            and _apply_fused()
+
+            return number of errors, or None if the file has to be
+            patched line by line
+        """
+        try:
+            target = _realname(filename, dir_fd)
+            with open(filename, "rb", opener=_opener(dir_fd)) as fp:
+                data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                pieces = p.patch_ranges(data, filename, i, total)
+                if pieces is None:
+                    debug("hunks for file %s are not at their lines, patching line by line" % filename)
+                    return None
+                debug("processing target file %s" % filename)
+                tmpname = _stageranges(target, data, pieces, durability, dir_fd)
+            finally:
+                data.close()
+            _replacefile(tmpname, target, durability, dir_fd)
+        except Exception as e:
+            warning("error patching file %s (%s)" % (filename, e))
+            return 1
+        changed.append(target)
+        info("successfully patched %d/%s:\t %s" % (i + 1, total, filename))
+        return 0
+
+
+    def _stage_fused(self, p, filename, i, total, changed, staged, fuzz=0, dir_fd=None):
+        """ apply hunks of Patch `p` to content of `filename`,
+            which is taken from `staged` if the file was already
+            patched, and keep new content in `staged`. Nothing is
+            written, so `changed` is left to _commit().
+
+            return number of errors
+        """
+        target = _realname(filename, dir_fd)
+        if target in staged:
+            original, lines = staged[target]
+        else:
+            with open(filename, "r", encoding="utf-8", errors="surrogateescape", newline="",
+                      opener=_opener(dir_fd)) as fp:
+                original = lines = fp.readlines()
+
+        errors, output = p.patch_lines(lines, filename, i, total, fuzz)
+        if output is not None:
+            debug("staged %d/%s:\t %s" % (i + 1, total, filename))
+            staged[target] = (original, output)
+        return errors
+
+
+    def _commit(self, staged, durability, changed, dir_fd=None):
+        """ write all staged files to temp files and then rename
+            them over the originals, which are added to `changed`.
+            If a rename fails, files that were already replaced get
+            their original content back.
+
+            return number of errors
+        """
+        tmpnames = []
+        try:
+            for target, (original, output) in staged.items():
+                tmpnames.append(_stagefile(target, output, durability, dir_fd))
+        except Exception as e:
+            warning("error writing temp file for %s (%s), no files are changed" % (target, e))
+            for tmpname in tmpnames:
+                os.unlink(tmpname, dir_fd=dir_fd)
+            return 1
+
+        replaced = []
+        for (target, (original, output)), tmpname in zip(staged.items(), tmpnames):
+            try:
+                os.replace(tmpname, target, src_dir_fd=dir_fd, dst_dir_fd=dir_fd)
+            except Exception as e:
+                warning("error replacing %s (%s), restoring %d patched files" % (target, e, len(replaced)))
+                for name in tmpnames[len(replaced):]:
+                    os.unlink(name, dir_fd=dir_fd)
+                for done in replaced:
+                    try:
+                        _replacefile(_stagefile(done, staged[done][0], durability, dir_fd), done, durability, dir_fd)
+                    except Exception as err:
+                        warning("unable to restore %s (%s)" % (done, err))
+                return 1
+            replaced.append(target)
+
+        if durability == "fsync":
+            for directory in set(os.path.dirname(target) for target in replaced):
+                _syncdir(directory, dir_fd)
+        changed.extend(replaced)
+        info("successfully patched %d files" % len(replaced))
+        return 0
+
+
+    def _apply_legacy(self, p, filename, i, total, changed):
+        """ original apply, which validates hunks, checks if file
+            is already patched and writes it in separate passes.
+            Written file is added to list `changed`.
+
+            return number of errors
+        """
+        errors = 0
+        # validate before patching
+        f2fp = open(filename, "r", encoding="utf-8", errors="replace")
+        hunkno = 0
+        hunk = p.hunks[hunkno]
+        hunkfind = []
+        hunkreplace = []
+        validhunks = 0
+        canpatch = False
+        for lineno, line in enumerate(f2fp):
+            if lineno + 1 < hunk.startsrc:
+                continue
+            elif lineno + 1 == hunk.startsrc:
+                hunkfind = [x[1:].rstrip("\r\n") for x in hunk.text if x[0] in " -"]
+                hunkreplace = [x[1:].rstrip("\r\n") for x in hunk.text if x[0] in " +"]
+                #pprint(hunkreplace)
+                hunklineno = 0
+
+                # todo \ No newline at end of file
+
+            # check hunks in source file
+            if lineno + 1 < hunk.startsrc + len(hunkfind) - 1:
+                if line.rstrip("\r\n") == hunkfind[hunklineno]:
+                    hunklineno += 1
+                else:
+                    info("file %d/%s:\t %s" % (i + 1, total, filename))
+                    info(" hunk no.%d doesn't match source file at line %d" % (hunkno + 1, lineno))
+                    info("  expected: %s" % hunkfind[hunklineno])
+                    info("  actual  : %s" % line.rstrip("\r\n"))
+                    # not counting this as error, because file may already be patched.
+                    # check if file is already patched is done after the number of
+                    # invalid hunks if found
+                    # TODO: check hunks against source/target file in one pass
+                    #   API - check(stream, srchunks, tgthunks)
+                    #           return tuple (srcerrs, tgterrs)
+
+                    # continue to check other hunks for completeness
                     hunkno += 1
-                    validhunks += 1
                     if hunkno < len(p.hunks):
                         hunk = p.hunks[hunkno]
+                        continue
                     else:
-                        if validhunks == len(p.hunks):
-                            # patch file
-                            canpatch = True
-                            break
-            else:
+                        break
+
+            # check if processed line is the last line
+            if lineno + 1 == hunk.startsrc + len(hunkfind) - 1:
+                debug(" hunk no.%d for file %s  -- is ready to be patched" % (hunkno + 1, filename))
+                hunkno += 1
+                validhunks += 1
                 if hunkno < len(p.hunks):
-                    warning("premature end of source file %s at hunk %d" % (filename, hunkno + 1))
-                    errors += 1
+                    hunk = p.hunks[hunkno]
+                else:
+                    if validhunks == len(p.hunks):
+                        # patch file
+                        canpatch = True
+                        break
+        else:
+            if hunkno < len(p.hunks):
+                warning("premature end of source file %s at hunk %d" % (filename, hunkno + 1))
+                errors += 1
+
+        f2fp.close()
 
-            f2fp.close()
+        if validhunks < len(p.hunks):
+            if self._match_file_hunks(filename, p.hunks):
+                warning("already patched  %s" % filename)
+            else:
+                warning("source file is different - %s" % filename)
+                errors += 1
+        if canpatch:
+            backupname = filename + ".orig"
+            if os.path.exists(backupname):
+                warning("can't backup original file to %s - aborting" % backupname)
+            else:
+                import shutil
 
-            if validhunks < len(p.hunks):
-                if self._match_file_hunks(filename, p.hunks):
-                    warning("already patched  %s" % filename)
+                shutil.move(filename, backupname)
+                if self.write_hunks(backupname, filename, p.hunks):
+                    info("successfully patched %d/%s:\t %s" % (i + 1, total, filename))
+                    os.unlink(backupname)
+                    changed.append(abspath(filename))
                 else:
-                    warning("source file is different - %s" % filename)
                     errors += 1
-            if canpatch:
-                backupname = filename + ".orig"
-                if os.path.exists(backupname):
-                    warning("can't backup original file to %s - aborting" % backupname)
-                else:
-                    import shutil
+                    warning("error patching file %s" % filename)
+                    shutil.copy(filename, filename + ".invalid")
+                    warning("invalid version is saved to %s" % filename + ".invalid")
+                    # todo: proper rejects
+                    shutil.move(backupname, filename)
 
-                    shutil.move(filename, backupname)
-                    if self.write_hunks(backupname, filename, p.hunks):
-                        info("successfully patched %d/%d:\t %s" % (i + 1, total, filename))
-                        os.unlink(backupname)
-                    else:
-                        errors += 1
-                        warning("error patching file %s" % filename)
-                        shutil.copy(filename, filename + ".invalid")
-                        warning("invalid version is saved to %s" % filename + ".invalid")
-                        # todo: proper rejects
-                        shutil.move(backupname, filename)
-
-        # todo: check for premature eof
-        return (errors == 0)
+        return errors
 
 
     def can_patch(self, filename):
@@ -936,10 +2858,7 @@ class PatchSet(object):
 
     def _match_file_hunks(self, filepath, hunks):
         matched = True
-        if six.PY2:
-            fp = open(abspath(filepath), "rb")
-        else:
-            fp = open(abspath(filepath), "r", encoding="utf-8", errors="replace")
+        fp = open(abspath(filepath), "r", encoding="utf-8", errors="replace")
 
         class NoMatch(Exception):
             pass
@@ -993,6 +2912,9 @@ class PatchSet(object):
         srclineno = 1
 
         lineends = {'\n': 0, '\r\n': 0, '\r': 0}
+        # line end of all lines read so far, None if they are mixed
+        # (or there are none yet) - updated when a new kind shows up
+        newline = [None]
 
         def get_line():
             """
@@ -1002,11 +2924,17 @@ class PatchSet(object):
             line = instream.readline()
             # 'U' mode works only with text files
             if line.endswith("\r\n"):
-                lineends["\r\n"] += 1
+                end = "\r\n"
             elif line.endswith("\n"):
-                lineends["\n"] += 1
+                end = "\n"
             elif line.endswith("\r"):
-                lineends["\r"] += 1
+                end = "\r"
+            else:
+                return line
+            if not lineends[end]:
+                kinds = [x for x in lineends if lineends[x]]
+                newline[0] = None if kinds else end
+            lineends[end] += 1
             return line
 
         for hno, h in enumerate(hunks):
@@ -1027,10 +2955,9 @@ class PatchSet(object):
                         get_line()
                         srclineno += 1
                     line2write = hline[1:]
-                    # detect if line ends are consistent in source file
-                    if sum([bool(lineends[x]) for x in lineends]) == 1:
-                        newline = [x for x in lineends if lineends[x] != 0][0]
-                        yield line2write.rstrip("\r\n") + newline
+                    # use line end of source file if it is consistent
+                    if newline[0]:
+                        yield line2write.rstrip("\r\n") + newline[0]
                     else: # newlines are mixed
                         yield line2write
 
@@ -1042,12 +2969,8 @@ class PatchSet(object):
         src = None
         tgt = None
         try:
-            if six.PY2:
-                src = open(srcname, "rb")
-                tgt = open(tgtname, "wb")
-            else:
-                src = open(srcname, "r", encoding="utf-8")
-                tgt = open(tgtname, "w", encoding="utf-8")
+            src = open(srcname, "r", encoding="utf-8")
+            tgt = open(tgtname, "w", encoding="utf-8")
 
             debug("processing target file %s" % tgtname)
 
@@ -1056,6 +2979,7 @@ class PatchSet(object):
             tgt.close()
             src.close()
             # [ ] TODO: add test for permission copy
+            import shutil
             shutil.copymode(srcname, tgtname)
             return True
         except Exception as e:
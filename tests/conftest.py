@@ -17,6 +17,14 @@ if python_path not in sys.path:
     sys.path.insert(0, python_path)
 
 
+@pytest.fixture(autouse=True)
+def parse_cache_dir(tmp_path, monkeypatch):
+    """Keep the command line parse cache out of the user's cache directory"""
+    cache_dir = str(tmp_path / 'parse-cache')
+    monkeypatch.setenv('PYPATCH_URL_CACHE_DIR', cache_dir)
+    return cache_dir
+
+
 @pytest.fixture(scope="session")
 def test_data_dir():
     """Return the path to the test data directory"""
@@ -123,8 +131,12 @@ class MockResponse:
         else:
             self.content = content
 
-    def read(self):
-        return self.content
+    def read(self, size=-1):
+        if size < 0:
+            content, self.content = self.content, b''
+        else:
+            content, self.content = self.content[:size], self.content[size:]
+        return content
 
 
 @pytest.fixture
@@ -140,7 +152,9 @@ def mock_url_response():
             # Return a mock response object that simulates a URL response
             return MockResponse(patch_content)
 
-        # Use pytest's monkeypatch which correctly handles the complexities of six.moves
-        monkeypatch.setattr('six.moves.urllib.request.urlopen', mock_urlopen)
+        monkeypatch.setattr('urllib.request.urlopen', mock_urlopen)
+        # the command line downloads over a connection pool
+        monkeypatch.setattr('pypatch_url.fetch.ConnectionPool.urlopen',
+                            lambda self, request, timeout=None: mock_urlopen(getattr(request, 'full_url', request)))
 
     return create_mock
\ No newline at end of file
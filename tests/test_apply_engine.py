@@ -0,0 +1,170 @@
+import builtins
+import os
+
+import pytest
+
+from pypatch_url import patch
+
+
+PATCH = (
+    '--- example.py\n'
+    '+++ example.py\n'
+    '@@ -1,3 +1,4 @@\n'
+    ' def hello_world():\n'
+    '-    return "Hello, World!"\n'
+    '+    greeting = "Hello, Patched World!"\n'
+    '+    return greeting\n'
+    ' \n'
+)
+
+ORIGINAL = 'def hello_world():\n    return "Hello, World!"\n\n# end\n'
+PATCHED = 'def hello_world():\n    greeting = "Hello, Patched World!"\n    return greeting\n\n# end\n'
+
+
+def write(directory, content):
+    filename = os.path.join(directory, 'example.py')
+    with open(filename, 'w', newline='') as f:
+        f.write(content)
+    return filename
+
+
+def read(filename):
+    with open(filename, newline='') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('engine', ['fused', 'legacy'])
+def test_engines_patch_file(tmp_path, engine, monkeypatch):
+    """Test that both apply engines give the same result"""
+    filename = write(str(tmp_path), ORIGINAL)
+    monkeypatch.chdir(str(tmp_path))
+
+    assert patch.fromstring(PATCH).apply(engine=engine)
+    assert read(filename) == PATCHED
+    assert not os.path.exists(filename + '.orig')
+
+
+def test_fused_reads_file_once(tmp_path, monkeypatch):
+    """Test that the file is read once and written once"""
+    write(str(tmp_path), ORIGINAL)
+    monkeypatch.chdir(str(tmp_path))
+    opened = []
+
+    def counting_open(file, mode='r', *args, **kwargs):
+        opened.append(mode)
+        return builtins.open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(patch, 'open', counting_open, raising=False)
+
+    assert patch.fromstring(PATCH).apply(engine='fused')
+    assert opened == ['r', 'w']
+
+
+def test_fused_keeps_line_ends(tmp_path, monkeypatch):
+    """Test that CRLF files stay CRLF and added lines get CRLF too"""
+    filename = write(str(tmp_path), ORIGINAL.replace('\n', '\r\n'))
+    monkeypatch.chdir(str(tmp_path))
+
+    assert patch.fromstring(PATCH).apply(engine='fused')
+    assert read(filename) == PATCHED.replace('\n', '\r\n')
+
+
+def test_fused_already_patched(tmp_path, monkeypatch):
+    """Test that patched files are detected and left alone"""
+    filename = write(str(tmp_path), PATCHED)
+    monkeypatch.chdir(str(tmp_path))
+
+    assert patch.fromstring(PATCH).apply(engine='fused')
+    assert read(filename) == PATCHED
+
+
+def test_fused_source_is_different(tmp_path, monkeypatch):
+    """Test that files matching neither side are not changed"""
+    content = ORIGINAL.replace('Hello', 'Bye')
+    filename = write(str(tmp_path), content)
+    monkeypatch.chdir(str(tmp_path))
+
+    assert not patch.fromstring(PATCH).apply(engine='fused')
+    assert read(filename) == content
+
+
+def test_fused_checks_last_hunk_line(tmp_path, monkeypatch):
+    """Test that the last source line of a hunk is checked as well"""
+    content = ORIGINAL.replace('\n\n', '\nnot empty\n')
+    filename = write(str(tmp_path), content)
+    monkeypatch.chdir(str(tmp_path))
+
+    assert not patch.fromstring(PATCH).apply(engine='fused')
+    assert read(filename) == content
+
+
+def test_fused_insert_and_no_newline(tmp_path, monkeypatch):
+    """Test hunks without source lines and lines without line end"""
+    filename = write(str(tmp_path), 'a\nb\nc')
+    monkeypatch.chdir(str(tmp_path))
+    patch_set = patch.fromstring(
+        '--- example.py\n'
+        '+++ example.py\n'
+        '@@ -1,0 +2 @@\n'
+        '+inserted\n'
+        '@@ -3 +4 @@\n'
+        '-c\n'
+        '\\ No newline at end of file\n'
+        '+d\n'
+    )
+
+    assert patch_set.apply(engine='fused')
+    assert read(filename) == 'a\ninserted\nb\nd\n'
+
+
+def test_unknown_apply_engine():
+    """Test that unknown engine names are rejected"""
+    with pytest.raises(ValueError):
+        patch.fromstring(PATCH).apply(engine='nonexistent')
+
+
+NO_NEWLINE_PATCH = (
+    '--- example.py\n'
+    '+++ example.py\n'
+    '@@ -1,2 +1,2 @@\n'
+    ' a\n'
+    '-b\n'
+    '+c\n'
+    '\\ No newline at end of file\n'
+)
+
+
+@pytest.mark.parametrize('engine', ['fused', 'ranges', 'memory'])
+def test_no_newline_after_last_line(tmp_path, monkeypatch, engine):
+    """Test a missing line end marker that follows the last line of a hunk"""
+    patch_set = patch.fromstring(NO_NEWLINE_PATCH)
+    assert patch_set.warnings == 0
+    if engine == 'memory':
+        assert patch_set.items[0].apply_to_text('a\nb\n') == 'a\nc'
+        return
+
+    filename = write(str(tmp_path), 'a\nb\n')
+    monkeypatch.chdir(tmp_path)
+    used = []
+    if engine == 'ranges':
+        patch_ranges = patch.Patch.patch_ranges
+
+        def recording_patch_ranges(self, *args):
+            pieces = patch_ranges(self, *args)
+            used.append(pieces is not None)
+            return pieces
+
+        monkeypatch.setattr(patch, 'copy_threshold', 0)
+        monkeypatch.setattr(patch.Patch, 'patch_ranges', recording_patch_ranges)
+    assert patch_set.apply(engine='fused')
+    assert read(filename) == 'a\nc'
+    assert used == ([True] if engine == 'ranges' else [])
+
+
+@pytest.mark.parametrize('engine', ['fast', 'legacy'])
+def test_parsers_keep_no_newline_after_hunk(engine):
+    """Test that both parsers add a missing line end marker after a complete hunk to the hunk"""
+    patch_set = patch.PatchSet()
+    assert patch_set.parse(iter(NO_NEWLINE_PATCH.splitlines(True)), engine=engine)
+    assert patch_set.items[0].hunks[0].text[-1] == '\\ No newline at end of file\n'
+    assert patch_set.warnings == 0
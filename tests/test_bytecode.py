@@ -0,0 +1,134 @@
+import importlib.util
+import os
+import py_compile
+import stat
+import sys
+import unittest.mock as mock
+
+import pytest
+
+from pypatch_url import bytecode, command
+
+
+def write(filename, content):
+    with open(filename, 'w') as f:
+        f.write(content)
+
+
+def source_hash(filename):
+    """return source hash stored in hash based pyc of `filename`"""
+    with open(importlib.util.cache_from_source(filename), 'rb') as f:
+        return f.read(16)[8:]
+
+
+def run(action, patch_file):
+    with mock.patch('sys.argv', ['pypatch-url', action, patch_file, 'testmodule']):
+        with mock.patch('sys.exit') as exit_mock:
+            command.main()
+    return exit_mock.call_args[0][0]
+
+
+def test_patched_file_is_recompiled(temp_module, test_data_dir, mock_module_path, monkeypatch):
+    """Test that stale bytecode is replaced keeping its invalidation mode"""
+    monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+    temp_dir, module_dir = temp_module
+    original_path = mock_module_path(temp_dir, module_dir)
+    example = os.path.join(module_dir, 'example.py')
+    py_compile.compile(example, invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    old_hash = source_hash(example)
+
+    assert run('apply', os.path.join(test_data_dir, 'sample.patch')) == 0
+
+    cfile = importlib.util.cache_from_source(example)
+    assert bytecode._pycmode(cfile) == py_compile.PycInvalidationMode.UNCHECKED_HASH
+    with open(example, 'rb') as f:
+        assert source_hash(example) == importlib.util.source_hash(f.read()) != old_hash
+
+    os.sys.path = original_path
+
+
+def test_syntax_error_fails_apply(temp_module, mock_module_path, tmp_path, capsys):
+    """Test that a patch which breaks syntax is reported as failed"""
+    temp_dir, module_dir = temp_module
+    original_path = mock_module_path(temp_dir, module_dir)
+    patch_file = str(tmp_path / 'broken.patch')
+    write(patch_file, '--- example.py\n+++ example.py\n@@ -1,2 +1,2 @@\n def hello_world():\n'
+                      '-    return "Hello, World!"\n+    return "Hello, World!\n')
+
+    assert run('apply', patch_file) == 1
+    out = capsys.readouterr().out
+    assert "Patched file '%s' does not compile" % os.path.realpath(os.path.join(module_dir, 'example.py')) in out
+
+    os.sys.path = original_path
+
+
+def test_recompile_in_processes(tmp_path, monkeypatch):
+    """Test that several files are compiled by worker processes"""
+    monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+    names = [str(tmp_path / ('m%d.py' % n)) for n in range(3)]
+    for n, name in enumerate(names):
+        write(name, 'x = %d\n' % n if n != 1 else 'x = (\n')
+    write(str(tmp_path / 'data.txt'), 'x = (\n')
+
+    errors = bytecode.recompile(names + [str(tmp_path / 'data.txt')], workers=2)
+    assert [name for name, _ in errors] == [names[1]]
+    assert 'SyntaxError' in errors[0][1] or 'never closed' in errors[0][1]
+    assert [os.path.exists(importlib.util.cache_from_source(name)) for name in names] == [True, False, True]
+
+    # only syntax is checked without bytecode writing
+    os.unlink(importlib.util.cache_from_source(names[0]))
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    assert [name for name, _ in bytecode.recompile(names, workers=1)] == [names[1]]
+    assert not os.path.exists(importlib.util.cache_from_source(names[0]))
+
+
+def test_recompile_without_invalidation_modes(tmp_path, monkeypatch):
+    """Test that files are compiled like on Python 3.6, which has no invalidation modes"""
+    monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+    monkeypatch.setattr(bytecode, 'PycInvalidationMode', None)
+    compile_file = py_compile.compile
+
+    def compile_36(file, cfile=None, dfile=None, doraise=False, optimize=-1):
+        return compile_file(file, cfile=cfile, dfile=dfile, doraise=doraise, optimize=optimize)
+
+    monkeypatch.setattr(py_compile, 'compile', compile_36)
+    example = str(tmp_path / 'example.py')
+    write(example, 'x = 1\n')
+    compile_36(example)
+
+    assert bytecode.recompile([example], workers=1) == []
+    assert os.path.exists(importlib.util.cache_from_source(example))
+
+
+@pytest.mark.parametrize('pycache', [
+    pytest.param('read-only', marks=pytest.mark.skipif(
+        not hasattr(os, 'geteuid') or os.geteuid() == 0, reason='permissions do not apply to root')),
+    'file',
+])
+def test_unwritable_pycache_is_not_fatal(temp_module, test_data_dir, mock_module_path, monkeypatch, capsys,
+                                         pycache):
+    """Test that apply succeeds when __pycache__ can't be written, with a warning"""
+    monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+    temp_dir, module_dir = temp_module
+    original_path = mock_module_path(temp_dir, module_dir)
+    example = os.path.join(module_dir, 'example.py')
+    directory = os.path.join(module_dir, '__pycache__')
+    if pycache == 'file':
+        write(directory, 'not a directory\n')
+    else:
+        py_compile.compile(example)
+        os.chmod(directory, stat.S_IRUSR | stat.S_IXUSR)
+
+    try:
+        assert run('apply', os.path.join(test_data_dir, 'sample.patch')) == 0
+    finally:
+        if pycache != 'file':
+            os.chmod(directory, stat.S_IRWXU)
+    with open(example) as f:
+        assert 'Patched' in f.read()
+    err = capsys.readouterr().err
+    assert 'unable to write bytecode' in err
+    if pycache != 'file':
+        assert 'unable to remove stale bytecode' in err
+
+    os.sys.path = original_path
@@ -0,0 +1,125 @@
+import os
+import stat
+import unittest.mock as mock
+
+from pypatch_url import command, patch
+
+
+PATCH = (
+    '--- one.py\n'
+    '+++ one.py\n'
+    '@@ -1,2 +1,2 @@\n'
+    ' def one():\n'
+    '-    return 1\n'
+    '+    return 11\n'
+    '@@ -4,2 +4,2 @@\n'
+    ' def two():\n'
+    '-    return 2\n'
+    '+    return 22\n'
+    '--- missing.py\n'
+    '+++ missing.py\n'
+    '@@ -1 +1 @@\n'
+    '-a\n'
+    '+b\n'
+)
+
+ORIGINAL = 'def one():\n    return 1\n\ndef two():\n    return 2\n'
+
+
+def write(directory, content):
+    with open(os.path.join(directory, 'one.py'), 'w') as f:
+        f.write(content)
+
+
+def statuses(results):
+    return [(r.patch.target, r.status, r.hunks) for r in results]
+
+
+def test_check_statuses(tmp_path, monkeypatch):
+    """Test file and hunk statuses without changing anything"""
+    monkeypatch.chdir(str(tmp_path))
+    patch_set = patch.fromstring(PATCH)
+    missing = ('missing.py', patch.MISSING, [patch.MISSING])
+
+    write(str(tmp_path), ORIGINAL)
+    assert statuses(patch_set.check()) == [
+        ('one.py', patch.APPLICABLE, [patch.APPLICABLE] * 2), missing]
+
+    write(str(tmp_path), ORIGINAL.replace('1', '11').replace('2', '22'))
+    assert statuses(patch_set.check()) == [
+        ('one.py', patch.ALREADY_APPLIED, [patch.ALREADY_APPLIED] * 2), missing]
+
+    write(str(tmp_path), ORIGINAL.replace('2', '22'))
+    assert statuses(patch_set.check()) == [
+        ('one.py', patch.CONFLICT, [patch.APPLICABLE, patch.ALREADY_APPLIED]), missing]
+
+    write(str(tmp_path), ORIGINAL.replace('1', '3'))
+    assert statuses(patch_set.check()) == [
+        ('one.py', patch.CONFLICT, [patch.CONFLICT, patch.APPLICABLE]), missing]
+
+    assert os.listdir(str(tmp_path)) == ['one.py']
+
+
+def test_check_read_only_directory(tmp_path, monkeypatch):
+    """Test that check works where nothing can be written"""
+    write(str(tmp_path), ORIGINAL)
+    monkeypatch.chdir(str(tmp_path))
+    os.chmod(str(tmp_path), stat.S_IRUSR | stat.S_IXUSR)
+    try:
+        results = patch.fromstring(PATCH).check()
+    finally:
+        os.chmod(str(tmp_path), stat.S_IRWXU)
+
+    assert results[0].status == patch.APPLICABLE
+    assert results[0].filename == 'one.py'
+
+
+def test_command_line_check_exit_codes(temp_module, test_data_dir, mock_module_path, capsys):
+    """Test exit codes of the check action"""
+    temp_dir, module_dir = temp_module
+    original_path = mock_module_path(temp_dir, module_dir)
+    argv = ['pypatch-url', 'check', os.path.join(test_data_dir, 'sample.patch'), 'testmodule']
+
+    with mock.patch('sys.argv', argv):
+        with mock.patch('sys.exit') as exit_mock:
+            command.main()
+    exit_mock.assert_called_once_with(command.CHECK_EXIT_CODES[patch.APPLICABLE])
+    assert 'example.py: applicable' in capsys.readouterr().out
+
+    with mock.patch('sys.argv', argv[:1] + ['apply'] + argv[2:]):
+        with mock.patch('sys.exit'):
+            command.main()
+
+    with mock.patch('sys.argv', argv):
+        with mock.patch('sys.exit') as exit_mock:
+            command.main()
+    exit_mock.assert_called_once_with(0)
+
+    with open(os.path.join(module_dir, 'example.py'), 'w') as f:
+        f.write('something else\n')
+    with mock.patch('sys.argv', argv):
+        with mock.patch('sys.exit') as exit_mock:
+            command.main()
+    exit_mock.assert_called_once_with(command.CHECK_EXIT_CODES[patch.CONFLICT])
+
+    os.sys.path = original_path
+
+
+def test_command_line_check_writes_no_cache(temp_module, test_data_dir, mock_module_path, parse_cache_dir):
+    """Test that the check action uses the caches only when asked to"""
+    temp_dir, module_dir = temp_module
+    original_path = mock_module_path(temp_dir, module_dir)
+    argv = ['pypatch-url', 'check', os.path.join(test_data_dir, 'sample.patch'), 'testmodule']
+
+    with mock.patch('sys.argv', argv):
+        with mock.patch('sys.exit'):
+            command.main()
+    assert not os.path.exists(parse_cache_dir)
+
+    with mock.patch('sys.argv', argv + ['--cache']):
+        with mock.patch('sys.exit'):
+            command.main()
+    assert os.listdir(parse_cache_dir)
+    assert patch.parse_cache is None
+
+    os.sys.path = original_path
@@ -0,0 +1,66 @@
+import pickle
+import tracemalloc
+from io import StringIO
+
+from pypatch_url import patch
+
+
+def generate_patch(files):
+    out = []
+    for f in range(files):
+        out.append('diff --git a/module_%d.py b/module_%d.py\n' % (f, f))
+        out.append('index 1234567..89abcde 100644\n')
+        out.append('--- a/module_%d.py\n+++ b/module_%d.py\n' % (f, f))
+        for h in range(4):
+            out.append('@@ -%d,12 +%d,12 @@\n' % (1 + h * 20, 1 + h * 20))
+            out.extend('     value_%d = compute(%d)\n' % (c, c) for c in range(3))
+            out.extend('-    result_%d = old_call(value_%d)\n' % (c, c) for c in range(6))
+            out.extend('+    result_%d = new_call(value_%d)\n' % (c, c) for c in range(6))
+            out.extend('     return_%d = finish(%d)\n' % (c, c) for c in range(3))
+    return ''.join(out)
+
+
+def parsed_size(text, compact):
+    """Return memory held by PatchSet parsed from text"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        patchset = patch.PatchSet()
+        patchset.parse(StringIO(text), compact=compact)
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def test_compact_attributes():
+    """Test that public attributes of compact patches are unchanged"""
+    text = generate_patch(3)
+    regular = patch.fromstring(text)
+    compact = patch.fromstring(text, compact=True)
+
+    for p, c in zip(regular.items, compact.items):
+        assert c.header == p.header
+        assert (c.source, c.target, c.type) == (p.source, p.target, p.type)
+        for h, ch in zip(p.hunks, c.hunks):
+            assert ch.text == h.text
+            assert (ch.startsrc, ch.linessrc, ch.starttgt, ch.linestgt) == \
+                   (h.startsrc, h.linessrc, h.starttgt, h.linestgt)
+
+    # hunk text can still be replaced
+    hunk = compact.items[0].hunks[0]
+    hunk.text = [' line\n']
+    assert hunk.text == [' line\n']
+
+    # and compact patches survive pickling
+    restored = pickle.loads(pickle.dumps(compact))
+    assert restored.items[1].hunks[2].text == regular.items[1].hunks[2].text
+
+
+def test_compact_memory_usage():
+    """Test that compact mode needs much less memory"""
+    text = generate_patch(300)
+
+    regular = parsed_size(text, compact=False)
+    compact = parsed_size(text, compact=True)
+
+    assert compact < regular * 0.6
@@ -0,0 +1,101 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+import unittest.mock as mock
+
+import pytest
+
+from pypatch_url import command
+from pypatch_url import compression
+from pypatch_url import patch
+
+PATCH = '--- example.py\n+++ example.py\n@@ -1,2 +1,2 @@\n def hello_world():\n-    return "Hello, World!"\n+    return "Hello, Patch!"\n'
+
+COMPRESSORS = {'gzip': gzip.compress, 'bzip2': bz2.compress, 'xz': lzma.compress}
+
+
+class Stream(object):
+    """Binary stream that can not seek, like stdin or HTTP response"""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._data.read(size)
+
+
+def hunks(patchset):
+    return [(p.target, [h.text for h in p.hunks]) for p in patchset]
+
+
+@pytest.mark.parametrize('format', sorted(COMPRESSORS))
+def test_detect(format):
+    """Test that compressed data is recognized by its magic bytes"""
+    assert compression.detect(COMPRESSORS[format](b'x')) == format
+    assert compression.detect(PATCH.encode('utf-8')) is None
+
+
+@pytest.mark.parametrize('format', sorted(COMPRESSORS))
+@pytest.mark.parametrize('cls', [io.BytesIO, Stream])
+def test_decompressed(format, cls):
+    """Test that streams are decompressed whether they can seek or not"""
+    data = PATCH.encode('utf-8')
+    assert compression.decompressed(cls(COMPRESSORS[format](data))).read() == data
+    assert compression.decompressed(cls(data)).read() == data
+    assert compression.decompressed(cls(b'')).read() == b''
+
+
+def test_content_encoding():
+    """Test that gzip content encoding is removed before checking for magic bytes"""
+    data = gzip.compress(lzma.compress(PATCH.encode('utf-8')))
+    assert compression.decompressed(Stream(data), 'gzip').read() == PATCH.encode('utf-8')
+
+
+@pytest.mark.parametrize('format', sorted(COMPRESSORS))
+@pytest.mark.parametrize('cached', [False, True])
+def test_fromfile(tmp_path, monkeypatch, format, cached):
+    """Test that compressed patch files are parsed whatever their name is"""
+    if cached:
+        from pypatch_url.cache import ParseCache
+        monkeypatch.setattr(patch, 'parse_cache', ParseCache(str(tmp_path / 'cache')))
+    filename = tmp_path / 'example.patch'
+    filename.write_bytes(COMPRESSORS[format](PATCH.encode('utf-8')))
+    expected = hunks(patch.fromstring(PATCH))
+    assert hunks(patch.fromfile(str(filename))) == expected
+    assert hunks(patch.fromfile(str(filename), mmap=True)) == expected
+    assert hunks(patch.fromfile(str(filename), stream=True)) == expected
+
+
+def test_fromurl_content_encoding(monkeypatch):
+    """Test that gzip Content-Encoding of responses is honoured"""
+    response = mock.Mock()
+    response.read = Stream(gzip.compress(gzip.compress(PATCH.encode('utf-8')))).read
+    response.headers.get_content_charset.return_value = None
+    response.headers.get.side_effect = lambda name, default=None: 'gzip' if name == 'Content-Encoding' else default
+    monkeypatch.setattr('urllib.request.urlopen', lambda url: response)
+    assert hunks(patch.fromurl('https://example.com/example.patch.gz')) == hunks(patch.fromstring(PATCH))
+
+
+def test_broken_compressed_url(monkeypatch):
+    """Test that broken compressed downloads are reported as errors"""
+    monkeypatch.setattr('urllib.request.urlopen', lambda url: Stream(lzma.compress(b'x' * 100)[:30]))
+    assert patch.fromurl('https://example.com/broken.patch.xz') is False
+
+
+def test_apply_from_stdin(temp_module, mock_module_path, monkeypatch):
+    """Test that '-' applies a compressed patch from standard input"""
+    temp_dir, module_dir = temp_module
+    mock_module_path(temp_dir, module_dir)
+    monkeypatch.setattr(sys, 'stdin', io.TextIOWrapper(io.BytesIO(bz2.compress(PATCH.encode('utf-8')))))
+
+    args = mock.Mock()
+    args.patch_file = '-'
+    args.module = 'testmodule'
+    args.strip = 0
+
+    assert command.apply_patch(args, debug=False)
+    with open(os.path.join(module_dir, 'example.py')) as f:
+        assert 'Hello, Patch!' in f.read()
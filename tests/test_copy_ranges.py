@@ -0,0 +1,84 @@
+import errno
+import os
+
+import pytest
+
+from pypatch_url import patch
+
+
+ORIGINAL = ''.join('VALUE_%d = %d\n' % (n, n) for n in range(1000))
+
+
+def make_patch(*lines):
+    text = '--- data.py\n+++ data.py\n'
+    for n in lines:
+        text += ('@@ -%d,3 +%d,4 @@\n VALUE_%d = %d\n-VALUE_%d = %d\n+VALUE_%d = 0\n+# patched\n VALUE_%d = %d\n'
+                 % (n, n, n - 1, n - 1, n, n, n, n + 1, n + 1))
+    return text
+
+
+def patched(content, *lines):
+    for n in lines:
+        content = content.replace('VALUE_%d = %d\n' % (n, n), 'VALUE_%d = 0\n# patched\n' % n)
+    return content
+
+
+def apply(directory, content, text, monkeypatch):
+    """apply patch `text` to data.py with `content`, return new content
+    and whether it was patched by copying byte ranges"""
+    monkeypatch.chdir(directory)
+    with open('data.py', 'w', newline='') as f:
+        f.write(content)
+    used = []
+    patch_ranges = patch.Patch.patch_ranges
+
+    def recording_patch_ranges(self, *args):
+        pieces = patch_ranges(self, *args)
+        used.append(pieces is not None)
+        return pieces
+
+    monkeypatch.setattr(patch, 'copy_threshold', 0)
+    monkeypatch.setattr(patch.Patch, 'patch_ranges', recording_patch_ranges)
+    assert patch.fromstring(text).apply()
+    with open('data.py', newline='') as f:
+        return f.read(), used == [True]
+
+
+def test_copy_ranges(tmp_path, monkeypatch):
+    """Test that large files are patched by copying unchanged ranges"""
+    text = make_patch(2, 500, 998)
+    assert apply(str(tmp_path), ORIGINAL, text, monkeypatch) == (patched(ORIGINAL, 2, 500, 998), True)
+
+    # already patched files are left to line by line check
+    assert apply(str(tmp_path), patched(ORIGINAL, 2, 500, 998), text, monkeypatch) == \
+        (patched(ORIGINAL, 2, 500, 998), False)
+
+
+@pytest.mark.parametrize('content', [
+    ORIGINAL.replace('\n', '\r\n'),
+    'moved\n' + ORIGINAL,
+], ids=['crlf', 'moved'])
+def test_copy_ranges_falls_back_to_lines(tmp_path, monkeypatch, content):
+    """Test that files with other line ends or moved hunks are patched line by line"""
+    new, ranges = apply(str(tmp_path), content, make_patch(2, 500), monkeypatch)
+    assert new == patched(content.replace('\r\n', '\n'), 2, 500).replace('\n', '\r\n' if '\r' in content else '\n')
+    assert not ranges
+
+
+def test_copy_ranges_without_kernel_copy(tmp_path, monkeypatch):
+    """Test that bytes are copied by Python when the kernel can't copy them"""
+    def unsupported(code):
+        def copy(*args):
+            raise OSError(code, os.strerror(code))
+        return copy
+
+    monkeypatch.setattr(os, 'copy_file_range', unsupported(errno.EXDEV), raising=False)
+    monkeypatch.setattr(os, 'sendfile', unsupported(errno.EINVAL), raising=False)
+    assert apply(str(tmp_path), ORIGINAL, make_patch(500), monkeypatch) == (patched(ORIGINAL, 500), True)
+
+
+def test_line_offsets():
+    """Test that line offsets are found across blocks"""
+    data = b'a\nbb\n\nccc\nd'
+    assert patch._lineoffsets(data, [0, 1, 3, 4, 5], block=3) == [0, 2, 6, 10, None]
+    assert patch._lineoffsets(data[:-1], [4], block=2) == [10]
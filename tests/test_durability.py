@@ -0,0 +1,84 @@
+import os
+import stat
+
+import pytest
+
+from pypatch_url import patch
+
+
+PATCH = (
+    '--- example.py\n'
+    '+++ example.py\n'
+    '@@ -1,2 +1,2 @@\n'
+    ' def hello_world():\n'
+    '-    return "Hello, World!"\n'
+    '+    return "Hello, Patched World!"\n'
+)
+
+
+def make_file(directory):
+    filename = os.path.join(directory, 'example.py')
+    with open(filename, 'w') as f:
+        f.write('def hello_world():\n    return "Hello, World!"\n')
+    os.chmod(filename, 0o640)
+    return filename
+
+
+@pytest.mark.parametrize('mode', patch.DURABILITY_MODES)
+def test_durability_modes(tmp_path, monkeypatch, mode):
+    """Test that files are replaced by a synced temp file as requested"""
+    filename = make_file(str(tmp_path))
+    monkeypatch.chdir(str(tmp_path))
+    synced = []
+    fsync = os.fsync
+
+    def counting_fsync(fd):
+        synced.append(stat.S_ISDIR(os.fstat(fd).st_mode))
+        fsync(fd)
+
+    monkeypatch.setattr(os, 'fsync', counting_fsync)
+    inode = os.stat(filename).st_ino
+
+    assert patch.fromstring(PATCH).apply(durability=mode)
+
+    with open(filename) as f:
+        assert 'Hello, Patched World!' in f.read()
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o640
+    assert os.stat(filename).st_ino != inode
+    assert os.listdir(str(tmp_path)) == ['example.py']
+    assert synced == {'none': [], 'atomic': [False], 'fsync': [False, True]}[mode]
+
+
+def test_symlink_target_is_patched(tmp_path, monkeypatch):
+    """Test that a symlinked file is patched and the link is kept"""
+    real = make_file(str(tmp_path))
+    os.rename(real, os.path.join(str(tmp_path), 'real.py'))
+    os.symlink('real.py', real)
+    monkeypatch.chdir(str(tmp_path))
+
+    assert patch.fromstring(PATCH).apply()
+    assert os.path.islink(real)
+    with open(os.path.join(str(tmp_path), 'real.py')) as f:
+        assert 'Hello, Patched World!' in f.read()
+
+
+def test_failed_write_keeps_original(tmp_path, monkeypatch):
+    """Test that the original file is not touched when writing fails"""
+    filename = make_file(str(tmp_path))
+    monkeypatch.chdir(str(tmp_path))
+
+    def failing_replace(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+
+    assert not patch.fromstring(PATCH).apply()
+    with open(filename) as f:
+        assert f.read() == 'def hello_world():\n    return "Hello, World!"\n'
+    assert os.listdir(str(tmp_path)) == ['example.py']
+
+
+def test_unknown_durability():
+    """Test that unknown durability modes are rejected"""
+    with pytest.raises(ValueError):
+        patch.fromstring(PATCH).apply(durability='sometimes')
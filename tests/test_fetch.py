@@ -0,0 +1,140 @@
+import gzip
+import threading
+import time
+from urllib.error import HTTPError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pypatch_url import command, patch
+from pypatch_url.cache import HTTPCache
+from pypatch_url.fetch import ConnectionPool
+
+
+class PatchServer(ThreadingHTTPServer):
+    """Serves a patch for file_N.py at /N.patch over keep-alive connections"""
+    daemon_threads = True
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), PatchHandler)
+        self.connections = 0
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d/%s' % (self.server_address[1], path)
+
+
+class PatchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def send(self, status, body=b'', **headers):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        name = self.path.strip('/')
+        with self.server.lock:
+            failures = self.server.failures.get(name, 0)
+            self.server.failures[name] = failures - 1
+        if failures > 0:
+            return self.send(503)
+        if name == 'slow.patch':
+            time.sleep(1)
+        if name == 'moved.patch':
+            return self.send(302, Location='/7.patch')
+        if name == 'cached.patch' and self.headers.get('If-None-Match') == '"x"':
+            return self.send(304)
+        if not name.endswith('.patch') or not name[0].isdigit() and name != 'cached.patch':
+            return self.send(404)
+        n = name.split('.')[0]
+        body = ('--- file_%s.py\n+++ file_%s.py\n@@ -1 +1 @@\n-a\n+b\n' % (n, n)).encode('utf-8')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            return self.send(200, gzip.compress(body), ETag='"x"', **{'Content-Encoding': 'gzip'})
+        self.send(200, body, ETag='"x"')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    for name in ('http_proxy', 'HTTP_PROXY', 'all_proxy', 'ALL_PROXY'):
+        monkeypatch.delenv(name, raising=False)
+    server = PatchServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def targets(results):
+    return [p and [item.target for item in p.items] for p in results]
+
+
+def test_fromurls_reuses_connections(server):
+    """Test that results are in order and connections are reused"""
+    urls = [server.url('%d.patch' % n) for n in range(20)]
+    results = patch.fromurls(urls, max_concurrency=4)
+    assert targets(results) == [['file_%d.py' % n] for n in range(20)]
+    assert server.connections <= 4
+
+
+def test_fromurls_errors(server):
+    """Test that failing URLs give False without stopping the others"""
+    urls = [server.url('1.patch'), server.url('missing'), server.url('moved.patch'), server.url('slow.patch')]
+    results = patch.fromurls(urls, timeout=0.3, retries=0)
+    assert targets(results) == [['file_1.py'], False, ['file_7.py'], False]
+
+
+def test_fromurls_with_http_cache(server, tmp_path, monkeypatch):
+    """Test that conditional requests go over the pool too"""
+    monkeypatch.setattr(patch, 'http_cache', HTTPCache(str(tmp_path)))
+    for _ in range(2):
+        assert targets(patch.fromurls([server.url('cached.patch')])) == [['file_cached.py']]
+    assert patch.http_cache.hits == 1
+    # the patch is kept without content encoding
+    headers, body = patch.http_cache.get(server.url('cached.patch'))
+    assert body.startswith(b'--- file_cached.py')
+
+
+def test_retries(server):
+    """Test that failed requests are retried"""
+    server.failures['2.patch'] = 2
+    pool = ConnectionPool(backoff=0)
+    try:
+        assert b'file_2.py' in pool.urlopen(server.url('2.patch')).read()
+    finally:
+        pool.close()
+
+    server.failures['3.patch'] = 2
+    pool = ConnectionPool(retries=1, backoff=0)
+    try:
+        with pytest.raises(HTTPError):
+            pool.urlopen(server.url('3.patch'))
+    finally:
+        pool.close()
+
+
+def test_command_line_url_timeout_and_retries(server, monkeypatch, capsys):
+    """Test that the command line downloads a single URL with a timeout and retries"""
+    monkeypatch.setattr(command, 'URL_TIMEOUT', 0.3)
+    server.failures['4.patch'] = 1
+    assert targets([command.load_patch_set(server.url('4.patch'))]) == [['file_4.py']]
+
+    monkeypatch.setattr(command, 'URL_RETRIES', 0)
+    started = time.time()
+    assert command.load_patch_set(server.url('slow.patch')) is False
+    assert time.time() - started < 1
+    assert 'Failed to download' in capsys.readouterr().out
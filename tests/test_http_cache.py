@@ -0,0 +1,98 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pypatch_url import patch
+from pypatch_url.cache import HTTPCache
+
+
+PATCH = '--- one.py\n+++ one.py\n@@ -1 +1 @@\n-one\n+two\n'
+
+
+class PatchServer(ThreadingHTTPServer):
+    """Serves `content` with an ETag and answers 304 if it is not modified"""
+
+    def __init__(self):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), PatchHandler)
+        self.content = PATCH
+        self.etag = '"1"'
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/fix.patch' % self.server_address[1]
+
+
+class PatchHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = server.content.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/x-diff; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', server.etag)
+        self.send_header('Last-Modified', 'Mon, 02 Jan 2023 10:00:00 GMT')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    for name in ('http_proxy', 'HTTP_PROXY', 'all_proxy', 'ALL_PROXY'):
+        monkeypatch.delenv(name, raising=False)
+    server = PatchServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def targets(patchset):
+    return [(p.target, [h.text for h in p.hunks]) for p in patchset.items]
+
+
+def test_conditional_requests(server, tmp_path, monkeypatch):
+    """Test that a cached patch is downloaded again only when it changed"""
+    cache = HTTPCache(str(tmp_path / 'http'))
+    monkeypatch.setattr(patch, 'http_cache', cache)
+
+    first = patch.fromurl(server.url)
+    assert targets(first) == [('one.py', [['-one\n', '+two\n']])]
+    assert targets(patch.fromurl(server.url)) == targets(first)
+    assert [r.get('If-None-Match') for r in server.requests] == [None, '"1"']
+    assert server.requests[1]['If-Modified-Since'] == 'Mon, 02 Jan 2023 10:00:00 GMT'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    server.content = PATCH.replace('two', 'three')
+    server.etag = '"2"'
+    assert targets(patch.fromurl(server.url)) == [('one.py', [['-one\n', '+three\n']])]
+    assert len(server.requests) == 3
+    assert HTTPCache(str(tmp_path / 'http')).stats()['entries'] == 1
+
+
+def test_max_age_and_offline(server, tmp_path, monkeypatch):
+    """Test that fresh and offline entries are used without requests"""
+    monkeypatch.setattr(patch, 'http_cache', HTTPCache(str(tmp_path / 'http'), max_age=3600))
+    assert patch.fromurl(server.url)
+    assert patch.fromurl(server.url)
+    assert len(server.requests) == 1
+
+    monkeypatch.setattr(patch, 'http_cache', HTTPCache(str(tmp_path / 'http'), offline=True))
+    server.shutdown()
+    assert targets(patch.fromurl(server.url)) == [('one.py', [['-one\n', '+two\n']])]
+    assert patch.fromurl(server.url + '?other') is False
+    assert len(server.requests) == 1
+
+    assert HTTPCache(str(tmp_path / 'http')).clear() == 1
+    assert patch.fromurl(server.url) is False
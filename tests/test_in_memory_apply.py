@@ -0,0 +1,59 @@
+import os
+
+from pypatch_url import patch
+
+
+PATCH = (
+    '--- a/pkg/one.py\n'
+    '+++ b/pkg/one.py\n'
+    '@@ -1,2 +1,2 @@\n'
+    ' def one():\n'
+    '-    return 1\n'
+    '+    return 11\n'
+    '--- a/pkg/two.py\n'
+    '+++ b/pkg/two.py\n'
+    '@@ -1,2 +1,3 @@\n'
+    ' def two():\n'
+    '+    """two"""\n'
+    '     return 2\n'
+)
+
+
+def test_apply_to_text():
+    """Test applying a single file patch to str and bytes"""
+    p = patch.fromstring(PATCH).items[0]
+
+    assert p.apply_to_text('def one():\n    return 1\n') == 'def one():\n    return 11\n'
+    assert p.apply_to_text(b'def one():\r\n    return 1\r\n') == b'def one():\r\n    return 11\r\n'
+    # already patched text is returned as is
+    assert p.apply_to_text('def one():\n    return 11\n') == 'def one():\n    return 11\n'
+    assert p.apply_to_text('def other():\n    return 1\n') is False
+
+
+def test_apply_to_mapping(tmp_path, monkeypatch):
+    """Test applying a patch set to a mapping without touching files"""
+    monkeypatch.chdir(str(tmp_path))
+    mapping = {
+        'pkg/one.py': 'def one():\n    return 1\n',
+        'pkg\\two.py': b'def two():\n    return 2\n',
+        'pkg/three.py': 'unchanged\n',
+    }
+
+    result = patch.fromstring(PATCH).apply_to_mapping(mapping, strip=1)
+
+    assert result == {
+        'pkg/one.py': 'def one():\n    return 11\n',
+        'pkg\\two.py': b'def two():\n    """two"""\n    return 2\n',
+        'pkg/three.py': 'unchanged\n',
+    }
+    # the mapping itself is not changed and nothing is written
+    assert mapping['pkg/one.py'] == 'def one():\n    return 1\n'
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_apply_to_mapping_errors():
+    """Test that missing and different files make apply_to_mapping fail"""
+    patch_set = patch.fromstring(PATCH)
+
+    assert patch_set.apply_to_mapping({'pkg/one.py': 'def one():\n    return 1\n'}, strip=1) is False
+    assert patch_set.apply_to_mapping({'pkg/one.py': 'other\n', 'pkg/two.py': 'other\n'}, strip=1) is False
@@ -0,0 +1,120 @@
+import json
+import os
+import unittest.mock as mock
+
+from pypatch_url import command, ledger, patch
+
+
+def run(action, patch_file, extra=()):
+    with mock.patch('sys.argv', ['pypatch-url', action] + list(extra) + [patch_file, 'testmodule']):
+        with mock.patch('sys.exit') as exit_mock:
+            command.main()
+    return exit_mock.call_args[0][0]
+
+
+def test_ledger_skips_applied_patch(temp_module, test_data_dir, mock_module_path, monkeypatch):
+    """Test that a re-run is confirmed from stat() without applying the patch"""
+    temp_dir, module_dir = temp_module
+    original_path = mock_module_path(temp_dir, module_dir)
+    patch_file = os.path.join(test_data_dir, 'sample.patch')
+    example = os.path.join(module_dir, 'example.py')
+
+    assert run('apply', patch_file) == 0
+    with open(os.path.join(module_dir, ledger.FILENAME)) as f:
+        files = list(json.load(f)['patches'].values())
+    assert list(files[0]) == ['example.py']
+
+    apply = patch.PatchSet.apply
+    calls = []
+
+    def counting_apply(self, *args, **kwargs):
+        calls.append(args)
+        return apply(self, *args, **kwargs)
+
+    monkeypatch.setattr(patch.PatchSet, 'apply', counting_apply)
+    assert run('apply', patch_file) == 0
+    assert calls == []
+
+    # same content with a new mtime is still applied
+    st = os.stat(example)
+    os.utime(example, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert run('apply', patch_file) == 0
+    assert calls == []
+
+    # changed file is verified in full
+    with open(example, 'w') as f:
+        f.write('def hello_world():\n    return "Hello, World!"\n')
+    assert run('apply', patch_file) == 0
+    assert len(calls) == 1
+    with open(example) as f:
+        assert 'Patched' in f.read()
+
+    # revert removes the patch from the ledger
+    assert run('revert', patch_file) == 0
+    assert ledger.Ledger(module_dir).patches == {}
+    assert run('apply', patch_file, ['--no-ledger']) == 0
+    assert ledger.Ledger(module_dir).patches == {}
+
+    os.sys.path = original_path
+
+
+def test_broken_ledger_is_ignored(tmp_path, caplog, monkeypatch):
+    """Test that a broken ledger file is not fatal"""
+    monkeypatch.chdir(str(tmp_path))
+    with open('one.py', 'w') as f:
+        f.write('one\n')
+    with open(ledger.FILENAME, 'w') as f:
+        f.write('{broken')
+    patch_set = patch.fromstring('--- one.py\n+++ one.py\n@@ -1 +1 @@\n-one\n+two\n')
+
+    book = ledger.Ledger(str(tmp_path))
+    key = book.key(patch_set)
+    assert not book.applied(key)
+    assert 'ignoring broken ledger' in caplog.text
+    assert book.record(key, patch_set)
+    assert ledger.Ledger(str(tmp_path)).applied(key)
+    assert book.key(patch_set, 1) != key
+
+
+def test_manifest_uses_ledger(tmp_path, monkeypatch):
+    """Test that apply-all records patches in ledgers of modules"""
+    from pypatch_url import manifest
+
+    os.makedirs(str(tmp_path / 'one'))
+    with open(str(tmp_path / 'one' / 'one.py'), 'w') as f:
+        f.write('one\n')
+    with open(str(tmp_path / 'one.patch'), 'w') as f:
+        f.write('--- a/one.py\n+++ b/one.py\n@@ -1 +1 @@\n-one\n+two\n')
+    with open(str(tmp_path / 'patches.toml'), 'w') as f:
+        f.write('[[patches]]\npatch = "one.patch"\nmodule = "one"\nstrip = 1\n')
+    monkeypatch.setattr(command, 'get_module_path', lambda name: str(tmp_path / name))
+
+    entries = manifest.load_manifest(str(tmp_path / 'patches.toml'))
+    assert manifest.apply_manifest(entries)
+    assert list(ledger.Ledger(str(tmp_path / 'one')).patches.values()) == [
+        {'one.py': mock.ANY}]
+
+    monkeypatch.setattr(patch.PatchSet, 'apply', mock.Mock(side_effect=AssertionError))
+    assert manifest.apply_manifest(entries)
+
+
+def test_ledgers_on_one_directory_merge(tmp_path):
+    """Test that entries written by another Ledger after this one was read are kept"""
+    patch_sets = []
+    for name in ('one', 'two', 'three'):
+        with open(str(tmp_path / (name + '.py')), 'w') as f:
+            f.write('%s\n' % name)
+        patch_sets.append(patch.fromstring('--- %s.py\n+++ %s.py\n@@ -1 +1 @@\n-%s\n+%s\n' % ((name,) * 4)))
+
+    first = ledger.Ledger(str(tmp_path))
+    second = ledger.Ledger(str(tmp_path))
+    keys = [first.key(patch_set) for patch_set in patch_sets]
+    assert first.patches == second.patches == {}
+
+    assert first.record(keys[0], patch_sets[0])
+    assert second.record(keys[1], patch_sets[1])
+    assert first.record(keys[2], patch_sets[2])
+    assert sorted(ledger.Ledger(str(tmp_path)).patches) == sorted(keys)
+
+    assert second.forget(keys[1])
+    assert sorted(ledger.Ledger(str(tmp_path)).patches) == sorted([keys[0], keys[2]])
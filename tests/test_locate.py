@@ -0,0 +1,91 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+from pypatch_url import command
+from pypatch_url import locate
+
+
+def write(path, text=''):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+@pytest.fixture
+def site(tmp_path):
+    """Two directories of packages that fail when they are imported"""
+    first, second = tmp_path / 'first', tmp_path / 'second'
+    write(first / 'broken' / '__init__.py', 'raise RuntimeError("imported")\n')
+    write(first / 'broken' / 'sub' / '__init__.py', 'raise RuntimeError("imported")\n')
+    write(first / 'single.py', 'raise RuntimeError("imported")\n')
+    write(first / 'space' / 'one' / '__init__.py')
+    write(second / 'space' / 'two' / '__init__.py')
+    write(second / 'broken' / 'shadowed' / '__init__.py')
+    return [str(first), str(second)]
+
+
+def test_packages_are_not_imported(site, monkeypatch):
+    """Test that packages are found without running their code"""
+    monkeypatch.setattr(sys, 'path', site + sys.path)
+    assert str(command.get_module_path('broken.sub')) == os.path.join(site[0], 'broken', 'sub')
+    assert str(command.get_module_path('single')) == site[0]
+    assert 'broken' not in sys.modules
+
+
+def test_namespace_packages(site):
+    """Test that all portions of namespace packages are searched"""
+    assert locate.find_module_path('space', site) == os.path.join(site[0], 'space')
+    assert locate.find_module_path('space.two', site) == os.path.join(site[1], 'space', 'two')
+
+
+def test_extended_package_path(site):
+    """Test that later directories of a package are searched after its own"""
+    assert locate.find_module_path('broken.shadowed', site) == os.path.join(site[1], 'broken', 'shadowed')
+
+
+def test_missing_modules(site, monkeypatch):
+    """Test that missing modules and submodules of modules are not found"""
+    assert locate.find_module_path('missing', site) is None
+    assert locate.find_module_path('single.sub', site) is None
+    assert locate.find_module_path('broken.missing', site) is None
+    monkeypatch.setattr(sys, 'path', site)
+    with pytest.raises(ImportError):
+        command.get_module_path('missing')
+
+
+def test_meta_path_finders(tmp_path, monkeypatch):
+    """Test that finders of editable installs are asked for top level names"""
+    package = tmp_path / 'src' / 'editable'
+    write(package / '__init__.py', 'raise RuntimeError("imported")\n')
+    write(package / 'sub' / '__init__.py')
+
+    class EditableFinder(object):
+        @classmethod
+        def find_spec(cls, name, path=None, target=None):
+            if name == 'editable':
+                return importlib.util.spec_from_file_location(name, str(package / '__init__.py'),
+                                                              submodule_search_locations=[str(package)])
+            return None
+
+    monkeypatch.setattr(sys, 'meta_path', sys.meta_path + [EditableFinder])
+    assert locate.find_module_path('editable.sub') == str(package / 'sub')
+    # finders are not asked for directories given by the caller
+    assert locate.find_module_path('editable', [str(tmp_path)]) is None
+
+
+def test_listings_are_cached(site, monkeypatch):
+    """Test that directories are listed again only when they change"""
+    locate.find_module_path('broken.sub', site)
+    listed = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: listed.append(path) or listdir(path))
+    assert locate.find_module_path('broken.sub', site) == os.path.join(site[0], 'broken', 'sub')
+    assert listed == []
+
+    open(os.path.join(site[0], 'added.py'), 'w').close()
+    st = os.stat(site[0])
+    os.utime(site[0], ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    assert locate.find_module_path('added', site) == site[0]
+    assert listed == [site[0]]
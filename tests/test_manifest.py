@@ -0,0 +1,149 @@
+import os
+import unittest.mock as mock
+
+import pytest
+
+from pypatch_url import command, manifest
+
+
+ONE = '--- a/one.py\n+++ b/one.py\n@@ -1 +1 @@\n-one = 1\n+one = 11\n'
+ONE_AGAIN = '--- one.py\n+++ one.py\n@@ -1 +1 @@\n-one = 11\n+one = 111\n'
+TWO = '--- two.py\n+++ two.py\n@@ -1 +1 @@\n-two = 2\n+two = 22\n'
+
+
+@pytest.fixture
+def modules(tmp_path, monkeypatch):
+    """Two modules, patches for them and a manifest"""
+    for name, content in (('one', 'one = 1\n'), ('two', 'two = 2\n')):
+        os.makedirs(str(tmp_path / name))
+        with open(str(tmp_path / name / (name + '.py')), 'w') as f:
+            f.write(content)
+    os.makedirs(str(tmp_path / 'patches'))
+    for name, text in (('one.patch', ONE), ('one-again.patch', ONE_AGAIN), ('two.patch', TWO)):
+        with open(str(tmp_path / 'patches' / name), 'w') as f:
+            f.write(text)
+
+    def get_module_path(module_name):
+        if module_name not in ('one', 'two'):
+            raise ImportError(module_name)
+        return str(tmp_path / module_name)
+
+    monkeypatch.setattr(command, 'get_module_path', get_module_path)
+    return tmp_path
+
+
+def write_manifest(directory, text):
+    filename = os.path.join(str(directory), 'patches.toml')
+    with open(filename, 'w') as f:
+        f.write(text)
+    return filename
+
+
+def read(directory, name):
+    with open(os.path.join(str(directory), name)) as f:
+        return f.read()
+
+
+MANIFEST = '''
+strip = 1
+
+[[patches]]
+patch = "patches/one.patch"
+module = "one"
+
+[[patches]]
+patch = "patches/two.patch"
+module = "two"
+strip = 0
+
+[[patches]]
+patch = "patches/one-again.patch"
+module = "one"
+strip = 0
+'''
+
+
+def test_load_manifest(modules):
+    """Test that defaults are used and patch names are relative to the manifest"""
+    entries = manifest.load_manifest(write_manifest(modules, MANIFEST))
+    assert [(e.patch, e.module, e.strip) for e in entries] == [
+        (os.path.join(str(modules), 'patches', 'one.patch'), 'one', 1),
+        (os.path.join(str(modules), 'patches', 'two.patch'), 'two', 0),
+        (os.path.join(str(modules), 'patches', 'one-again.patch'), 'one', 0),
+    ]
+
+
+@pytest.mark.parametrize('text', [
+    '[[patches]]\npatch = "a.patch"\n',
+    '[[patches]]\npatch = "a.patch"\nmodule = "one"\nfuzz = 1\n',
+    'patch = "a.patch"\n',
+    '[[patches]\n',
+])
+def test_invalid_manifest(modules, text):
+    """Test that invalid manifests are rejected"""
+    with pytest.raises(ValueError):
+        manifest.load_manifest(write_manifest(modules, text))
+
+
+def test_apply_manifest(modules, monkeypatch):
+    """Test that patches are applied to their modules in manifest order"""
+    monkeypatch.chdir(str(modules))
+    entries = manifest.load_manifest(write_manifest(modules, MANIFEST))
+    assert manifest.apply_manifest(entries, jobs=2)
+    assert [e.result for e in entries] == [True, True, True]
+    assert read(modules, 'one/one.py') == 'one = 111\n'
+    assert read(modules, 'two/two.py') == 'two = 22\n'
+    assert os.getcwd() == str(modules)
+
+
+def test_apply_manifest_failures(modules):
+    """Test that failing patches don't stop the others"""
+    entries = manifest.load_manifest(write_manifest(modules, MANIFEST + '''
+[[patches]]
+patch = "patches/two.patch"
+module = "three"
+
+[[patches]]
+patch = "patches/missing.patch"
+module = "two"
+'''))
+    assert not manifest.apply_manifest(entries)
+    assert [e.result for e in entries] == [True, True, True, False, False]
+    assert read(modules, 'two/two.py') == 'two = 22\n'
+
+
+def test_command_line_apply_all(modules, capsys):
+    """Test the apply-all action and its summary"""
+    argv = ['pypatch-url', 'apply-all', write_manifest(modules, MANIFEST)]
+    with mock.patch('sys.argv', argv):
+        with mock.patch('sys.exit') as exit_mock:
+            command.main()
+    exit_mock.assert_called_once_with(0)
+    assert 'Applied 3 of 3 patches to 2 modules' in capsys.readouterr().out
+    assert read(modules, 'one/one.py') == 'one = 111\n'
+
+
+def test_apply_manifest_modules_in_one_directory(tmp_path, monkeypatch):
+    """Test that single file modules of one directory share its ledger and nested roots are patched serially"""
+    from pypatch_url import ledger
+
+    site = tmp_path / 'site'
+    os.makedirs(str(site / 'pkg'))
+    patches = ''
+    for module, filename in (('alpha', 'alpha.py'), ('beta', 'beta.py'), ('pkg', 'pkg/mod.py')):
+        with open(str(site / filename), 'w') as f:
+            f.write('%s = 1\n' % module)
+        with open(str(tmp_path / (module + '.patch')), 'w') as f:
+            f.write('--- %s\n+++ %s\n@@ -1 +1 @@\n-%s = 1\n+%s = 2\n'
+                    % ((os.path.basename(filename),) * 2 + (module,) * 2))
+        patches += '[[patches]]\npatch = "%s.patch"\nmodule = "%s"\n\n' % (module, module)
+    monkeypatch.setattr(command, 'get_module_path',
+                        lambda name: str(site / 'pkg') if name == 'pkg' else str(site))
+
+    entries = manifest.load_manifest(write_manifest(tmp_path, patches))
+    assert manifest._nested([str(site), str(site / 'pkg'), None]) == [[str(site), str(site / 'pkg')], [None]]
+    assert manifest.apply_manifest(entries, jobs=4)
+    assert [read(site, name) for name in ('alpha.py', 'beta.py', 'pkg/mod.py')] == [
+        'alpha = 2\n', 'beta = 2\n', 'pkg = 2\n']
+    assert sorted(f for files in ledger.Ledger(str(site)).patches.values() for f in files) == ['alpha.py', 'beta.py']
+    assert list(ledger.Ledger(str(site / 'pkg')).patches.values()) == [{'mod.py': mock.ANY}]
@@ -0,0 +1,58 @@
+import os
+import pickle
+
+from pypatch_url import patch
+
+
+def write_patch(directory, name, content):
+    filename = os.path.join(directory, name)
+    with open(filename, 'wb') as f:
+        f.write(content)
+    return filename
+
+
+def test_mmap_matches_text_parse(test_data_dir):
+    """Test that memory mapped parsing gives the same patches"""
+    for name in ('sample.patch', 'nested_path.patch'):
+        filename = os.path.join(test_data_dir, name)
+        text = patch.fromfile(filename)
+        mapped = patch.fromfile(filename, mmap=True)
+
+        assert [(p.source, p.target, p.type, p.header) for p in mapped.items] == \
+               [(p.source, p.target, p.type, p.header) for p in text.items]
+        assert [h.text for p in mapped.items for h in p.hunks] == \
+               [h.text for p in text.items for h in p.hunks]
+
+
+def test_mmap_keeps_hunks_in_buffer(tmp_path):
+    """Test that hunk text is decoded from the mapped file on access"""
+    filename = write_patch(str(tmp_path), 'crlf.patch', (
+        b'--- caf\xc3\xa9.py\r\n'
+        b'+++ caf\xc3\xa9.py\r\n'
+        b'@@ -1,2 +1,2 @@\r\n'
+        b' def caf\xc3\xa9():\r\n'
+        b'-    return 1\r\n'
+        b'+    return 2\r\n'
+    ))
+
+    patch_set = patch.fromfile(filename, mmap=True)
+    p = patch_set.items[0]
+    hunk = p.hunks[0]
+
+    assert p.source == 'café.py'
+    assert hunk._text is None
+    assert hunk.text == [' def café():\r\n', '-    return 1\r\n', '+    return 2\r\n']
+    # binary parsing keeps line ends that text mode would translate
+    assert p.hunkends['crlf'] == 3
+
+    restored = pickle.loads(pickle.dumps(hunk))
+    assert restored.text == hunk.text
+
+
+def test_mmap_stream_and_empty_file(tmp_path, test_data_dir):
+    """Test streamed memory mapped parsing and empty patch files"""
+    filename = os.path.join(test_data_dir, 'sample.patch')
+    streamed = patch.fromfile(filename, stream=True, mmap=True)
+    assert [p.target for p in streamed] == [p.target for p in patch.fromfile(filename).items]
+
+    assert patch.fromfile(write_patch(str(tmp_path), 'empty.patch', b''), mmap=True) is False
@@ -0,0 +1,75 @@
+import os
+
+from pypatch_url import patch
+
+
+PATCH = (
+    '--- example.py\n'
+    '+++ example.py\n'
+    '@@ -1,4 +1,4 @@\n'
+    ' def one():\n'
+    '-    return 1\n'
+    '+    return 11\n'
+    ' \n'
+    ' \n'
+    '@@ -8,3 +8,3 @@\n'
+    ' def three():\n'
+    '-    return 3\n'
+    '+    return 33\n'
+    ' # end\n'
+)
+
+ORIGINAL = ('def one():\n    return 1\n\n\n'
+            'def two():\n    return 2\n\n'
+            'def three():\n    return 3\n# end\n')
+PATCHED = ORIGINAL.replace('return 1', 'return 11').replace('return 3', 'return 33')
+HEADER = 'import os\nimport sys\n\n'
+
+
+def offsets(p, text, fuzz=0):
+    """return (offset, fuzz) of every hunk of Patch `p` found in `text`"""
+    found = p.check_lines(text.splitlines(True), fuzz=fuzz)[2]
+    return [(offset, level) for _, _, offset, level in found]
+
+
+def test_hunks_found_at_offset(tmp_path, monkeypatch):
+    """Test that hunks are found when lines were added to the file"""
+    filename = os.path.join(str(tmp_path), 'example.py')
+    with open(filename, 'w') as f:
+        f.write(HEADER + ORIGINAL)
+    monkeypatch.chdir(str(tmp_path))
+    patch_set = patch.fromstring(PATCH)
+
+    assert offsets(patch_set.items[0], HEADER + ORIGINAL) == [(3, 0), (3, 0)]
+    assert patch_set.apply()
+    with open(filename) as f:
+        assert f.read() == HEADER + PATCHED
+
+
+def test_offset_is_carried_to_next_hunks():
+    """Test that later hunks are looked for after the previous ones"""
+    p = patch.fromstring(PATCH).items[0]
+    # second hunk also matches before the first one moved
+    text = 'def three():\n    return 3\n# end\n' + HEADER + ORIGINAL
+
+    assert p.apply_to_text(text) == 'def three():\n    return 3\n# end\n' + HEADER + PATCHED
+    assert offsets(p, text) == [(6, 0), (6, 0)]
+
+
+def test_fuzz():
+    """Test that changed context lines are ignored with fuzz"""
+    p = patch.fromstring(PATCH).items[0]
+    text = ORIGINAL.replace('# end', '# the end')
+
+    assert p.apply_to_text(text) is False
+    assert offsets(p, text) == []
+    assert p.apply_to_text(text, fuzz=1) == PATCHED.replace('# end', '# the end')
+    assert offsets(p, text, fuzz=1) == [(0, 0), (0, 1)]
+
+
+def test_already_patched_is_not_patched_at_offset():
+    """Test that patched text is not patched again where context moved to"""
+    p = patch.fromstring('--- a.py\n+++ a.py\n@@ -1,2 +1,3 @@\n+import os\n import sys\n import re\n').items[0]
+
+    assert p.apply_to_text('import sys\nimport re\n') == 'import os\nimport sys\nimport re\n'
+    assert p.apply_to_text('import os\nimport sys\nimport re\n') == 'import os\nimport sys\nimport re\n'
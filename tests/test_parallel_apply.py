@@ -0,0 +1,70 @@
+import logging
+import os
+import unittest.mock as mock
+
+from pypatch_url import command, patch
+
+
+def make_files(directory, count):
+    """Create files and a patch that changes all of them"""
+    out = []
+    for n in range(count):
+        with open(os.path.join(directory, 'file_%d.py' % n), 'w') as f:
+            f.write('def f():\n    return %d\n' % n)
+        out.append('--- file_%d.py\n+++ file_%d.py\n'
+                   '@@ -1,2 +1,2 @@\n def f():\n-    return %d\n+    return %d\n' % (n, n, n, n * 10))
+    return ''.join(out)
+
+
+def test_parallel_apply_matches_serial(tmp_path, caplog, monkeypatch):
+    """Test that files are patched concurrently with messages in file order"""
+    monkeypatch.chdir(str(tmp_path))
+    text = make_files(str(tmp_path), 20)
+    # one file is missing and one is different
+    os.unlink('file_3.py')
+    with open('file_7.py', 'w') as f:
+        f.write('something else\n')
+    caplog.set_level(logging.INFO, logger='pypatch.patch')
+
+    assert not patch.fromstring(text).apply(workers=4)
+
+    for n in range(20):
+        if n not in (3, 7):
+            with open('file_%d.py' % n) as f:
+                assert f.read() == 'def f():\n    return %d\n' % (n * 10)
+    messages = [r.getMessage() for r in caplog.records if r.levelno >= logging.WARNING]
+    assert messages == ['source/target file does not exist\n--- file_3.py\n+++ file_3.py',
+                        'source file is different - file_7.py']
+    patched = [r.getMessage() for r in caplog.records if r.getMessage().startswith('successfully')]
+    assert patched == ['successfully patched %d/20:\t file_%d.py' % (n + 1, n)
+                       for n in range(20) if n not in (3, 7)]
+
+
+def test_parallel_apply_same_file_is_serial(temp_module, test_data_dir, caplog, monkeypatch):
+    """Test that patches for the same file are applied one after another"""
+    _, module_dir = temp_module
+    monkeypatch.chdir(module_dir)
+    caplog.set_level(logging.DEBUG, logger='pypatch.patch')
+
+    # sample.patch changes example.py twice
+    patch_set = patch.fromfile(os.path.join(test_data_dir, 'sample.patch'))
+    assert patch_set.apply(workers=4)
+    assert 'applying serially' in caplog.text
+    assert 'already patched  example.py' in caplog.text
+
+
+def test_command_line_jobs(temp_module, test_data_dir, mock_module_path):
+    """Test the --jobs option"""
+    temp_dir, module_dir = temp_module
+    original_path = mock_module_path(temp_dir, module_dir)
+
+    with mock.patch('sys.argv', ['pypatch-url', 'apply', '--jobs', '4',
+                                 os.path.join(test_data_dir, 'sample.patch'), 'testmodule']):
+        with mock.patch('sys.exit') as exit_mock:
+            command.main()
+
+    exit_mock.assert_called_once_with(0)
+    with open(os.path.join(module_dir, 'example.py')) as f:
+        assert 'return "Hello, Patched World!"' in f.read()
+
+    os.sys.path = original_path
@@ -0,0 +1,85 @@
+import logging
+from io import StringIO
+
+from pypatch_url import patch
+
+
+def generate_patch(files):
+    """Return patch with git and plain file sections"""
+    out = []
+    for f in range(files):
+        if f % 3:
+            out.append('diff --git a/module_%d.py b/module_%d.py\n' % (f, f))
+            out.append('index 1234567..89abcde 100644\n')
+            out.append('--- a/module_%d.py\n+++ b/module_%d.py\n' % (f, f))
+        else:
+            out.append('--- module_%d.py\n+++ module_%d.py\n' % (f, f))
+        for h in range(3):
+            out.append('@@ -%d,4 +%d,4 @@\n' % (1 + h * 20, 1 + h * 20))
+            out.append(' context\n-removed\n+added\n')
+            # empty context line that lost its leading space
+            out.append('\n')
+            out.append(' context\n')
+    return ''.join(out)
+
+
+def snapshot(patchset, result):
+    return (result, patchset.errors, patchset.warnings, patchset.type,
+            [(p.source, p.target, p.header, p.type, p.hunkends,
+              [(h.startsrc, h.linessrc, h.starttgt, h.linestgt, h.invalid, h.text) for h in p.hunks])
+             for p in patchset.items])
+
+
+def test_parallel_parse_matches_serial(monkeypatch):
+    """Test that parsing in worker processes gives serial results"""
+    monkeypatch.setattr(patch, '_MIN_CHUNK_LINES', 1)
+    text = generate_patch(40)
+
+    serial = patch.PatchSet()
+    serial_result = serial.parse(StringIO(text))
+    parallel = patch.PatchSet()
+    parallel_result = parallel.parse(StringIO(text), workers=2)
+
+    assert patch._split_points(StringIO(text).readlines(), 8)
+    assert snapshot(parallel, parallel_result) == snapshot(serial, serial_result)
+    assert parallel.type == patch.MIXED
+    assert parallel.warnings == 40 * 3
+
+
+def test_parallel_parse_falls_back_to_serial(monkeypatch, caplog):
+    """Test that parts which can not be parsed separately are parsed serially"""
+    monkeypatch.setattr(patch, '_MIN_CHUNK_LINES', 1)
+    caplog.set_level(logging.DEBUG, logger='pypatch.patch')
+    # hunk claims more lines than it has, so the file after it
+    # is a part of the broken hunk
+    text = (generate_patch(4)
+            + '--- a.py\n+++ a.py\n@@ -1,5 +1,5 @@\n a\n-b\n+c\n'
+            + generate_patch(4))
+
+    serial = patch.PatchSet()
+    serial_result = serial.parse(StringIO(text))
+    parallel = patch.PatchSet()
+    parallel_result = parallel.parse(StringIO(text), workers=2)
+
+    assert snapshot(parallel, parallel_result) == snapshot(serial, serial_result)
+    assert parallel.errors > 0
+    assert 'parsing serially' in caplog.text
+
+
+def test_parallel_parse_logs_like_serial(monkeypatch, caplog):
+    """Test that messages of worker processes name the same patches as a serial parse"""
+    monkeypatch.setattr(patch, '_MIN_CHUNK_LINES', 1)
+    caplog.set_level(logging.WARNING, logger='pypatch.patch')
+    # absolute and parent paths are reported with the number of the patch
+    text = generate_patch(40).replace('--- module_', '--- /abs/module_').replace('+++ module_', '+++ ../module_')
+
+    serial = patch.PatchSet()
+    serial.parse(StringIO(text))
+    serial_messages = [r.getMessage() for r in caplog.records]
+    caplog.clear()
+    parallel = patch.PatchSet()
+    parallel.parse(StringIO(text), workers=2)
+    parallel_messages = [r.getMessage() for r in caplog.records]
+
+    assert 'error: stripping parent path for target file patch no.40' in serial_messages
+    assert parallel_messages == serial_messages
@@ -0,0 +1,123 @@
+import os
+import unittest.mock as mock
+
+import pytest
+
+from pypatch_url import cache, command, patch
+
+
+def snapshot(patch_set):
+    return (patch_set.type, patch_set.errors, patch_set.warnings,
+            [(p.source, p.target, p.type, p.header, [h.text for h in p.hunks])
+             for p in patch_set.items])
+
+
+def test_fromfile_uses_cache(monkeypatch, test_data_dir, parse_cache_dir):
+    """Test that a second parse of the same file comes from the cache"""
+    parse_cache = cache.ParseCache()
+    monkeypatch.setattr(patch, 'parse_cache', parse_cache)
+    filename = os.path.join(test_data_dir, 'sample.patch')
+
+    first = patch.fromfile(filename)
+    second = patch.fromfile(filename)
+    mapped = patch.fromfile(filename, mmap=True)
+    mapped_again = patch.fromfile(filename, mmap=True)
+
+    assert parse_cache.directory == parse_cache_dir
+    assert (parse_cache.hits, parse_cache.misses) == (2, 2)
+    assert snapshot(second) == snapshot(first)
+    assert snapshot(mapped_again) == snapshot(mapped)
+    assert parse_cache.stats()['entries'] == 2
+
+
+def test_cache_key_depends_on_content_and_options(tmp_path):
+    """Test that keys change with patch bytes, options and parser version"""
+    parse_cache = cache.ParseCache(str(tmp_path))
+    key = parse_cache.key(b'--- a\n', compact=False)
+
+    assert parse_cache.key(b'--- a\n', compact=False) == key
+    assert parse_cache.key(b'--- b\n', compact=False) != key
+    assert parse_cache.key(b'--- a\n', compact=True) != key
+    with mock.patch.object(patch, '__version__', '0'):
+        assert parse_cache.key(b'--- a\n', compact=False) != key
+
+
+def test_fromstring_and_fromurl_use_cache(monkeypatch, tmp_path, mock_url_response):
+    """Test that texts parsed from strings and URLs are cached"""
+    parse_cache = cache.ParseCache(str(tmp_path))
+    monkeypatch.setattr(patch, 'parse_cache', parse_cache)
+    text = '--- a.py\n+++ a.py\n@@ -1 +1 @@\n-a\n+b\n'
+    mock_url_response(text, monkeypatch)
+
+    assert snapshot(patch.fromstring(text)) == snapshot(patch.fromurl('http://example.com/a.patch'))
+    assert (parse_cache.hits, parse_cache.misses) == (1, 1)
+    # failed parses are not cached
+    assert patch.fromstring('--- a.py\n+++ a.py\n@@ -1 +1 @@\n@@\n') is False
+    assert parse_cache.stats()['entries'] == 1
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    """Test that old entries are removed when the cache is over its size limit"""
+    parse_cache = cache.ParseCache(str(tmp_path))
+    patch_set = patch.fromstring('--- a.py\n+++ a.py\n@@ -1 +1 @@\n-a\n+b\n')
+    for n, key in enumerate(('old', 'used', 'new')):
+        assert parse_cache.put(key, patch_set)
+        os.utime(os.path.join(parse_cache.directory, key + cache.SUFFIX), (n, n))
+    assert parse_cache.get('old')
+    entry_size = parse_cache.stats()['size'] // 3
+
+    parse_cache.max_size = entry_size * 2
+    assert parse_cache.evict() == 1
+    assert parse_cache.get('used') is None
+    assert parse_cache.get('old') and parse_cache.get('new')
+
+
+def test_broken_entry_is_a_miss(tmp_path):
+    """Test that unreadable cache entries are removed"""
+    parse_cache = cache.ParseCache(str(tmp_path))
+    with open(os.path.join(str(tmp_path), 'broken' + cache.SUFFIX), 'wb') as f:
+        f.write(b'not a pickle')
+
+    assert parse_cache.get('broken') is None
+    assert parse_cache.stats()['entries'] == 0
+
+
+def test_command_line_cache(temp_module, test_data_dir, mock_module_path, parse_cache_dir, capsys):
+    """Test that the command line caches parsed patches unless --no-cache is given"""
+    temp_dir, module_dir = temp_module
+    patch_file = os.path.join(test_data_dir, 'sample.patch')
+    original_path = mock_module_path(temp_dir, module_dir)
+
+    with mock.patch('sys.argv', ['pypatch-url', 'apply', '--no-cache', patch_file, 'testmodule']):
+        with mock.patch('sys.exit'):
+            command.main()
+    assert not os.path.exists(parse_cache_dir)
+
+    with mock.patch('sys.argv', ['pypatch-url', 'apply', patch_file, 'testmodule']):
+        with mock.patch('sys.exit'):
+            command.main()
+    assert patch.parse_cache is None
+
+    capsys.readouterr()
+    with mock.patch('sys.argv', ['pypatch-url', 'cache', 'stats']):
+        with mock.patch('sys.exit') as exit_mock:
+            command.main()
+    assert 'Entries: 1' in capsys.readouterr().out
+    exit_mock.assert_called_once_with(0)
+
+    with mock.patch('sys.argv', ['pypatch-url', 'cache', 'clear', '--cache-dir', parse_cache_dir]):
+        with mock.patch('sys.exit'):
+            command.main()
+    assert 'Removed 1 entries' in capsys.readouterr().out
+    assert cache.ParseCache().stats()['entries'] == 0
+
+    os.sys.path = original_path
+
+
+def test_command_line_cache_without_action(capsys):
+    """Test that the cache command without an action exits with usage instead of a traceback"""
+    with mock.patch('sys.argv', ['pypatch-url', 'cache']):
+        with pytest.raises(SystemExit) as exc_info:
+            command.main()
+    assert exc_info.value.code == 2
+    assert 'required: action' in capsys.readouterr().err
@@ -0,0 +1,90 @@
+import os
+import time
+from io import StringIO
+
+import pytest
+
+from pypatch_url import patch
+
+
+EDGE_CASES = [
+    '',
+    'no patch here\n',
+    '--- a.py\n+++ a.py\n@@ -1,2 +1,2 @@\n a\n-b\n+c\n',
+    # empty line inside of hunk is a context line
+    '--- a.py\n+++ a.py\n@@ -1,3 +1,3 @@\n a\n\n-b\n+c\n',
+    # crlf and missing newline markers
+    '--- a.py\n+++ a.py\n@@ -1,2 +1,2 @@\n a\r\n-b\r\n+c\n\\ No newline at end of file\n',
+    # extra and invalid hunk lines
+    '--- a.py\n+++ a.py\n@@ -1,1 +1,1 @@\n-a\n+b\n+c\n--- b.py\n+++ b.py\n@@ -1 +1 @@\n-a\njunk\n',
+    # empty hunk, missing target, incomplete stream
+    '--- a.py\n+++ a.py\n@@ -1,0 +1,0 @@\njunk\n--- b.py\njunk\n--- c.py\n+++ c.py\n@@ -1,2 +1,2 @@\n a\n',
+    # svn, hg and git headers with parent and absolute paths
+    'Index: a.py\n' + '=' * 67 + '\n--- ../a.py\n+++ ../a.py\n@@ -1 +1 @@\n-a\n+b\n'
+    'diff -r 123456789abc c.py\n--- a/c.py\n+++ b/c.py\n@@ -1 +1 @@\n-a\n+b\n'
+    'diff --git a/d.py b/d.py\nindex 1234567..89abcde 100644\n--- /d.py\n+++ /d.py\n@@ -1 +1 @@\n-a\n+b\n'
+    'trailing garbage\n',
+]
+
+
+def snapshot(patchset, result):
+    """Return comparable representation of parse results"""
+    return (result, patchset.errors, patchset.warnings, patchset.type,
+            [(p.source, p.target, list(p.header), p.type, dict(p.hunkends),
+              [(h.startsrc, h.linessrc, h.starttgt, h.linestgt, h.invalid, list(h.text))
+               for h in p.hunks])
+             for p in patchset.items])
+
+
+def parse_with(text, engine):
+    patchset = patch.PatchSet()
+    result = patchset.parse(StringIO(text), engine=engine)
+    return snapshot(patchset, result)
+
+
+def generate_patch(files):
+    out = []
+    for f in range(files):
+        out.append('--- module_%d.py\n+++ module_%d.py\n' % (f, f))
+        for h in range(4):
+            out.append('@@ -%d,6 +%d,6 @@\n' % (1 + h * 20, 1 + h * 20))
+            out.extend(' context line %d\n' % c for c in range(2))
+            out.extend('-removed line %d\n' % c for c in range(2))
+            out.extend('+added line %d\n' % c for c in range(2))
+            out.extend(' context line %d\n' % c for c in range(2))
+    return ''.join(out)
+
+
+@pytest.mark.parametrize('text', EDGE_CASES)
+def test_engines_give_identical_results(text):
+    """Test that fast and legacy engines agree on tricky input"""
+    assert parse_with(text, 'fast') == parse_with(text, 'legacy')
+
+
+def test_engines_on_test_data(test_data_dir):
+    """Test that fast and legacy engines agree on bundled patches"""
+    for name in os.listdir(test_data_dir):
+        if name.endswith('.patch'):
+            with open(os.path.join(test_data_dir, name)) as fp:
+                text = fp.read()
+            assert parse_with(text, 'fast') == parse_with(text, 'legacy')
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        patch.PatchSet().parse(StringIO(''), engine='turbo')
+
+
+def test_fast_engine_is_faster():
+    """Test that fast engine beats the legacy one on a large patch"""
+    text = generate_patch(500)
+
+    def best(engine):
+        times = []
+        for _ in range(3):
+            started = time.perf_counter()
+            patch.PatchSet().parse(StringIO(text), engine=engine)
+            times.append(time.perf_counter() - started)
+        return min(times)
+
+    assert best('fast') < best('legacy')
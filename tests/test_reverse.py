@@ -0,0 +1,100 @@
+import os
+import unittest.mock as mock
+
+from pypatch_url import command, patch
+
+
+PATCH = (
+    '--- one.py\n'
+    '+++ one.py\n'
+    '@@ -1,2 +1,3 @@\n'
+    ' def one():\n'
+    '-    return 1\n'
+    '+    one = 1\n'
+    '+    return one\n'
+    '@@ -4,2 +5,2 @@\n'
+    ' def two():\n'
+    '-    return 2\n'
+    '+    return 22\n'
+)
+
+ORIGINAL = 'def one():\n    return 1\n\ndef two():\n    return 2\n'
+PATCHED = 'def one():\n    one = 1\n    return one\n\ndef two():\n    return 22\n'
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_reversed_hunk():
+    """Test that reversed hunk swaps ranges and lines"""
+    h = patch.fromstring(PATCH).items[0].hunks[0].reversed()
+    assert (h.startsrc, h.linessrc, h.starttgt, h.linestgt) == (1, 3, 1, 2)
+    assert h.text == [' def one():\n', '+    return 1\n', '-    one = 1\n', '-    return one\n']
+
+
+def test_reverse_apply(tmp_path, monkeypatch):
+    """Test that reverse apply restores original and skips reverted file"""
+    monkeypatch.chdir(str(tmp_path))
+    write('one.py', ORIGINAL)
+    patch_set = patch.fromstring(PATCH)
+
+    assert patch_set.apply()
+    assert read('one.py') == PATCHED
+    assert patch_set.apply(reverse=True)
+    assert read('one.py') == ORIGINAL
+    # already reverted
+    assert patch_set.apply(reverse=True)
+    assert read('one.py') == ORIGINAL
+    assert [r.status for r in patch_set.check(reverse=True)] == [patch.ALREADY_APPLIED]
+
+
+def test_reverse_apply_several_patches_to_one_file(tmp_path, monkeypatch):
+    """Test that patches are reverted in the opposite order"""
+    monkeypatch.chdir(str(tmp_path))
+    write('one.py', ORIGINAL)
+    patch_set = patch.fromstring(PATCH + (
+        '--- one.py\n'
+        '+++ one.py\n'
+        '@@ -5,2 +5,2 @@\n'
+        ' def two():\n'
+        '-    return 22\n'
+        '+    return 222\n'))
+
+    assert patch_set.apply()
+    assert read('one.py') == PATCHED.replace('22', '222')
+    assert patch_set.apply(reverse=True)
+    assert read('one.py') == ORIGINAL
+
+
+def test_reverse_conflict(tmp_path, monkeypatch):
+    """Test that a file that is neither patched nor reverted is not changed"""
+    monkeypatch.chdir(str(tmp_path))
+    write('one.py', ORIGINAL.replace('2', '3'))
+    assert not patch.fromstring(PATCH).apply(reverse=True)
+    assert read('one.py') == ORIGINAL.replace('2', '3')
+
+
+def test_command_line_revert(temp_module, test_data_dir, mock_module_path, capsys):
+    """Test the revert action"""
+    temp_dir, module_dir = temp_module
+    original_path = mock_module_path(temp_dir, module_dir)
+    example = os.path.join(module_dir, 'example.py')
+    original = read(example)
+    patch_file = os.path.join(test_data_dir, 'sample.patch')
+
+    for action in ('apply', 'revert'):
+        with mock.patch('sys.argv', ['pypatch-url', action, patch_file, 'testmodule']):
+            with mock.patch('sys.exit') as exit_mock:
+                command.main()
+        exit_mock.assert_called_once_with(0)
+    assert "Module 'testmodule' reverted successfully!" in capsys.readouterr().out
+    assert read(example) == original
+
+    os.sys.path = original_path
@@ -0,0 +1,135 @@
+import os
+import unittest.mock as mock
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pypatch_url import command, patch
+
+
+PATCH = (
+    '--- pkg/one.py\n'
+    '+++ pkg/one.py\n'
+    '@@ -1,2 +1,2 @@\n'
+    ' def one():\n'
+    '-    return 1\n'
+    '+    return 11\n'
+)
+
+ORIGINAL = 'def one():\n    return 1\n'
+PATCHED = 'def one():\n    return 11\n'
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+@pytest.fixture
+def roots(tmp_path, monkeypatch):
+    """Directories with a copy of pkg/one.py, and another working directory"""
+    roots = [str(tmp_path / ('root%d' % n)) for n in range(32)]
+    for root in roots:
+        write(os.path.join(root, 'pkg', 'one.py'), ORIGINAL)
+    os.makedirs(str(tmp_path / 'cwd'))
+    monkeypatch.chdir(str(tmp_path / 'cwd'))
+    return roots
+
+
+def test_apply_with_root(roots):
+    """Test that file names are relative to root and the working directory is kept"""
+    cwd = os.getcwd()
+    result = patch.fromstring(PATCH).apply(root=roots[0])
+    assert result
+    assert os.getcwd() == cwd
+    assert read(os.path.join(roots[0], 'pkg', 'one.py')) == PATCHED
+    assert result.changed == [os.path.join(roots[0], 'pkg', 'one.py')]
+
+    results = patch.fromstring(PATCH).check(root=roots[0])
+    assert [(r.filename, r.status) for r in results] == [(os.path.join(roots[0], 'pkg', 'one.py'), patch.ALREADY_APPLIED)]
+    assert patch.fromstring(PATCH).apply(1, root=os.path.join(roots[0], 'pkg'), reverse=True)
+    assert read(os.path.join(roots[0], 'pkg', 'one.py')) == ORIGINAL
+
+
+def test_concurrent_roots(roots):
+    """Test that one PatchSet is applied to many directories from many threads at once"""
+    patch_set = patch.fromstring(PATCH)
+    with ThreadPoolExecutor(max_workers=len(roots)) as executor:
+        results = list(executor.map(lambda root: patch_set.apply(root=root), roots))
+    for root, result in zip(roots, results):
+        assert result
+        assert result.changed == [os.path.join(root, 'pkg', 'one.py')]
+        assert read(os.path.join(root, 'pkg', 'one.py')) == PATCHED
+
+
+needs_dir_fd = pytest.mark.skipif(os.open not in os.supports_dir_fd or os.rename not in os.supports_dir_fd,
+                                  reason='needs os functions with dir_fd')
+
+
+@needs_dir_fd
+@pytest.mark.parametrize('options', [{}, {'transactional': True}, {'workers': 2}],
+                         ids=['fused', 'transactional', 'workers'])
+def test_apply_with_dir_fd(roots, monkeypatch, options):
+    """Test that file names are relative to an open directory, even when it is renamed"""
+    link = os.path.join(roots[0], 'pkg', 'link.py')
+    os.symlink('one.py', link)
+    fd = os.open(roots[0], os.O_RDONLY)
+    try:
+        os.rename(roots[0], roots[0] + '.moved')
+        result = patch.fromstring(PATCH).apply(dir_fd=fd, **options)
+        assert result.changed == ['pkg/one.py']
+        assert [r.status for r in patch.fromstring(PATCH).check(dir_fd=fd)] == [patch.ALREADY_APPLIED]
+        assert patch.fromstring(PATCH).apply(root='pkg', dir_fd=fd, reverse=True, strip=1, **options)
+
+        # symlinks are replaced by the file they point to, large files by copying ranges
+        monkeypatch.setattr(patch, 'copy_threshold', 0)
+        result = patch.fromstring(PATCH.replace('one.py', 'link.py')).apply(root='pkg', dir_fd=fd, strip=1, **options)
+        assert result.changed == ['pkg/one.py']
+    finally:
+        os.close(fd)
+    moved = os.path.join(roots[0] + '.moved', 'pkg')
+    assert read(os.path.join(moved, 'one.py')) == PATCHED
+    assert os.path.islink(os.path.join(moved, 'link.py'))
+    assert sorted(os.listdir(moved)) == ['link.py', 'one.py']
+
+
+@needs_dir_fd
+def test_invalid_dir_fd(roots):
+    """Test that a file descriptor that is not an open directory, or the legacy engine, is an error"""
+    fd = os.open(os.path.join(roots[0], 'pkg', 'one.py'), os.O_RDONLY)
+    try:
+        with pytest.raises(ValueError):
+            patch.fromstring(PATCH).apply(dir_fd=fd)
+    finally:
+        os.close(fd)
+    with pytest.raises(ValueError):
+        patch.fromstring(PATCH).apply(dir_fd=fd)
+
+    fd = os.open(roots[0], os.O_RDONLY)
+    try:
+        with pytest.raises(ValueError):
+            patch.fromstring(PATCH).apply(dir_fd=fd, engine='legacy')
+    finally:
+        os.close(fd)
+
+
+def test_command_line_keeps_working_directory(roots, monkeypatch):
+    """Test that the command line applies patches without changing the working directory"""
+    cwd = os.getcwd()
+    monkeypatch.setattr(command, 'get_module_path', lambda name: os.path.join(roots[0], 'pkg'))
+    write(os.path.join(cwd, 'fix.patch'), PATCH)
+
+    args = mock.Mock()
+    args.patch_file = 'fix.patch'
+    args.module = 'pkg'
+    args.strip = 1
+
+    assert command.apply_patch(args, debug=False)
+    assert os.getcwd() == cwd
+    assert read(os.path.join(roots[0], 'pkg', 'one.py')) == PATCHED
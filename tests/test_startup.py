@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+# modules that are imported only when an action needs them
+LAZY_MODULES = [
+    'argparse', 'six', 'logging.config', 'urllib.request', 'http.client', 'ssl',
+    'json', 'pickle', 'tempfile', 'shutil', 'concurrent.futures',
+    'pypatch_url.cache', 'pypatch_url.ledger', 'pypatch_url.bytecode', 'pypatch_url.fetch', 'pypatch_url.manifest',
+]
+
+# seconds to import the command line module, generous for slow machines and sources without bytecode
+STARTUP_BUDGET = 0.25
+
+
+def import_times(code):
+    """Return {module: cumulative seconds} of imports made by running code in a new interpreter"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))]
+                                        + [path for path in [env.get('PYTHONPATH')] if path])
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def test_lazy_imports():
+    """Test that importing the command line module does not import modules of optional features"""
+    startup = set(import_times('pass'))
+    imported = set(import_times('import pypatch_url.command')) - startup
+    assert 'pypatch_url.patch' in imported
+    assert sorted(imported.intersection(LAZY_MODULES)) == []
+
+
+def test_startup_time():
+    """Test that the command line module is imported within the startup budget"""
+    best = min(import_times('import pypatch_url.command')['pypatch_url.command'] for _ in range(3))
+    assert best < STARTUP_BUDGET
@@ -0,0 +1,71 @@
+import os
+from io import StringIO
+
+from pypatch_url import patch
+
+
+MULTI_FILE_PATCH = (
+    'diff --git a/one.py b/one.py\n'
+    'index 1234567..89abcde 100644\n'
+    '--- a/one.py\n'
+    '+++ b/one.py\n'
+    '@@ -1,2 +1,2 @@\n'
+    ' def one():\n'
+    '-    return 1\n'
+    '+    return 11\n'
+    'diff --git a/two.py b/two.py\n'
+    'index 1234567..89abcde 100644\n'
+    '--- a/two.py\n'
+    '+++ b/two.py\n'
+    '@@ -1,2 +1,2 @@\n'
+    ' def two():\n'
+    '-    return 2\n'
+    '+    return 22\n'
+)
+
+
+def test_iterparse_matches_parse():
+    """Test that streamed patches are the same as parsed ones"""
+    parsed = patch.PatchSet(StringIO(MULTI_FILE_PATCH))
+    streamed = patch.PatchSet()
+    items = list(streamed.iterparse(StringIO(MULTI_FILE_PATCH)))
+
+    assert [(p.source, p.target, p.type) for p in items] == \
+           [(p.source, p.target, p.type) for p in parsed.items]
+    assert [h.text for p in items for h in p.hunks] == \
+           [h.text for p in parsed.items for h in p.hunks]
+    assert streamed.type == parsed.type == patch.GIT
+    assert streamed.errors == 0
+    # streamed patches are not collected
+    assert streamed.items == []
+
+
+def test_iterparse_yields_before_end_of_stream():
+    """Test that the first file is available before the whole stream is read"""
+    consumed = []
+
+    def lines():
+        for line in StringIO(MULTI_FILE_PATCH):
+            consumed.append(line)
+            yield line
+
+    patches = patch.PatchSet().iterparse(lines())
+    first = next(patches)
+
+    assert first.source == 'one.py'
+    assert len(consumed) < len(MULTI_FILE_PATCH.splitlines())
+    assert [p.source for p in patches] == ['two.py']
+
+
+def test_fromfile_stream_apply(temp_module, test_data_dir, monkeypatch):
+    """Test applying a streamed patch file"""
+    _, module_dir = temp_module
+    monkeypatch.chdir(module_dir)
+
+    patch_set = patch.fromfile(os.path.join(test_data_dir, 'sample.patch'), stream=True)
+    assert patch_set.apply()
+
+    with open(os.path.join(module_dir, 'example.py'), 'r') as f:
+        content = f.read()
+
+    assert 'return "Hello, Patched World!"' in content
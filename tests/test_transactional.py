@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from pypatch_url import patch
+
+
+def make_files(directory, count):
+    """Create files and a patch that changes all of them"""
+    out = []
+    for n in range(count):
+        with open(os.path.join(directory, 'file_%d.py' % n), 'w') as f:
+            f.write('def f():\n    return %d\n' % n)
+        out.append('--- file_%d.py\n+++ file_%d.py\n'
+                   '@@ -1,2 +1,2 @@\n def f():\n-    return %d\n+    return %d\n' % (n, n, n, n * 10))
+    return ''.join(out)
+
+
+def contents(directory):
+    result = {}
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name)) as f:
+            result[name] = f.read()
+    return result
+
+
+@pytest.mark.parametrize('workers', [None, 4])
+def test_transaction_commits_all_files(tmp_path, workers, monkeypatch):
+    """Test that all files are patched when every file can be patched"""
+    monkeypatch.chdir(str(tmp_path))
+    text = make_files(str(tmp_path), 10)
+
+    assert patch.fromstring(text).apply(transactional=True, workers=workers)
+    assert contents(str(tmp_path)) == dict(('file_%d.py' % n, 'def f():\n    return %d\n' % (n * 10))
+                                           for n in range(10))
+
+
+@pytest.mark.parametrize('workers', [None, 4])
+def test_transaction_changes_nothing_on_error(tmp_path, workers, monkeypatch):
+    """Test that no file is changed if one of them can't be patched"""
+    monkeypatch.chdir(str(tmp_path))
+    text = make_files(str(tmp_path), 10)
+    with open('file_7.py', 'w') as f:
+        f.write('something else\n')
+    before = contents(str(tmp_path))
+
+    assert not patch.fromstring(text).apply(transactional=True, workers=workers)
+    assert contents(str(tmp_path)) == before
+
+
+def test_transaction_rolls_back_failed_rename(tmp_path, monkeypatch):
+    """Test that replaced files are restored when a rename fails"""
+    monkeypatch.chdir(str(tmp_path))
+    text = make_files(str(tmp_path), 5)
+    before = contents(str(tmp_path))
+    replace = os.replace
+    calls = []
+
+    def failing_replace(src, dst):
+        calls.append(dst)
+        if len(calls) == 3:
+            raise OSError('device busy')
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+
+    assert not patch.fromstring(text).apply(transactional=True)
+    assert contents(str(tmp_path)) == before
+
+
+def test_transaction_patches_same_file_twice(temp_module, test_data_dir, monkeypatch):
+    """Test that later patches for a file see the staged content"""
+    _, module_dir = temp_module
+    monkeypatch.chdir(module_dir)
+
+    # sample.patch changes example.py twice, second time it is already patched
+    assert patch.fromfile(os.path.join(test_data_dir, 'sample.patch')).apply(transactional=True)
+    with open('example.py') as f:
+        assert 'return "Hello, Patched World!"' in f.read()
@@ -0,0 +1,58 @@
+from io import BytesIO, StringIO
+
+import pytest
+
+from pypatch_url import patch
+
+
+TEXT = ''.join('--- f%d.py\r\n+++ f%d.py\r\n@@ -1 +1 @@\r\n-é%d\r\n+ü%d\r\n' % (n, n, n, n) for n in range(50))
+
+
+class Response(object):
+    """Binary response that records how much of it was read"""
+
+    def __init__(self, data):
+        self.stream = BytesIO(data)
+        self.size = len(data)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    @property
+    def position(self):
+        return self.stream.tell()
+
+
+@pytest.mark.parametrize('size', [1, 2, 7, 1 << 16])
+@pytest.mark.parametrize('encoding', ['utf-8', 'latin-1'])
+def test_decoded_lines(size, encoding):
+    """Test that lines are the same as lines of StringIO"""
+    text = TEXT + 'no newline ü'
+    lines = list(patch._decodedlines(BytesIO(text.encode(encoding)), encoding, size))
+    assert lines == StringIO(text).readlines()
+    assert list(patch._decodedlines(StringIO(text), encoding, size)) == lines
+
+
+def test_invalid_bytes_are_replaced():
+    """Test that invalid bytes are decoded as replacement characters"""
+    assert list(patch._decodedlines(BytesIO(b'a\xff\nb'), 'utf-8', 1)) == ['a�\n', 'b']
+
+
+def test_fromurl_parses_while_downloading(monkeypatch):
+    """Test that streamed patches from URLs are parsed before the whole response is read"""
+    response = Response((TEXT * 100).encode('utf-8'))
+    monkeypatch.setattr('urllib.request.urlopen', lambda url: response)
+
+    patchset = patch.fromurl('http://example.com/big.patch', stream=True)
+    first = next(iter(patchset))
+    assert [h.text for h in first.hunks] == [['-é0\r\n', '+ü0\r\n']]
+    assert response.position <= 1 << 16 < response.size
+
+
+def test_fromurl_matches_fromstring(monkeypatch):
+    """Test that parsing a response gives the same patches as the text"""
+    monkeypatch.setattr('urllib.request.urlopen', lambda url: Response(TEXT.encode('utf-8')))
+    expected = patch.fromstring(TEXT)
+    result = patch.fromurl('http://example.com/big.patch')
+    assert [(p.target, [h.text for h in p.hunks]) for p in result.items] == \
+        [(p.target, [h.text for h in p.hunks]) for p in expected.items]
@@ -56,7 +56,9 @@ def test_url_download(temp_module, monkeypatch):
 
     # In pytest, we can directly monkeypatch the module
     # This will properly handle cleanup automatically
-    monkeypatch.setattr('six.moves.urllib.request.urlopen', mock_urlopen)
+    monkeypatch.setattr('urllib.request.urlopen', mock_urlopen)
+    monkeypatch.setattr('pypatch_url.fetch.ConnectionPool.urlopen',
+                        lambda self, request, timeout=None: mock_urlopen(request))
 
     # Mock sys.path to include our test module
     original_path = sys.path.copy()